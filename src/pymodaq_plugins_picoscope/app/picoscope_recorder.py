@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Headless high-rate recorder of a Picoscope 4000a streaming, without the DAQ_Viewer loop
+
+python -m pymodaq_plugins_picoscope.app.picoscope_recorder --sampling 10 --duration 60 --directory D:/data
+
+@author: dqml-lab
+"""
+import argparse
+
+from pymodaq_plugins_picoscope.hardware.Picoscope4000a_wrapper import Picoscope_Wrapper, CHANNEL_INPUT_RANGES_MV
+from pymodaq_plugins_picoscope.hardware.stream_recorder import StreamRecorder, WRITERS
+
+
+def print_stats(stats):
+    print(f"{stats['elapsed']:8.1f} s | acquired {stats['acquiredMSs']:7.2f} MS/s | written {stats['recordedMSs']:7.2f} MS/s | "
+          f"buffer {stats['bufferedMB']:7.1f} MB (high-water {stats['highWaterMB']:.1f} MB, {stats['highWaterChunks']} chunks) | "
+          f"dropped {stats['droppedSamples']} samples | {stats['files']} files")
+
+
+def record(serial=None, sampling=10., duration=10., directory='.', fileFormat='h5', fileSamples=50e6,
+           bufferMB=256., driverBuffer=1_000_000, reportPeriod=1., preview=True):
+    """ Stream channels A and B to rotating files for duration (s, None until Ctrl+C) at sampling (MHz)
+
+    preview adds the min/max preview pyramid to each h5 file when it is closed. Returns the final stats of the
+    StreamRecorder.
+    """
+    scope = Picoscope_Wrapper(aquire_time=1e-3, sampling_freq=sampling, serial=serial)
+    scaleA, scaleB = scope.get_channel_scales()
+    metadata = dict(serial=str(scope.serial), scale_A_mV=scaleA, scale_B_mV=scaleB,
+                    range_A_mV=float(CHANNEL_INPUT_RANGES_MV[scope.chARange]), range_B_mV=float(CHANNEL_INPUT_RANGES_MV[scope.chBRange]))
+
+    options = dict(preview=preview) if fileFormat == 'h5' else {}
+    writer = WRITERS[fileFormat](directory, fileSamples=fileSamples, metadata=metadata, **options)
+    recorder = StreamRecorder(scope, writer, maxBufferedBytes=bufferMB * 1e6)
+    recorder.start(driverBuffer)
+    writer.metadata['sample_interval_s'] = scope.streamingInterval
+    print(f"Recording at {1e-6 / scope.streamingInterval:g} MS/s per channel to {writer.directory} ({fileFormat})")
+
+    try:
+        recorder.run(duration, report=print_stats, reportPeriod=reportPeriod)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = recorder.stop()
+        print_stats(stats)
+        for path in writer.files: print(path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the Picoscope 4000a streaming (channels A and B, raw int16) to rotating files")
+    parser.add_argument('--serial', default=None, help="serial number of the unit, the first free one by default")
+    parser.add_argument('--sampling', type=float, default=10., help="sampling frequency per channel (MHz)")
+    parser.add_argument('--duration', type=float, default=None, help="recording duration (s), until Ctrl+C by default")
+    parser.add_argument('--directory', default='.', help="directory of the files")
+    parser.add_argument('--format', choices=list(WRITERS), default='h5', help="h5 files or memory mapped raw .bin files")
+    parser.add_argument('--file-samples', type=float, default=50e6, help="samples per channel in each file before rotating")
+    parser.add_argument('--buffer-mb', type=float, default=256., help="maximum data waiting for the writer (MB)")
+    parser.add_argument('--driver-buffer', type=int, default=1_000_000, help="driver ring buffer (samples per channel)")
+    parser.add_argument('--report', type=float, default=1., help="period of the status lines (s)")
+    parser.add_argument('--no-preview', action='store_true', help="do not add the min/max preview pyramid to the h5 files")
+    args = parser.parse_args()
+
+    record(args.serial, args.sampling, args.duration, args.directory, args.format, args.file_samples,
+           args.buffer_mb, args.driver_buffer, args.report, not args.no_preview)
+
+
+if __name__ == '__main__':
+    main()
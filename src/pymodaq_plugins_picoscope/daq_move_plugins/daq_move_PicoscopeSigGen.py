@@ -0,0 +1,160 @@
+from typing import Union, List, Dict
+
+from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_parameters_fun, main, DataActuatorType,\
+    DataActuator  # common set of parameters for all actuators
+from pymodaq.utils.daq_utils import ThreadCommand # object used to send info back to the main thread
+from pymodaq.utils.parameter import Parameter
+
+from ..hardware.discovery import FIRST_FREE
+from ..hardware.plugin_mixin import PicoscopePluginMixin
+from ..hardware.handle_cache import handle_cache
+from ..hardware.siggen import SigGen, WAVE_TYPES
+
+
+class DAQ_Move_PicoscopeSigGen(PicoscopePluginMixin, DAQ_Move_base):
+    """ Instrument plugin class for the built-in signal generator of a Picoscope 4000a.
+
+    The actuator value is the generator frequency (Hz), so frequency responses can be scanned point by point. A whole
+    frequency response in one hardware sweep is captured by the Sig Gen Sweep mode of DAQ_1DViewer_Picoscope.
+
+    The unit is taken from the handle cache : the actuator and a Picoscope viewer on the same serial number share it.
+
+    Attributes:
+    -----------
+    controller: SigGen
+        The signal generator of the open unit
+    """
+    is_multiaxes = False
+    _axis_names: Union[List[str], Dict[str, int]] = ['Frequency']
+    _controller_units: Union[str, List[str]] = 'Hz'
+    _epsilon: Union[float, List[float]] = 0.01
+    data_actuator_type = DataActuatorType.DataActuator
+
+    params = [
+        {'title':'Serial Number : Need to Reload Actuator if changed !!', 'name':'serial', 'type':'itemselect', 'value':dict(all_items=[FIRST_FREE], selected=[FIRST_FREE])},
+        {'title':'Detect Units', 'name':'detect_units', 'type':'bool_push', 'value':False, 'default':False },
+
+        {'title':'Signal Generator',
+         'name':'siggen_param',
+         'type':'group',
+         'children':[
+             {'title':'Waveform', 'name':'waveform', 'type':'itemselect', 'value':dict(all_items=list(WAVE_TYPES), selected=["Sine"])},
+             {'title':'Amplitude (mV pk-pk)', 'name':'amplitude', 'type':'float', 'value':1000, 'default':1000, 'min':0 },
+             {'title':'Offset (mV)', 'name':'offset', 'type':'float', 'value':0, 'default':0 },
+             {'title':'Output Enabled', 'name':'output', 'type':'led_push', 'value':True, 'default':True } ]
+        } ,
+                ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
+
+    def ini_attributes(self):
+        self.controller: SigGen = None
+        self.serial = None
+        self.detect_units()
+
+    def get_actuator_value(self):
+        """Get the current generator frequency with scaling conversion.
+
+        Returns
+        -------
+        float: The frequency obtained after scaling conversion.
+        """
+        pos = DataActuator(data=self.controller.frequency)
+        pos = self.get_position_with_scaling(pos)
+        return pos
+
+    def close(self):
+        """Switch the output off and give the unit back to the handle cache"""
+        if self.controller is not None and self.is_master:
+            self.controller.set_builtin(enabled=False)
+            handle_cache.release(self.serial)
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the detector settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within detector_settings) whose value has been changed by the user
+        """
+        if param.name() == "detect_units":
+            self.detect_units(refresh=True)
+
+        elif param.name() in ["waveform", "amplitude", "offset", "output"] and self.controller is not None:
+            self.set_waveform()
+
+    def set_waveform(self):
+        """Apply the signal generator settings, at the current frequency"""
+        self.controller.set_builtin( waveType = WAVE_TYPES[ self.settings.child('siggen_param', 'waveform').value()['selected'][0] ],
+                                     pkToPk = self.settings.child('siggen_param', 'amplitude').value(),
+                                     offset = self.settings.child('siggen_param', 'offset').value(),
+                                     enabled = self.settings.child('siggen_param', 'output').value() )
+
+    def pico_series(self):
+        """The signal generator plugin only drives 4000a units"""
+        return "Picoscope 4000a"
+
+    def ini_stage(self, controller=None):
+        """Actuator communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator by controller (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+        self.ini_stage_init(slave_controller=controller)  # will be useful when controller is slave
+
+        if self.is_master:  # is needed when controller is master
+            handle, self.serial, reused = handle_cache.acquire(self.selected_serial(), self.report_open_progress)
+            self.controller = SigGen(handle)
+
+        self.set_waveform()
+
+        info = f"Picoscope {self.serial} signal generator"
+        initialized = True
+        return info, initialized
+
+    def move_abs(self, value: DataActuator):
+        """ Set the generator to the absolute frequency defined by value
+
+        Parameters
+        ----------
+        value: (float) value of the absolute target frequency
+        """
+
+        value = self.check_bound(value)  #if user checked bounds, the defined bounds are applied here
+        self.target_value = value
+        value = self.set_position_with_scaling(value)  # apply scaling if the user specified one
+        self.controller.set_frequency(value.value())
+        self.emit_status(ThreadCommand('Update_Status', [f'Signal generator at {value.value():g} Hz']))
+
+    def move_rel(self, value: DataActuator):
+        """ Shift the generator frequency by value
+
+        Parameters
+        ----------
+        value: (float) value of the relative frequency step
+        """
+        value = self.check_bound(self.current_position + value) - self.current_position
+        self.target_value = value + self.current_position
+        value = self.set_position_relative_with_scaling(value)
+
+        self.controller.set_frequency(self.controller.frequency + value.value())
+        self.emit_status(ThreadCommand('Update_Status', [f'Signal generator at {self.controller.frequency:g} Hz']))
+
+    def move_home(self):
+        """The generator has no reference position, the frequency is kept"""
+        self.emit_status(ThreadCommand('Update_Status', ['No home for the signal generator, frequency unchanged']))
+        self.move_done()
+
+    def stop_motion(self):
+      """Frequency changes are immediate, nothing to stop"""
+      self.move_done()
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -0,0 +1,311 @@
+import numpy as np
+from pymodaq.utils.daq_utils import ThreadCommand
+from pymodaq.utils.data import DataFromPlugins, DataToExport
+from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
+from pymodaq.utils.parameter import Parameter
+
+from ...hardware.Picoscope4000_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000
+from ...hardware.Picoscope4000a_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000a
+from ...hardware.discovery import FIRST_FREE
+from ...hardware.profiles import profile_names
+from ...hardware.plugin_mixin import PicoscopePluginMixin
+from ...hardware.measurements import MEASUREMENTS, channel_measurements
+from ...hardware.lockin import fixed_width_nd_bd
+
+
+COUNTER_RANGES = {"20 Hz":2, "200 Hz":3, "2 kHz":0, "20 kHz":1}  # PS4000A_FREQUENCY_COUNTER_RANGE
+
+
+class DAQ_0DViewer_Picoscope(PicoscopePluginMixin, DAQ_Viewer_base):
+    """ Instrument plugin class for a 0D viewer.
+
+    Each grab is reduced to scalars per channel (mean, RMS, peak to peak, min, max, gated integral) and optionally to
+    the lock-in ND_Bd, and only these are emitted. Meant for DAQ_Scan where the full traces are not needed : a scan
+    step saves a few numbers instead of the whole capture.
+
+    Attributes:
+    -----------
+    controller: object
+        The particular object that allow the communication with the hardware, in general a python wrapper around the
+         hardware library.
+
+    """
+
+    params = comon_parameters+[
+        {"title": "Picoscope Series Version",
+         "name": "pico_type",
+         "type": "itemselect",
+         "value": dict(all_items=["Picoscope 4000", "Picoscope 4000a"], selected=["Picoscope 4000a"])
+        } ,
+
+        {'title':'Serial Number : Need to Reload Detector if changed !!', 'name':'serial', 'type':'itemselect', 'value':dict(all_items=[FIRST_FREE], selected=[FIRST_FREE])},
+        {'title':'Detect Units', 'name':'detect_units', 'type':'bool_push', 'value':False, 'default':False },
+
+        {'title':'Aquisition Parameters : Need to Reload Detector if changed !!',
+         'name':'aquisition_param',
+         'type':'group',
+         'children':[
+             {'title':'Aquisition Time (ms)', 'name':'aquisition_time', 'type':'float', 'value':10, 'default':10 },
+             {'title':'Sampling Frequency (MHz)', 'name':'sampling_freq', 'type':'float', 'value':0.2, 'default':0.2 },
+             {'title':'Number of Samples (kS)', 'name':'num_samples', 'type':'float', 'value':2, 'default':2, 'readonly':True },
+             {'title':'Trigger Channel', 'name':'trig_chan', 'type':'itemselect', 'value':dict(all_items=["A", "B", "External"], selected=["B"])},
+             {'title':'Trigger Level (mV)', 'name':'trig_lvl', 'type':'float', 'value':500, 'default':500 } ]
+        } ,
+
+        {'title':'Acquisition Profiles',
+         'name':'profile_param',
+         'type':'group',
+         'children':[
+             {'title':'Profile', 'name':'profile', 'type':'itemselect', 'value':dict(all_items=profile_names(), selected=profile_names()[:1])},
+             {'title':'Apply Profile', 'name':'apply_profile', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'New Profile Name', 'name':'profile_name', 'type':'str', 'value':'', 'default':'' },
+             {'title':'Save Settings as Profile', 'name':'save_profile', 'type':'bool_push', 'value':False, 'default':False } ]
+        } ,
+
+        {'title':'Readout',
+         'name':'readout_param',
+         'type':'group',
+         'children':[
+             {'title':'Overlapped Readout (4000a)', 'name':'overlapped', 'type':'bool', 'value':True, 'default':True },
+             {'title':'Pipelined Acquisition (4000a)', 'name':'pipelined', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Pre-move Captures (Pipelined)', 'name':'premove', 'type':'itemselect', 'value':dict(all_items=["Keep", "Discard"], selected=["Keep"])},
+             {'title':'Settle Time (ms)', 'name':'settle_time', 'type':'float', 'value':0, 'default':0, 'min':0 },
+             {'title':'Discarded Captures', 'name':'discarded', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Grab Duration (ms)', 'name':'grab_duration', 'type':'float', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Measurements',
+         'name':'measurement_param',
+         'type':'group',
+         'children':[
+             {'title':'Measurements', 'name':'measurements', 'type':'itemselect', 'value':dict(all_items=MEASUREMENTS, selected=["Mean", "RMS", "Peak to Peak"])},
+             {'title':'Gate Start (ms)', 'name':'gate_start', 'type':'float', 'value':0, 'default':0, 'min':0 },
+             {'title':'Gate Stop (ms, 0 = End)', 'name':'gate_stop', 'type':'float', 'value':0, 'default':0, 'min':0 },
+             {'title':'Lock In ND_Bd', 'name':'lockin', 'type':'group', 'children':[
+                    {'title':'Compute ND_Bd', 'name':'ND_Bd', 'type':'bool', 'value':False, 'default':False },
+                    {'title':'B Frequency (Hz)', 'name':'B_freq', 'type':'float', 'value':500, 'default':500 },
+                    {'title':'Pulse Frequency (kHz)', 'name':'pulse_freq', 'type':'float', 'value':1, 'default':1 },
+             ]},
+             ]},
+
+        {'title':'Frequency Counter (4000a)',
+         'name':'counter_param',
+         'type':'group',
+         'children':[
+             {'title':'Frequency Counter Mode', 'name':'counter', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Counter Range', 'name':'counter_range', 'type':'itemselect', 'value':dict(all_items=list(COUNTER_RANGES), selected=["2 kHz"])},
+             {'title':'Threshold (mV)', 'name':'counter_threshold', 'type':'float', 'value':0, 'default':0 },
+             {'title':'Hysteresis (mV)', 'name':'counter_hysteresis', 'type':'float', 'value':50, 'default':50, 'min':0 },
+             {'title':'Readings per Grab', 'name':'counter_samples', 'type':'int', 'value':100, 'default':100, 'min':1 },
+             {'title':'Pulse Frequency from Channel', 'name':'pulse_source', 'type':'itemselect', 'value':dict(all_items=["Off", "A", "B"], selected=["Off"])},
+             {'title':'B Frequency from Channel', 'name':'B_source', 'type':'itemselect', 'value':dict(all_items=["Off", "A", "B"], selected=["Off"])},
+             ]},
+
+        ]
+
+
+    # ----- Initialise
+
+    def ini_attributes(self):
+
+        if self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000": self.controller: Picoscope_Wrapper4000 = None
+        elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": self.controller: Picoscope_Wrapper4000a = None
+        self.detect_units()
+
+        # Set all read only values
+        self.settings.child('aquisition_param', 'num_samples').setValue( self.settings.child('aquisition_param', 'sampling_freq').value()*1e6 * self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3 * 1e-3 )
+
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the detector settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within detector_settings) whose value has been changed by the user
+        """
+
+        if param.name() in ["pico_type", "detect_units"]:
+            self.detect_units(refresh = param.name() == "detect_units")
+
+        if param.name() == "apply_profile":
+            self.apply_profile()
+
+        if param.name() == "save_profile":
+            self.save_profile()
+
+        if param.name() in ["counter", "counter_range", "counter_threshold", "counter_hysteresis"] and self.controller is not None:
+            self.set_frequency_counter()
+
+        if param.name() in ["aquisition_time", "sampling_freq"]:
+            sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value()
+            aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()
+            self.settings.child('aquisition_param', 'num_samples').setValue( (sampling_freq*1e6) * (aquire_time*1e-3) * 1e-3 )
+
+        if param.name() == "overlapped" and hasattr(self.controller, 'overlapped'):
+            self.controller.overlapped = param.value()
+
+
+    def set_frequency_counter(self):
+        """Switch the channels of the controller to (or back from) frequency counting"""
+        enabled = self.settings.child('counter_param', 'counter').value()
+        if not hasattr(self.controller, 'set_frequency_counter'):
+            if enabled: self.emit_status(ThreadCommand('Update_Status', ['Frequency counter only available for Picoscope 4000a']))
+            return
+        if not enabled and self.controller.frequencyCounterRange is None: return
+
+        self.controller.set_frequency_counter( enabled = enabled,
+                                               fcRange = COUNTER_RANGES[ self.settings.child('counter_param', 'counter_range').value()['selected'][0] ],
+                                               threshold = self.settings.child('counter_param', 'counter_threshold').value(),
+                                               hysteresis = self.settings.child('counter_param', 'counter_hysteresis').value() )
+
+
+    def grab_frequencies(self):
+        """Emit the counter frequencies of both channels, and fill the lock-in frequencies with them if asked"""
+        frequencies = self.controller.read_frequencies( self.settings.child('counter_param', 'counter_samples').value() )
+        self.settings.child('readout_param', 'grab_duration').setValue( self.controller.lastGrabDuration * 1e3 )
+
+        channel_index = {"A":0, "B":1}
+        pulse_source = self.settings.child('counter_param', 'pulse_source').value()['selected'][0]
+        if pulse_source != "Off": self.settings.child('measurement_param', 'lockin', 'pulse_freq').setValue( frequencies[channel_index[pulse_source]] * 1e-3 )
+        B_source = self.settings.child('counter_param', 'B_source').value()['selected'][0]
+        if B_source != "Off": self.settings.child('measurement_param', 'lockin', 'B_freq').setValue( frequencies[channel_index[B_source]] )
+
+        data = DataToExport('Picoscope', data=[ DataFromPlugins(name='Frequency', data=[ np.array([frequency]) for frequency in frequencies ], dim='Data0D',
+                                                                labels=['Channel A Frequency (Hz)', 'Channel B Frequency (Hz)'], do_plot=True) ])
+        self.dte_signal.emit(data)
+
+
+    def ini_detector(self, controller=None):
+        """Detector communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator/detector by controller
+            (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+
+        # Define Trigger Channel
+        trigger_channel_number_dic = {"A":0, "B":1, "External":9}
+        trigger_channel_number = trigger_channel_number_dic [self.settings.child('aquisition_param', 'trig_chan').value()['selected'][0] ]
+
+        if (trigger_channel_number==9) and (self.pico_series() == "Picoscope 4000a"):
+            info = "External trigger channel not available for Picoscope 4000a"
+            self.emit_status(ThreadCommand('Update_Status', [info]))
+            return info, False
+
+        if self.pico_series() == "Picoscope 4000":
+            self.controller = Picoscope_Wrapper4000(
+                                                aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
+                                                sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
+                                                trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
+                                                trigger_chan = trigger_channel_number,
+                                                serial = self.selected_serial()
+                                                )
+        elif self.pico_series() == "Picoscope 4000a":
+            self.controller = Picoscope_Wrapper4000a(
+                                                aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
+                                                sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
+                                                trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
+                                                trigger_chan = trigger_channel_number,
+                                                serial = self.selected_serial(),
+                                                progress = self.report_open_progress
+                                                )
+        else:
+            info = f"Unknown Picoscope series {self.pico_series()}"
+            self.emit_status(ThreadCommand('Update_Status', [info]))
+            return info, False
+
+        if hasattr(self.controller, 'overlapped'): self.controller.overlapped = self.settings.child('readout_param', 'overlapped').value()
+        if self.settings.child('counter_param', 'counter').value(): self.set_frequency_counter()
+
+        info = "Log info on Picoscope initialisation : Not coded Yet"
+        return info, True
+
+
+    def close(self):
+        """Terminate the communication protocol"""
+        if self.controller is not None: self.controller.__del__()
+
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """Start a grab from the detector
+
+        Parameters
+        ----------
+        Naverage: int
+            Number of hardware averaging (if hardware averaging is possible, self.hardware_averaging should be set to
+            True in class preamble and you should code this implementation)
+        kwargs: dict
+            others optionals arguments
+        """
+        if self.settings.child('counter_param', 'counter').value() and hasattr(self.controller, 'read_frequencies'):
+            # No waveform transferred, only the frequencies measured by the scope
+            self.grab_frequencies()
+            return
+
+        # Keep the int16 ADC counts when the controller gives them, only the scalars are scaled
+        raw = hasattr(self.controller, 'get_channel_scales')
+        scales = self.controller.get_channel_scales() if raw else [1., 1.]
+
+        if self.settings.child('readout_param', 'pipelined').value() and hasattr(self.controller, 'start_a_pipelined_grab'):
+            time, channels = self.controller.start_a_pipelined_grab(raw=raw, settleTime=self.settle_time())
+            self.settings.child('readout_param', 'discarded').setValue( self.controller.discardedCaptures )
+        else:
+            time, channels = self.controller.start_a_grab_snap(raw=True) if raw else self.controller.start_a_grab_snap()
+
+        if getattr(self.controller, 'lastGrabDuration', None) is not None:
+            self.settings.child('readout_param', 'grab_duration').setValue( self.controller.lastGrabDuration * 1e3 )
+
+        self.process_and_show_data(time, channels, scales)
+
+
+    def process_and_show_data(self, time, channels, scales=(1., 1.)):
+            dt = time[1] - time[0]
+
+            # Gate in samples
+            gate_start = int(round(self.settings.child('measurement_param', 'gate_start').value() * 1e-3 / dt))
+            gate_stop = self.settings.child('measurement_param', 'gate_stop').value()
+            gate = slice(gate_start, int(round(gate_stop * 1e-3 / dt)) if gate_stop > 0 else None)
+
+            measurements = channel_measurements(channels, scales, dt, gate)
+
+            data_to_export = []
+            for name in self.settings.child('measurement_param', 'measurements').value()['selected']:
+                data_to_export.append( DataFromPlugins(name=name, data=[ np.array([value]) for value in measurements[name] ], dim='Data0D',
+                                                       labels=[f'Channel A {name}', f'Channel B {name}'], do_plot=True) )
+
+            if self.settings.child('measurement_param', 'lockin', 'ND_Bd').value():
+                aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()
+                number_of_pulses = int(aquire_time * self.settings.child('measurement_param', 'lockin', 'pulse_freq').value())
+                number_of_B = int(aquire_time * self.settings.child('measurement_param', 'lockin', 'B_freq').value() * 1e-3 * 2)
+                try:
+                    ND_Bd = fixed_width_nd_bd(channels, number_of_pulses, number_of_B, scales)
+                    data_to_export.append( DataFromPlugins(name='ND_Bd', data=[ np.array([ND_Bd]) ], dim='Data0D', labels=['ND_Bd'], do_plot=True) )
+                except ValueError:
+                    self.emit_status(ThreadCommand('Update_Status', ['Aquisition too short for two B steps of at least one pulse, ND_Bd skipped']))
+
+            data = DataToExport('Picoscope', data=data_to_export)
+
+            self.dte_signal.emit(data)
+
+
+    def stop(self):
+        """Stop the current grab hardware wise if necessary"""
+        if getattr(self.controller, 'pipelineRunning', False):
+            self.controller.stop_pipeline()
+            self.emit_status(ThreadCommand('Update_Status', ['Pipelined acquisition stopped']))
+        return ''
+
+
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -1,3 +1,5 @@
+from time import perf_counter, sleep
+
 import numpy as np
 from pymodaq.utils.daq_utils import ThreadCommand
 from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport
@@ -6,9 +8,15 @@ from pymodaq.utils.parameter import Parameter
 
 from ...hardware.Picoscope4000_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000
 from ...hardware.Picoscope4000a_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000a
+from ...hardware.discovery import FIRST_FREE
+from ...hardware.profiles import profile_names
+from ...hardware.plugin_mixin import PicoscopePluginMixin
+from ...hardware.capture_history import CaptureHistory
+from ...hardware.siggen import WAVE_TYPES
+from ...hardware.stream_trigger import StreamTrigger, RISING, FALLING
 
 
-class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
+class DAQ_1DViewer_Picoscope(PicoscopePluginMixin, DAQ_Viewer_base):
     """ Instrument plugin class for a 1D viewer.
     
     This object inherits all functionalities to communicate with PyMoDAQ’s DAQ_Viewer module through inheritance via
@@ -29,6 +37,9 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
          "value": dict(all_items=["Picoscope 4000", "Picoscope 4000a"], selected=["Picoscope 4000a"])
         } ,
 
+        {'title':'Serial Number : Need to Reload Detector if changed !!', 'name':'serial', 'type':'itemselect', 'value':dict(all_items=[FIRST_FREE], selected=[FIRST_FREE])},
+        {'title':'Detect Units', 'name':'detect_units', 'type':'bool_push', 'value':False, 'default':False },
+
         {'title':'Aquisition Parameters : Need to Reload Detector if changed !!',
          'name':'aquisition_param',
          'type':'group',
@@ -40,6 +51,107 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
              {'title':'Trigger Level (mV)', 'name':'trig_lvl', 'type':'float', 'value':500, 'default':500 } ]
         } ,
 
+        {'title':'Acquisition Profiles',
+         'name':'profile_param',
+         'type':'group',
+         'children':[
+             {'title':'Profile', 'name':'profile', 'type':'itemselect', 'value':dict(all_items=profile_names(), selected=profile_names()[:1])},
+             {'title':'Apply Profile', 'name':'apply_profile', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'New Profile Name', 'name':'profile_name', 'type':'str', 'value':'', 'default':'' },
+             {'title':'Save Settings as Profile', 'name':'save_profile', 'type':'bool_push', 'value':False, 'default':False } ]
+        } ,
+
+        {'title':'Readout',
+         'name':'readout_param',
+         'type':'group',
+         'children':[
+             {'title':'Overlapped Readout (4000a)', 'name':'overlapped', 'type':'bool', 'value':True, 'default':True },
+             {'title':'Grab Duration (ms)', 'name':'grab_duration', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Measure Overlapped Gain', 'name':'measure_gain', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'Saved per Grab (ms)', 'name':'saved_per_grab', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Pipelined Acquisition (4000a)', 'name':'pipelined', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Pre-move Captures (Pipelined)', 'name':'premove', 'type':'itemselect', 'value':dict(all_items=["Keep", "Discard"], selected=["Keep"])},
+             {'title':'Settle Time (ms)', 'name':'settle_time', 'type':'float', 'value':0, 'default':0, 'min':0 },
+             {'title':'Discarded Captures', 'name':'discarded', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Duty Cycle (%)', 'name':'duty_cycle', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Acquisition Worker (4000a)', 'name':'worker', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Worker Policy', 'name':'worker_policy', 'type':'itemselect', 'value':dict(all_items=["Block (Saving)", "Latest Only (Display)"], selected=["Block (Saving)"])},
+             {'title':'Worker Queue Depth', 'name':'worker_depth', 'type':'int', 'value':4, 'default':4, 'min':1 },
+             {'title':'Queued Captures', 'name':'worker_queued', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Dropped Captures', 'name':'worker_dropped', 'type':'int', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Segment Plan (4000a)',
+         'name':'segment_param',
+         'type':'group',
+         'children':[
+             {'title':'Rapid Block Averaging', 'name':'segment_average', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Trigger Rate (kHz)', 'name':'trigger_rate', 'type':'float', 'value':1, 'default':1, 'min':0 },
+             {'title':'Max Readout Period (ms)', 'name':'readout_period', 'type':'float', 'value':100, 'default':100, 'min':0 },
+             {'title':'Segments per Readout', 'name':'segments', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Samples per Segment', 'name':'segment_samples', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Device Max Segments', 'name':'max_segments', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Transfer Size (kB)', 'name':'transfer_size', 'type':'float', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Sig Gen Sweep (4000a, Frequency Response)',
+         'name':'sweep_param',
+         'type':'group',
+         'children':[
+             {'title':'Sig Gen Sweep Mode', 'name':'sweep', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Start Frequency (Hz)', 'name':'start_freq', 'type':'float', 'value':100, 'default':100, 'min':0 },
+             {'title':'Stop Frequency (Hz)', 'name':'stop_freq', 'type':'float', 'value':10000, 'default':10000, 'min':0 },
+             {'title':'Steps', 'name':'sweep_steps', 'type':'int', 'value':50, 'default':50, 'min':1 },
+             {'title':'Dwell Time per Step (ms)', 'name':'dwell_time', 'type':'float', 'value':1, 'default':1, 'min':0 },
+             {'title':'Waveform', 'name':'waveform', 'type':'itemselect', 'value':dict(all_items=list(WAVE_TYPES), selected=["Sine"])},
+             {'title':'Amplitude (mV pk-pk)', 'name':'amplitude', 'type':'float', 'value':1000, 'default':1000, 'min':0 },
+             {'title':'Offset (mV)', 'name':'offset', 'type':'float', 'value':0, 'default':0 } ]
+        } ,
+
+        {'title':'Triggered Streaming (4000a, no re-arm dead time)',
+         'name':'stream_trigger_param',
+         'type':'group',
+         'children':[
+             {'title':'Triggered Streaming Mode', 'name':'stream_trigger', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Trigger Source', 'name':'stream_source', 'type':'itemselect', 'value':dict(all_items=["Software (Continuous)", "Driver (Auto-Stop)"], selected=["Software (Continuous)"])},
+             {'title':'Software Trigger Channel', 'name':'stream_channel', 'type':'itemselect', 'value':dict(all_items=["A", "B"], selected=["B"])},
+             {'title':'Software Trigger Level (mV)', 'name':'stream_level', 'type':'float', 'value':500, 'default':500 },
+             {'title':'Software Trigger Edge', 'name':'stream_edge', 'type':'itemselect', 'value':dict(all_items=["Rising", "Falling"], selected=["Rising"])},
+             {'title':'Pre-Trigger Samples', 'name':'pre_samples', 'type':'int', 'value':100, 'default':100, 'min':0 },
+             {'title':'Post-Trigger Samples', 'name':'post_samples', 'type':'int', 'value':1000, 'default':1000, 'min':1 },
+             {'title':'Holdoff (samples)', 'name':'holdoff', 'type':'int', 'value':0, 'default':0, 'min':0 },
+             {'title':'Streaming Buffer (kS)', 'name':'stream_buffer', 'type':'float', 'value':1000, 'default':1000, 'min':1 },
+             {'title':'Ring Buffer (MS)', 'name':'ring_size', 'type':'float', 'value':4, 'default':4, 'min':0.001 },
+             {'title':'Max Windows per Grab', 'name':'max_windows', 'type':'int', 'value':100, 'default':100, 'min':1 },
+             {'title':'Grab Timeout (s)', 'name':'stream_timeout', 'type':'float', 'value':1, 'default':1, 'min':0.01 },
+             {'title':'Events', 'name':'events', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Windows Emitted', 'name':'emitted', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Missed Events', 'name':'missed', 'type':'int', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Capture History (4000a)',
+         'name':'history_param',
+         'type':'group',
+         'children':[
+             {'title':'History Depth (0 = Off)', 'name':'history_depth', 'type':'int', 'value':0, 'default':0, 'min':0 },
+             {'title':'Captures in History', 'name':'history_count', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Clear History', 'name':'clear_history', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'Show Average', 'name':'show_average', 'type':'led_push', 'value':True, 'default':True },
+             {'title':'Show Min/Max Envelope', 'name':'show_envelope', 'type':'led_push', 'value':False, 'default':False },
+             {'title':'Show Persistence', 'name':'show_persistence', 'type':'led_push', 'value':False, 'default':False },
+             {'title':'Persistence Amplitude Bins', 'name':'persistence_bins', 'type':'int', 'value':256, 'default':256, 'min':2, 'max':65536 } ]
+        } ,
+
+        {'title':'Equivalent Time Sampling (4000a, repetitive signals only)',
+         'name':'ets_param',
+         'type':'group',
+         'children':[
+             {'title':'ETS Mode', 'name':'ets_mode', 'type':'itemselect', 'value':dict(all_items=["Off", "Fast", "Slow"], selected=["Off"])},
+             {'title':'ETS Cycles', 'name':'ets_cycles', 'type':'int', 'value':20, 'default':20, 'min':1 },
+             {'title':'ETS Interleave', 'name':'ets_interleave', 'type':'int', 'value':4, 'default':4, 'min':1 },
+             {'title':'ETS Step Size (ps)', 'name':'ets_step', 'type':'int', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
         ]
 
 
@@ -49,9 +161,13 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
 
         if self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000": self.controller: Picoscope_Wrapper4000 = None
         elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": self.controller: Picoscope_Wrapper4000a = None
+        self.detect_units()
         
         self.x_axis = None
         self.pico = None
+        self.history: CaptureHistory = None
+        self.segment_plan = None
+        self.stream_trigger: StreamTrigger = None
 
         # Set all read only values
         self.settings.child('aquisition_param', 'num_samples').setValue( self.settings.child('aquisition_param', 'sampling_freq').value()*1e6 * self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3 * 1e-3 )
@@ -67,6 +183,15 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
         """
 
         print("Commit setting : ", param)
+        if param.name() in ["pico_type", "detect_units"]:
+            self.detect_units(refresh = param.name() == "detect_units")
+
+        if param.name() == "apply_profile":
+            self.apply_profile()
+
+        if param.name() == "save_profile":
+            self.save_profile()
+
         if param.name() == "aquisition_time":   # TODO: Find a way to set Timebase while initialised
             sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value()
             aquire_time = param.value()
@@ -82,6 +207,208 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
             
             self.settings.child('aquisition_param', 'num_samples').setValue( num_points )
 
+        if param.name() in ["history_depth", "clear_history", "persistence_bins"]:   # Reallocated at the next grab
+            self.history = None
+            self.settings.child('history_param', 'history_count').setValue( 0 )
+
+        if param.name() in ["aquisition_time", "sampling_freq", "segment_average", "trigger_rate", "readout_period", "apply_profile"]:   # Planned again at the next averaged grab
+            self.segment_plan = None
+
+        if param.name() in ["stream_trigger", "stream_source", "stream_channel", "stream_level", "stream_edge", "pre_samples", "post_samples",
+                            "holdoff", "stream_buffer", "ring_size", "apply_profile"]:
+            # Streaming again from scratch at the next grab
+            self.stream_trigger = None
+            if getattr(self.controller, 'streamingRunning', False): self.controller.stop_streaming()
+
+        if param.name() in ["worker", "worker_policy", "worker_depth", "pipelined", "overlapped", "measure_gain", "ets_mode", "ets_cycles", "ets_interleave"]:
+            # The worker owns the scope while it runs, it is restarted at the next grab with the new settings
+            if getattr(self.controller, 'workerRunning', False): self.controller.stop_acquisition_worker()
+
+        if param.name() in ["ets_mode", "ets_cycles", "ets_interleave"] and self.controller is not None:
+            self.set_ets()
+
+        if param.name() == "overlapped" and self.controller is not None:
+            self.set_readout()
+
+        if param.name() == "measure_gain" and self.controller is not None:
+            self.measure_overlapped_gain()
+
+
+    def set_ets(self):
+        """Apply the ETS settings to the controller"""
+        ets_modes = {"Off":0, "Fast":1, "Slow":2}
+        ets_mode = ets_modes[ self.settings.child('ets_param', 'ets_mode').value()['selected'][0] ]
+
+        if not hasattr(self.controller, 'set_ets'):
+            if ets_mode: self.emit_status(ThreadCommand('Update_Status', ['ETS only available for Picoscope 4000a']))
+            return
+
+        self.controller.set_ets( mode = ets_mode,
+                                 etsCycles = self.settings.child('ets_param', 'ets_cycles').value(),
+                                 etsInterleave = self.settings.child('ets_param', 'ets_interleave').value() )
+        self.settings.child('ets_param', 'ets_step').setValue( self.controller.etsSampleTimeps )
+
+
+    def set_readout(self):
+        """Apply the readout settings to the controller"""
+        if hasattr(self.controller, 'overlapped'):
+            self.controller.overlapped = self.settings.child('readout_param', 'overlapped').value()
+
+
+    def start_acquisition_worker(self):
+        """Start the acquisition worker of the controller with the readout settings"""
+        if getattr(self.controller, 'workerError', None) is not None:
+            self.emit_status(ThreadCommand('Update_Status', [f'Acquisition worker stopped on error, restarting : {self.controller.workerError}']))
+        self.controller.start_acquisition_worker( depth = self.settings.child('readout_param', 'worker_depth').value(),
+                                                  latestOnly = self.settings.child('readout_param', 'worker_policy').value()['selected'][0] != "Block (Saving)",
+                                                  pipelined = self.settings.child('readout_param', 'pipelined').value() )
+
+
+    def measure_overlapped_gain(self):
+        """Compare the grab duration with the serial and the overlapped readout"""
+        if not hasattr(self.controller, 'measure_overlapped_gain'):
+            self.emit_status(ThreadCommand('Update_Status', ['Overlapped readout only available for Picoscope 4000a']))
+            return
+
+        serial, overlapped = self.controller.measure_overlapped_gain()
+        self.settings.child('readout_param', 'saved_per_grab').setValue( (serial - overlapped) * 1e3 )
+        self.emit_status(ThreadCommand('Update_Status', [f'Grab duration : {serial*1e3:.3f} ms serial, {overlapped*1e3:.3f} ms overlapped']))
+
+
+    def plan_segments(self):
+        """Plan the rapid block segments averaged in one grab, as many captures as the memory and the readout period allow"""
+        trigger_rate = self.settings.child('segment_param', 'trigger_rate').value() * 1e3
+        self.segment_plan = self.controller.plan_segments( samples = self.controller.maxSamples,
+                                                           triggerRate = trigger_rate if trigger_rate > 0 else None,
+                                                           readoutPeriod = self.settings.child('segment_param', 'readout_period').value() * 1e-3 )
+        self.settings.child('segment_param', 'segments').setValue( self.segment_plan.segments )
+        self.settings.child('segment_param', 'segment_samples').setValue( self.segment_plan.samples )
+        self.settings.child('segment_param', 'max_segments').setValue( self.segment_plan.maxSegments )
+        self.settings.child('segment_param', 'transfer_size').setValue( self.segment_plan.transferBytes * 1e-3 )
+        if self.settings.child('ets_param', 'ets_mode').value()['selected'][0] != "Off":
+            self.emit_status(ThreadCommand('Update_Status', ['ETS is off during rapid block averaging']))
+
+
+    def grab_sweep(self):
+        """Capture one generator sweep, emitted as one 2D dataset per channel (frequency x time) and its RMS response"""
+        sigGen = self.controller.sigGen
+        sigGen.waveType = WAVE_TYPES[ self.settings.child('sweep_param', 'waveform').value()['selected'][0] ]
+        sigGen.pkToPk = self.settings.child('sweep_param', 'amplitude').value()
+        sigGen.offset = self.settings.child('sweep_param', 'offset').value()
+
+        time, frequencies, channels = self.controller.start_a_sweep_snap( startFrequency = self.settings.child('sweep_param', 'start_freq').value(),
+                                                                          stopFrequency = self.settings.child('sweep_param', 'stop_freq').value(),
+                                                                          nSteps = self.settings.child('sweep_param', 'sweep_steps').value(),
+                                                                          dwellTime = self.settings.child('sweep_param', 'dwell_time').value() * 1e-3,
+                                                                          raw = True )
+        self.settings.child('readout_param', 'grab_duration').setValue( self.controller.lastGrabDuration * 1e3 )
+
+        names = ['Channel A', 'Channel B']
+        scales = self.controller.get_channel_scales()
+        data_to_export = [ DataFromPlugins(name=f'Sweep {name[-1]}', data=[ channel * np.float32(scale) ], dim='Data2D', labels=[ name ], do_plot=True,
+                                           axes=[Axis('Frequency', units='Hz', data=frequencies, index=0), Axis('Time', units='s', data=time, index=1)])
+                           for name, channel, scale in zip(names, channels, scales) ]
+
+        # AC RMS of every step, the frequency response itself
+        response = [ np.std(channel, axis=1) * scale for channel, scale in zip(channels, scales) ]
+        data_to_export.append( DataFromPlugins(name='Frequency Response', data=response, dim='Data1D', labels=[ f'{name} RMS' for name in names ], do_plot=True,
+                                               axes=[Axis('Frequency', units='Hz', data=frequencies, index=0)]) )
+
+        self.dte_signal.emit(DataToExport('Picoscope', data=data_to_export))
+
+
+    def grab_triggered_stream(self):
+        """Windows around the software trigger crossings of the continuous streaming, the scope is never re-armed
+
+        Polls the stream until at least one window is complete. Without any event before the timeout, the latest
+        samples are emitted untriggered (as the auto mode of a scope) so the continuous grab goes on.
+        """
+        pre = self.settings.child('stream_trigger_param', 'pre_samples').value()
+        post = self.settings.child('stream_trigger_param', 'post_samples').value()
+        if not self.controller.streamingRunning:
+            self.controller.start_streaming(bufferSize=self.settings.child('stream_trigger_param', 'stream_buffer').value()*1e3)
+        if self.stream_trigger is None:
+            channel = ["A", "B"].index( self.settings.child('stream_trigger_param', 'stream_channel').value()['selected'][0] )
+            scale = self.controller.get_channel_scales()[channel]
+            self.stream_trigger = StreamTrigger( pre, post,
+                                                 level = int(round( self.settings.child('stream_trigger_param', 'stream_level').value() / scale )),
+                                                 channel = channel,
+                                                 direction = RISING if self.settings.child('stream_trigger_param', 'stream_edge').value()['selected'][0] == "Rising" else FALLING,
+                                                 holdoff = self.settings.child('stream_trigger_param', 'holdoff').value(),
+                                                 capacity = self.settings.child('stream_trigger_param', 'ring_size').value()*1e6 )
+
+        windows = []
+        timeout = self.settings.child('stream_trigger_param', 'stream_timeout').value()
+        t_start = perf_counter()
+        while not windows and perf_counter() - t_start < timeout:
+            windows = self.stream_trigger.feed(self.controller.get_streaming_latest())
+            if not windows: sleep(max(post * self.controller.streamingInterval / 4, 1e-3))
+
+        self.settings.child('stream_trigger_param', 'events').setValue( self.stream_trigger.events )
+        self.settings.child('stream_trigger_param', 'emitted').setValue( self.stream_trigger.emitted )
+        self.settings.child('stream_trigger_param', 'missed').setValue( self.stream_trigger.missed )
+
+        if not windows:
+            self.emit_status(ThreadCommand('Update_Status', [f'No trigger event in {timeout:g} s']))
+            latest = self.stream_trigger.total % self.stream_trigger.capacity + self.stream_trigger.capacity
+            self.emit_windows([], self.stream_trigger.ring[:, latest - self.stream_trigger.window:latest], pre)
+            return
+        self.emit_windows(windows[-self.settings.child('stream_trigger_param', 'max_windows').value():], windows[-1][1], pre)
+
+
+    def grab_driver_triggered_stream(self):
+        """One window around the trigger of the unit (Trigger Channel and Level of the acquisition parameters), the
+        driver stops the streaming by itself after it (RunStreaming auto-stop), and it is re-armed at the next grab"""
+        pre = self.settings.child('stream_trigger_param', 'pre_samples').value()
+        post = self.settings.child('stream_trigger_param', 'post_samples').value()
+        self.controller.start_streaming( bufferSize = max(self.settings.child('stream_trigger_param', 'stream_buffer').value()*1e3, pre + post),
+                                         preTriggerSamples = pre, postTriggerSamples = post, autoStop = True )
+
+        chunks = []
+        triggers = []
+        timeout = self.settings.child('stream_trigger_param', 'stream_timeout').value()
+        t_start = perf_counter()
+        while not self.controller.streamingAutoStopped and perf_counter() - t_start < timeout:
+            chunks.append(self.controller.get_streaming_latest())
+            triggers += self.controller.streamingTriggers
+            if not self.controller.streamingAutoStopped: sleep(max((pre + post) * self.controller.streamingInterval / 4, 1e-3))
+        self.controller.stop_streaming()
+
+        stream = np.concatenate([np.asarray(chunk) for chunk in chunks], axis=1) if chunks else np.zeros((2, 0), dtype=np.int16)
+        if not triggers or triggers[0] < pre or triggers[0] + post > stream.shape[1]:
+            self.emit_status(ThreadCommand('Update_Status', [f'No driver trigger in {timeout:g} s']))
+            window = np.zeros((2, pre + post), dtype=np.int16)
+            window[:, :min(stream.shape[1], pre + post)] = stream[:, -(pre + post):]
+            self.emit_windows([], window, pre)
+            return
+        window = stream[:, triggers[0] - pre:triggers[0] + post]
+        self.emit_windows([ (triggers[0], window) ], window, pre)
+
+
+    def emit_windows(self, windows, latest, pre):
+        """Latest window (1D) and the stack of the windows of this grab (2D, event x time), int16 counts scaled to mV"""
+        scales = self.controller.get_channel_scales()
+        names = ['Channel A', 'Channel B']
+        time = (np.arange(latest.shape[1]) - pre) * self.controller.streamingInterval
+
+        data_to_export = [ DataFromPlugins(name='Triggered Window', data=[ latest[channel] * np.float32(scale) for channel, scale in enumerate(scales) ], dim='Data1D',
+                                           labels=names, do_plot=True, axes=[Axis('Time', units='s', data=time, index=0)]) ]
+        if windows:
+            events = np.array([ event for event, window in windows ])
+            for channel, scale in enumerate(scales):
+                stack = np.stack([ window[channel] for event, window in windows ]) * np.float32(scale)
+                data_to_export.append( DataFromPlugins(name=f'Events {names[channel][-1]}', data=[ stack ], dim='Data2D', labels=[ f'{names[channel]} Windows' ], do_plot=True,
+                                                       axes=[Axis('Event Time', units='s', data=events * self.controller.streamingInterval, index=0),
+                                                             Axis('Time', units='s', data=time, index=1)]) )
+
+        self.dte_signal.emit(DataToExport('Picoscope', data=data_to_export))
+
+
+    def profile_applied(self):
+        """Drop the history of the previous configuration"""
+        self.history = None   # Reallocated at the next grab
+        if self.settings.child('ets_param', 'ets_mode').value()['selected'][0] != "Off": self.set_ets()   # ETS is turned off when the buffers are reallocated
+
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -113,7 +440,8 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
                                                     aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
                                                     sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
                                                     trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
-                                                    trigger_chan = trigger_channel_number
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial()
                                                     )  #
             elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": 
                 print("Initialise 4000a")
@@ -121,11 +449,16 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
                                                     aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
                                                     sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
                                                     trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
-                                                    trigger_chan = trigger_channel_number
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial(),
+                                                    progress = self.report_open_progress
                                                     )  #instantiate you driver with whatever arguments are needed
             else: 
                 print("Problem +")
 
+            if self.settings.child('ets_param', 'ets_mode').value()['selected'][0] != "Off": self.set_ets()
+            self.set_readout()
+
             info = "Log info on Picoscope initialisation : Not coded Yet"
             initialized = True
         
@@ -133,14 +466,11 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
         return info, initialized
 
 
-
     def close(self):
         """Terminate the communication protocol"""
         self.controller.__del__()
 
 
-
-
     def grab_data(self, Naverage=1, **kwargs):
         """Start a grab from the detector
 
@@ -153,24 +483,116 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
             others optionals arguments
         """
         ##synchrone version (blocking function)
-        time, channels = self.controller.start_a_grab_snap()
+        if self.settings.child('stream_trigger_param', 'stream_trigger').value():
+            if hasattr(self.controller, 'start_streaming'):
+                if self.settings.child('stream_trigger_param', 'stream_source').value()['selected'][0] == "Driver (Auto-Stop)": self.grab_driver_triggered_stream()
+                else: self.grab_triggered_stream()
+                return
+            self.emit_status(ThreadCommand('Update_Status', ['Triggered streaming only available for Picoscope 4000a']))
+
+        if self.settings.child('sweep_param', 'sweep').value():
+            if hasattr(self.controller, 'start_a_sweep_snap'):
+                self.grab_sweep()
+                return
+            self.emit_status(ThreadCommand('Update_Status', ['Sig Gen sweep only available for Picoscope 4000a']))
+
+        averaged = self.settings.child('segment_param', 'segment_average').value() and hasattr(self.controller, 'plan_segments')
+        if averaged:
+            # All the segments of one readout averaged in a single trace
+            if self.segment_plan is None: self.plan_segments()
+            time, segments, trigger_offsets = self.controller.start_a_rapid_block_snap(self.segment_plan.segments, raw=True, samples=self.segment_plan.samples,
+                                                                                       preTriggerSamples=self.controller.preTriggerSamples)
+            channels = [np.mean(segment, axis=0) for segment in segments]
+        elif self.settings.child('readout_param', 'worker').value() and hasattr(self.controller, 'start_acquisition_worker'):
+            # The scope acquires at its own pace, this only takes the next (or latest) capture of the queue
+            if not self.controller.workerRunning: self.start_acquisition_worker()
+            time, channels = self.controller.get_acquired()
+            self.settings.child('readout_param', 'worker_queued').setValue( self.controller.workerQueue.qsize() )
+            self.settings.child('readout_param', 'worker_dropped').setValue( self.controller.workerDropped )
+        elif self.settings.child('readout_param', 'pipelined').value() and hasattr(self.controller, 'start_a_pipelined_grab'):
+            # The next capture is already running while this one is processed
+            time, channels = self.controller.start_a_pipelined_grab(raw=True, settleTime=self.settle_time())
+            self.settings.child('readout_param', 'discarded').setValue( self.controller.discardedCaptures )
+        elif hasattr(self.controller, 'get_channel_scales'):
+            time, channels = self.controller.start_a_grab_snap(raw=True)
+        else:
+            time, channels = self.controller.start_a_grab_snap()
+
+        if hasattr(self.controller, 'get_channel_scales'):
+            if not averaged: self.update_history(channels)   # The history keeps raw int16 captures
+
+            # int16 counts to mV in one vectorized pass, only for display
+            scaleA, scaleB = self.controller.get_channel_scales()
+            channels = [channels[0] * np.float32(scaleA), channels[1] * np.float32(scaleB)]
+
+        if getattr(self.controller, 'lastGrabDuration', None) is not None:
+            self.settings.child('readout_param', 'grab_duration').setValue( self.controller.lastGrabDuration * 1e3 )
+        if getattr(self.controller, 'dutyCycle', None) is not None:
+            self.settings.child('readout_param', 'duty_cycle').setValue( self.controller.dutyCycle * 1e2 )
 
         self.process_and_show_data(time, channels)
 
 
+    def update_history(self, channels):
+        """Copy the raw int16 capture in the history ring, (re)allocated when its shape changed"""
+        depth = self.settings.child('history_param', 'history_depth').value()
+        if depth == 0:
+            self.history = None
+            return
+
+        if self.history is None or self.history.shape != (len(channels), channels[0].size):
+            self.history = CaptureHistory(depth, len(channels), channels[0].size, nBins=self.settings.child('history_param', 'persistence_bins').value())
+
+        self.history.append(channels)
+        self.settings.child('history_param', 'history_count').setValue( self.history.count )
+
 
     def process_and_show_data(self, time, channels):
             ChannelA = channels[0]
             ChannelB = channels[1]
 
-            dwa1D3 = DataFromPlugins(name='Channel B', data=[ChannelA, ChannelB], dim='Data1D', labels=['Channel A', 'Channel B'], do_plot=True)
+            # In ETS the time axis is the interleaved sample times, not a regular grid
+            dwa1D3 = DataFromPlugins(name='Channel B', data=[ChannelA, ChannelB], dim='Data1D', labels=['Channel A', 'Channel B'], do_plot=True,
+                                     axes=[Axis('Time', units='s', data=time, index=0)])
+
+            data_to_export = [ dwa1D3 ]
+            if self.history is not None: data_to_export += self.history_data(time)
 
-            data = DataToExport('Picoscope', data=[ dwa1D3 ])
+            data = DataToExport('Picoscope', data=data_to_export)
 
             self.dte_signal.emit(data)
     
 
 
+    def history_data(self, time):
+        """Average, envelopes and persistence of the capture history, scaled to mV"""
+        scales = self.controller.get_channel_scales()
+        names = ['Channel A', 'Channel B']
+        data_to_export = []
+
+        curves = []
+        labels = []
+        if self.settings.child('history_param', 'show_average').value():
+            average = self.history.average()
+            curves += [ (average[channel] * scale).astype(np.float32) for channel, scale in enumerate(scales) ]
+            labels += [ f'{name} Average' for name in names ]
+        if self.settings.child('history_param', 'show_envelope').value():
+            minimum, maximum = self.history.envelope()
+            for channel, scale in enumerate(scales):
+                curves += [ minimum[channel] * np.float32(scale), maximum[channel] * np.float32(scale) ]
+                labels += [ f'{names[channel]} Min', f'{names[channel]} Max' ]
+        if curves: data_to_export.append( DataFromPlugins(name='History', data=curves, dim='Data1D', labels=labels, do_plot=True, do_save=False,
+                                                          axes=[Axis('Time', units='s', data=time, index=0)]) )
+
+        if self.settings.child('history_param', 'show_persistence').value():
+            bin_centers = self.history.bin_centers()
+            for channel, scale in enumerate(scales):
+                data_to_export.append( DataFromPlugins(name=f'Persistence {names[channel][-1]}', data=[ self.history.persistence[channel] ], dim='Data2D',
+                                                       labels=[ f'{names[channel]} Persistence' ], do_plot=True, do_save=False,
+                                                       axes=[Axis('Amplitude', units='mV', data=bin_centers * scale, index=0),
+                                                             Axis('Time', units='s', data=time, index=1)]) )
+
+        return data_to_export
 
 
     def callback(self):
@@ -182,11 +604,16 @@ class DAQ_1DViewer_Picoscope(DAQ_Viewer_base):
 
     def stop(self):
         """Stop the current grab hardware wise if necessary"""
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_stop_acquisition()  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
-        ##############################
+        if getattr(self.controller, 'workerRunning', False):
+            self.controller.stop_acquisition_worker()
+            self.emit_status(ThreadCommand('Update_Status', ['Acquisition worker stopped']))
+        if getattr(self.controller, 'pipelineRunning', False):
+            self.controller.stop_pipeline()
+            self.emit_status(ThreadCommand('Update_Status', ['Pipelined acquisition stopped']))
+        if getattr(self.controller, 'streamingRunning', False):
+            self.controller.stop_streaming()
+            self.stream_trigger = None
+            self.emit_status(ThreadCommand('Update_Status', ['Streaming stopped']))
         return ''
 
 
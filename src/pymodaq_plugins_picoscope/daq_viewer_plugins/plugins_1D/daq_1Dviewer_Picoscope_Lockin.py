@@ -1,14 +1,21 @@
 import numpy as np
+import threading
+from time import perf_counter
 from pymodaq.utils.daq_utils import ThreadCommand
 from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
 from pymodaq.utils.parameter import Parameter
 
 from ...hardware.Picoscope4000_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000
-from ...hardware.Picoscope4000a_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000a
+from ...hardware.Picoscope4000a_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000a, RAPID_BLOCK_PRE_TRIGGER_SAMPLES
+from ...hardware.discovery import FIRST_FREE
+from ...hardware.profiles import profile_names
+from ...hardware.plugin_mixin import PicoscopePluginMixin
+from ...hardware.lockin import RunningStatistics, PulseFinder, align_segments, pulse_matrix, fixed_width_pulses, pulse_integrals, nd_bd_cycles
+from ...hardware.processing import ProcessingQueue
 
 
-class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
+class DAQ_1DViewer_Picoscope_Lockin(PicoscopePluginMixin, DAQ_Viewer_base):
     """ Instrument plugin class for a 1D viewer.
     
     This object inherits all functionalities to communicate with PyMoDAQ’s DAQ_Viewer module through inheritance via
@@ -28,6 +35,9 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
          "value": dict(all_items=["Picoscope 4000", "Picoscope 4000a"], selected=["Picoscope 4000a"])
         } ,
 
+        {'title':'Serial Number : Need to Reload Detector if changed !!', 'name':'serial', 'type':'itemselect', 'value':dict(all_items=[FIRST_FREE], selected=[FIRST_FREE])},
+        {'title':'Detect Units', 'name':'detect_units', 'type':'bool_push', 'value':False, 'default':False },
+
         {'title':'Aquisition Parameters : Need to Reload Detector if changed !!',
          'name':'aquisition_param',
          'type':'group',
@@ -39,22 +49,81 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
              {'title':'Trigger Level (mV)', 'name':'trig_lvl', 'type':'float', 'value':500, 'default':500 } 
              ]},
         
+        {'title':'Readout',
+         'name':'readout_param',
+         'type':'group',
+         'children':[
+             {'title':'Overlapped Readout (4000a)', 'name':'overlapped', 'type':'bool', 'value':True, 'default':True },
+             {'title':'Grab Duration (ms)', 'name':'grab_duration', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Measure Overlapped Gain', 'name':'measure_gain', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'Saved per Grab (ms)', 'name':'saved_per_grab', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Pipelined Acquisition (4000a)', 'name':'pipelined', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Pre-move Captures (Pipelined)', 'name':'premove', 'type':'itemselect', 'value':dict(all_items=["Keep", "Discard"], selected=["Keep"])},
+             {'title':'Settle Time (ms)', 'name':'settle_time', 'type':'float', 'value':0, 'default':0, 'min':0 },
+             {'title':'Discarded Captures', 'name':'discarded', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Duty Cycle (%)', 'name':'duty_cycle', 'type':'float', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Segment Plan (4000a, Trigger Time Offsets)',
+         'name':'segment_param',
+         'type':'group',
+         'children':[
+             {'title':'Segments per Readout', 'name':'segments', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Samples per Segment', 'name':'segment_samples', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Device Max Segments', 'name':'max_segments', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Transfer Size (kB)', 'name':'transfer_size', 'type':'float', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        {'title':'Acquisition Profiles',
+         'name':'profile_param',
+         'type':'group',
+         'children':[
+             {'title':'Profile', 'name':'profile', 'type':'itemselect', 'value':dict(all_items=profile_names(), selected=profile_names()[:1])},
+             {'title':'Apply Profile', 'name':'apply_profile', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'New Profile Name', 'name':'profile_name', 'type':'str', 'value':'', 'default':'' },
+             {'title':'Save Settings as Profile', 'name':'save_profile', 'type':'bool_push', 'value':False, 'default':False } ]
+        } ,
+
+        {'title':'Processing',
+         'name':'processing_param',
+         'type':'group',
+         'children':[
+             {'title':'Processing', 'name':'processing_mode', 'type':'itemselect', 'value':dict(all_items=["Synchronous", "Worker Thread"], selected=["Synchronous"])},
+             {'title':'Queue Depth', 'name':'queue_depth', 'type':'int', 'value':2, 'default':2, 'min':1 },
+             {'title':'Queue Policy', 'name':'queue_policy', 'type':'itemselect', 'value':dict(all_items=["Block", "Drop Oldest (Display Only)"], selected=["Block"])},
+             {'title':'Queued Captures', 'name':'queued', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Dropped Captures', 'name':'dropped', 'type':'int', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
         {'title':'Lock In Parameters',
          'name':'lockin_param',
          'type':'group',
          'children':[        
              {'title':'Remove Background ?', 'name':'rmv_bg', 'type':'bool_push', 'value':True, 'default':True },
              {'title':'B Frequency (Hz)', 'name':'B_freq', 'type':'float', 'value':500, 'default':500 },
+             {'title':'Pulse Frequency (kHz)', 'name':'pulse_freq', 'type':'float', 'value':1, 'default':1 },
+             {'title':'Pulse Alignment', 'name':'pulse_align', 'type':'itemselect', 'value':dict(all_items=["Fixed Width", "Trigger Time Offsets", "Reference Edges"], selected=["Fixed Width"])},
+             {'title':'Pulse Finder (Reference Edges)', 'name':'pulse_finder', 'type':'group', 'children':[
+                    {'title':'Edge Threshold (mV)', 'name':'edge_threshold', 'type':'float', 'value':500, 'default':500 },
+                    {'title':'Edge Hysteresis (mV)', 'name':'edge_hysteresis', 'type':'float', 'value':50, 'default':50, 'min':0 },
+                    {'title':'Period Drift Tolerance (%)', 'name':'period_tolerance', 'type':'float', 'value':1, 'default':1, 'min':0 },
+                    {'title':'Detected Pulse Frequency (kHz)', 'name':'detected_freq', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+             ]},
+             {'title':'Reset ND_Bd Statistics', 'name':'reset_stats', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'Grabs in Statistics', 'name':'stats_count', 'type':'int', 'value':0, 'default':0, 'readonly':True },
              ]},
             
         {'title':'Display Parameters',
          'name':'display_param',
          'type':'group',
          'children':[
+             {'title':'PID Output (ND_Bd only, lowest latency)', 'name':'pid_output', 'type':'bool', 'value':False, 'default':False },
+             {'title':'Grab to Output Latency (ms)', 'name':'output_latency', 'type':'float', 'value':0, 'default':0, 'readonly':True },
              {'title':'Lockin Display', 'name':'lockin_display', 'type':'group', 'children':[                   
                     {'title':'Raw Trace', 'name':'pulse_train', 'type':'led_push', 'value':False, 'default':False},
                     {'title': 'Integrated Pulse Train', 'name': 'pulse_train_int', 'type': 'led_push', 'value': False, 'default': False},
                     {'title': 'ND_Bd', 'name': 'ND_Bd', 'type': 'led_push', 'value': True, 'default': True},
+                    {'title': 'ND_Bd Statistics', 'name': 'ND_Bd_stats', 'type': 'led_push', 'value': True, 'default': True},
             ]},
 
          ]},
@@ -62,13 +131,10 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
         ]
 
 
-
-
-
-
     def ini_attributes(self):
         if self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000": self.controller: Picoscope_Wrapper4000 = None
         elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": self.controller: Picoscope_Wrapper4000a = None
+        self.detect_units()
         
         self.x_axis = None
         self.pico = None
@@ -77,6 +143,13 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
         self.settings.child('aquisition_param', 'num_samples').setValue( self.settings.child('aquisition_param', 'sampling_freq').value()*1e6 * self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3 * 1e-3 )
         self.x_axis = None
         self.pico = None
+        self.ND_Bd_stats = RunningStatistics()
+        self.segment_plan = None
+        self.processing: ProcessingQueue = None
+        self.lockin_lock = threading.Lock()   # pulse_finder and ND_Bd_stats are used by the processing worker too
+        self.pulse_finder = PulseFinder(threshold = self.settings.child('lockin_param', 'pulse_finder', 'edge_threshold').value(),
+                                        hysteresis = self.settings.child('lockin_param', 'pulse_finder', 'edge_hysteresis').value(),
+                                        tolerance = self.settings.child('lockin_param', 'pulse_finder', 'period_tolerance').value() * 1e-2)
 
         # Set all read only values
         self.settings.child('aquisition_param', 'num_samples').setValue( self.settings.child('aquisition_param', 'sampling_freq').value()*1e6 * self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3 * 1e-3 )
@@ -91,6 +164,15 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
         """
 
         print("Commit setting : ", param)
+        if param.name() in ["pico_type", "detect_units"]:
+            self.detect_units(refresh = param.name() == "detect_units")
+
+        if param.name() == "apply_profile":
+            self.apply_profile()
+
+        if param.name() == "save_profile":
+            self.save_profile()
+
         if param.name() == "aquisition_time":   # TODO: Find a way to set Timebase while initialised
             sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value()
             aquire_time = param.value()
@@ -106,6 +188,81 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
             
             self.settings.child('aquisition_param', 'num_samples').setValue( num_points )
 
+        if param.name() == "overlapped" and self.controller is not None:
+            self.set_readout()
+
+        if param.name() == "measure_gain" and self.controller is not None:
+            self.measure_overlapped_gain()
+
+        if param.name() in ["edge_threshold", "edge_hysteresis", "period_tolerance"]:
+            with self.lockin_lock:
+                self.pulse_finder.threshold = self.settings.child('lockin_param', 'pulse_finder', 'edge_threshold').value()
+                self.pulse_finder.hysteresis = self.settings.child('lockin_param', 'pulse_finder', 'edge_hysteresis').value()
+                self.pulse_finder.tolerance = self.settings.child('lockin_param', 'pulse_finder', 'period_tolerance').value() * 1e-2
+                self.pulse_finder.reset()
+
+        if param.name() in ["processing_mode", "queue_depth", "queue_policy"] and self.processing is not None:   # Rebuilt at the next grab
+            self.processing.shutdown()
+            self.processing = None
+
+        if param.name() in ["aquisition_time", "sampling_freq", "pulse_freq", "pulse_align", "apply_profile"]:   # Planned again at the next rapid block grab
+            self.segment_plan = None
+
+        if param.name() in ["reset_stats", "B_freq", "rmv_bg", "pulse_align", "pulse_freq"]:   # Running statistics are only meaningful for fixed settings
+            with self.lockin_lock: self.ND_Bd_stats.reset()
+            self.settings.child('lockin_param', 'stats_count').setValue( 0 )
+
+    def set_readout(self):
+        """Apply the readout settings to the controller"""
+        if hasattr(self.controller, 'overlapped'):
+            self.controller.overlapped = self.settings.child('readout_param', 'overlapped').value()
+
+
+    def measure_overlapped_gain(self):
+        """Compare the grab duration with the serial and the overlapped readout"""
+        if not hasattr(self.controller, 'measure_overlapped_gain'):
+            self.emit_status(ThreadCommand('Update_Status', ['Overlapped readout only available for Picoscope 4000a']))
+            return
+
+        serial, overlapped = self.controller.measure_overlapped_gain()
+        self.settings.child('readout_param', 'saved_per_grab').setValue( (serial - overlapped) * 1e3 )
+        self.emit_status(ThreadCommand('Update_Status', [f'Grab duration : {serial*1e3:.3f} ms serial, {overlapped*1e3:.3f} ms overlapped']))
+
+
+    def profile_applied(self):
+        """Drop the processing and statistics of the previous configuration"""
+        if self.processing is not None:   # Rebuilt at the next grab, with the processing mode of the profile
+            self.processing.shutdown()
+            self.processing = None
+        with self.lockin_lock: self.ND_Bd_stats.reset()
+        self.settings.child('lockin_param', 'stats_count').setValue( 0 )
+
+
+    def plan_segments(self):
+        """Plan the rapid block segments, one per pulse, for the pulses expected during the aquisition time
+
+        Each segment is shorter than the pulse period by the re-arm time, so that consecutive pulses are all captured
+        """
+        pulse_frequency = self.settings.child('lockin_param', 'pulse_freq').value()        # kHz
+        aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()   # ms
+
+        self.segment_plan = self.controller.plan_segments( samples = self.controller.segment_samples(1e-3 / pulse_frequency),
+                                                           triggerRate = pulse_frequency * 1e3,
+                                                           readoutPeriod = aquire_time * 1e-3 )
+        self.settings.child('segment_param', 'segments').setValue( self.segment_plan.segments )
+        self.settings.child('segment_param', 'segment_samples').setValue( self.segment_plan.samples )
+        self.settings.child('segment_param', 'max_segments').setValue( self.segment_plan.maxSegments )
+        self.settings.child('segment_param', 'transfer_size').setValue( self.segment_plan.transferBytes * 1e-3 )
+        if self.segment_plan.segments < int(aquire_time * pulse_frequency):
+            self.emit_status(ThreadCommand('Update_Status', [f'Memory limited to {self.segment_plan.segments} pulses per readout']))
+
+        # ND_Bd needs a B step of each sign
+        B_frequency = self.settings.child('lockin_param', 'B_freq').value() * 1e-3 * 2   # kHz, steps
+        pulses_per_B = max(int(pulse_frequency / B_frequency), 1)
+        if self.segment_plan.segments < 2 * pulses_per_B:
+            self.emit_status(ThreadCommand('Update_Status', [f'{self.segment_plan.segments} pulses per readout, two B steps need {2 * pulses_per_B} : raise the B frequency or lower the sampling frequency']))
+
+
     def ini_detector(self, controller=None):
         """Detector communication initialization
 
@@ -136,7 +293,8 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
                                                     aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
                                                     sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
                                                     trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
-                                                    trigger_chan = trigger_channel_number
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial()
                                                     )  #
             elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": 
                 print("Initialise 4000a")
@@ -144,11 +302,15 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
                                                     aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
                                                     sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
                                                     trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
-                                                    trigger_chan = trigger_channel_number
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial(),
+                                                    progress = self.report_open_progress
                                                     )  #instantiate you driver with whatever arguments are needed
             else: 
                 print("Problem +")
 
+            self.set_readout()
+
             info = "Log info on Picoscope initialisation : Not coded Yet"
             initialized = True
         
@@ -156,10 +318,9 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
         return info, initialized
 
 
-
-
     def close(self):
         """Terminate the communication protocol"""
+        if self.processing is not None: self.processing.shutdown()
         self.controller.__del__()
 
 
@@ -174,80 +335,208 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
         kwargs: dict
             others optionals arguments
         """
-        ##synchrone version (blocking function)
-        time, channels = self.controller.start_a_grab_snap()
+        if self.settings.child('processing_param', 'processing_mode').value()['selected'][0] == "Synchronous":
+            ##synchrone version (blocking function)
+            t_start = perf_counter()
+            self.process_and_show_data(*self.acquire())
+            self.settings.child('display_param', 'output_latency').setValue( (perf_counter() - t_start) * 1e3 )
+            return
+
+        if self.processing is None:
+            self.processing = ProcessingQueue(self.process_data,
+                                              depth = self.settings.child('processing_param', 'queue_depth').value(),
+                                              dropOldest = self.settings.child('processing_param', 'queue_policy').value()['selected'][0] != "Block")
+
+        if self.processing.dropOldest:
+            # Display only : acquire continuously until the worker has a result, captures it could not keep up with
+            # are dropped, only the latest result is emitted
+            while True:
+                time, channels, trigger_offsets, scales = self.acquire()
+                # The raw buffers are reused by the next captures, the worker gets its own copy
+                self.processing.submit(time, [np.array(channel) for channel in channels], trigger_offsets, scales)
+                if self.processing.processedEvent.is_set(): break
+            result = self.processing.take_latest()
+        else:
+            # Block : one capture per grab and its own result, a scan step or a snap never gets the data of another
+            # capture. The pipelined readout keeps the next capture running while this one is processed
+            time, channels, trigger_offsets, scales = self.acquire()
+            result = self.processing.submit(time, [np.array(channel) for channel in channels], trigger_offsets, scales).result()
+
+        self.settings.child('processing_param', 'queued').setValue( self.processing.queued )
+        self.settings.child('processing_param', 'dropped').setValue( self.processing.dropped )
+        self.show_result(result)
+
+
+    def acquire(self):
+        """Capture from the controller, returns time, channels, trigger_offsets, scales"""
+        # Keep the int16 ADC counts when the controller gives them, scaling is done on the reduced data
+        raw = hasattr(self.controller, 'get_channel_scales')
+        scales = self.controller.get_channel_scales() if raw else [1., 1.]
+
+        trigger_offsets = None
+        rapid_block = self.settings.child('lockin_param', 'pulse_align').value()['selected'][0] == "Trigger Time Offsets"
+        if rapid_block and hasattr(self.controller, 'start_a_rapid_block_snap'):
+            # One triggered segment per pulse, as many as the segment plan fits in one readout
+            if self.segment_plan is None: self.plan_segments()
+            time, channels, trigger_offsets = self.controller.start_a_rapid_block_snap(self.segment_plan.segments, raw=raw, samples=self.segment_plan.samples,
+                                                                                       preTriggerSamples=RAPID_BLOCK_PRE_TRIGGER_SAMPLES)
+        elif self.settings.child('readout_param', 'pipelined').value() and hasattr(self.controller, 'start_a_pipelined_grab'):
+            # The next capture is already running while this one is processed
+            time, channels = self.controller.start_a_pipelined_grab(raw=raw, settleTime=self.settle_time())
+            self.settings.child('readout_param', 'discarded').setValue( self.controller.discardedCaptures )
+        else:
+            if rapid_block: self.emit_status(ThreadCommand('Update_Status', ['Trigger time offsets need a Picoscope 4000a, using fixed width pulses']))
+            time, channels = self.controller.start_a_grab_snap(raw=True) if raw else self.controller.start_a_grab_snap()
 
-        self.process_and_show_data(time, channels)
+        if getattr(self.controller, 'lastGrabDuration', None) is not None:
+            self.settings.child('readout_param', 'grab_duration').setValue( self.controller.lastGrabDuration * 1e3 )
+        if getattr(self.controller, 'dutyCycle', None) is not None:
+            self.settings.child('readout_param', 'duty_cycle').setValue( self.controller.dutyCycle * 1e2 )
 
+        return time, channels, trigger_offsets, scales
 
 
-    def process_and_show_data(self, time, channels):
-        
+    def process_and_show_data(self, time, channels, trigger_offsets=None, scales=(1., 1.)):
+        self.show_result(self.process_data(time, channels, trigger_offsets, scales))
+
+
+    def skipped_grab(self, message, updates):
+        """Result of a grab that cannot give ND_Bd : NaN, not fed to the statistics, so the viewer still gets its data"""
+        self.emit_status(ThreadCommand('Update_Status', [message]))
+        return DataToExport('Picoscope', data=[ DataFromPlugins(name='ND_Bd', data=[ np.array([np.nan]) ], dim='Data0D', labels=['ND_Bd'], do_plot=True) ]), updates
+
+
+    def show_result(self, result):
+        """Apply the readonly settings computed by process_data and emit its data, on the plugin thread"""
+        data_to_export, updates = result
+        for path, value in updates.items(): self.settings.child(*path).setValue( value )
+        self.dte_signal.emit(data_to_export)
+
+
+    def process_data(self, time, channels, trigger_offsets=None, scales=(1., 1.)):
+        """Lock-in processing of a grab, returns the DataToExport to emit and the readonly settings to update
+
+        May run on the processing worker : the settings are not changed here but returned as a dict of path: value,
+        applied by show_result on the plugin thread
+
+        Parameters
+        ----------
+        time: ndarray
+            time axis (s) of the trace, or of each segment in rapid block
+        channels: list of ndarray
+            Channel A and B, either full traces or (number_of_pulses, width_of_pulse) segments. Integer ADC counts are
+            reduced with integer accumulators and only scaled afterwards
+        trigger_offsets: ndarray or None
+            trigger time offsets (s) of the segments, used to align the pulses
+        scales: tuple of float
+            mV per unit of channel A and B
+        """
+
         ChannelA = channels[0]
         ChannelB = channels[1]
+        scaleA, scaleB = scales
 
         # Parameters to set as Inputs for user
         B_frequency = self.settings.child('lockin_param', 'B_freq').value() * 1e-3      # kHz
         B_frequency *= 2 # We want to seperate by steps, not periods
-        pulse_frequency = 1 # kHz
+        pulse_frequency = self.settings.child('lockin_param', 'pulse_freq').value() # kHz
         
         sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value()
         aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()
-        num_points = self.settings.child('aquisition_param', 'num_samples').value() * 1e3
 
         number_of_pulses = int(aquire_time * pulse_frequency)
-        width_of_pulse = int(num_points / number_of_pulses)
 
         number_of_B = int(aquire_time * B_frequency)
-        width_of_B = int(number_of_pulses/number_of_B)
-
-        # Reshape Data (Seperate Pulses)
-        ChannelA_reshaped = ChannelA.reshape(number_of_pulses, width_of_pulse)
-        ChannelB_reshaped = ChannelB.reshape(number_of_pulses, width_of_pulse)
+        width_of_B = number_of_pulses // number_of_B if number_of_B > 0 else 0
+
+        updates = {}
+        pulse_lengths = None
+        if ChannelA.ndim == 2:
+            # Segments (Pulses already seperated), realigned on their true trigger time
+            shifts = trigger_offsets / (time[1] - time[0])
+            ChannelA_reshaped = align_segments(ChannelA, shifts)
+            ChannelB_reshaped = align_segments(ChannelB, shifts)
+            number_of_pulses, width_of_pulse = ChannelA_reshaped.shape
+            # The trigger is at the start of the segments : move the pulse to the second half, as in the fixed width traces
+            ChannelA_reshaped = np.roll(ChannelA_reshaped, width_of_pulse // 2, axis=1)
+            ChannelB_reshaped = np.roll(ChannelB_reshaped, width_of_pulse // 2, axis=1)
+            number_of_B = number_of_pulses // width_of_B if width_of_B > 0 else 0   # The segment plan may hold fewer pulses than the aquisition time
+            ChannelA = ChannelA_reshaped.reshape(-1)
+            ChannelB = ChannelB_reshaped.reshape(-1)
+        elif self.settings.child('lockin_param', 'pulse_align').value()['selected'][0] == "Reference Edges":
+            # Pulses located on the reference channel, zero padded to the longest one
+            with self.lockin_lock:
+                pulse_starts, pulse_lengths = self.pulse_finder.find_pulses(ChannelB, scaleB)
+                period = self.pulse_finder.period
+            if pulse_starts.size == 0:
+                return self.skipped_grab('No complete pulse found on the reference channel : ND_Bd skipped', updates)
+            ChannelA_reshaped, ChannelB_reshaped = pulse_matrix(np.stack([ChannelA, ChannelB]), pulse_starts, pulse_lengths)
+            number_of_pulses, width_of_pulse = ChannelA_reshaped.shape
+
+            pulse_frequency = sampling_freq * 1e3 / period   # kHz
+            updates[('lockin_param', 'pulse_finder', 'detected_freq')] = pulse_frequency
+            width_of_B = max(int(round(pulse_frequency / B_frequency)), 1)
+            number_of_B = number_of_pulses // width_of_B
+        else:
+            # Reshape Data (Seperate Pulses)
+            ChannelA_reshaped, ChannelB_reshaped = fixed_width_pulses(np.stack([ChannelA, ChannelB]), number_of_pulses)
+            width_of_pulse = ChannelA_reshaped.shape[1]
 
-        # Calculate Pulses and remove background
-        ChannelA_values = np.sum(ChannelA_reshaped[:,width_of_pulse//2:], axis=1) - np.sum(ChannelA_reshaped[:,:width_of_pulse//2], axis=1)
-        ChannelB_values = np.sum(ChannelB_reshaped[:,width_of_pulse//2:], axis=1) - np.sum(ChannelB_reshaped[:,:width_of_pulse//2], axis=1)
+        # Calculate Pulses and remove background (exact integer sums for ADC counts), then scale the reduced values only
+        ChannelA_values = pulse_integrals(ChannelA_reshaped, pulse_lengths) * scaleA
+        ChannelB_values = pulse_integrals(ChannelB_reshaped, pulse_lengths) * scaleB
 
         # Normalise Data
         ND = ChannelA_values / ChannelB_values
-        
-        # Reshape Data (Seperate Pulses)
-        ND_reshaped = ND.reshape(number_of_B, width_of_B)
-
-        # Compute ND_a
-        ND_a = np.mean( ND_reshaped )
 
-        # Compute ND_Bd
-        if len(ND_reshaped)%2 !=0 : ND_reshaped = ND_reshaped[:-1]
-        ND_Bd = np.mean( ND_reshaped[::2] - ND_reshaped[1::2] )
-        
-        # Plot a reference of the B
-        Ref = np.ones( (number_of_B, int(width_of_B * width_of_pulse) ) ) * ChannelB.max()
-        Ref[1::2] = 0; Ref = Ref.reshape(Ref.size,)
+        # Compute ND_Bd, one value per B-cycle (all cycles have the same width so their mean is ND_Bd)
+        try:
+            ND_Bd_cycles = nd_bd_cycles(ND, number_of_B, width_of_B)
+        except ValueError:
+            return self.skipped_grab(f'{number_of_pulses} pulses in the grab, fewer than two B steps of {width_of_B} pulses : ND_Bd skipped', updates)
+        ND_Bd = np.mean( ND_Bd_cycles )
+
+        # Standard error over the B-cycles of this grab, and running (Welford) estimate over grabs
+        if ND_Bd_cycles.size > 1: ND_Bd_se = np.std( ND_Bd_cycles, ddof=1 ) / np.sqrt( ND_Bd_cycles.size )
+        else: ND_Bd_se = np.nan
+        with self.lockin_lock:
+            self.ND_Bd_stats.update( ND_Bd )
+            stats_count, stats_mean, stats_se = self.ND_Bd_stats.count, self.ND_Bd_stats.mean, self.ND_Bd_stats.standard_error
+        updates[('lockin_param', 'stats_count')] = stats_count
+
+        if self.settings.child('display_param', 'pid_output').value():
+            # Only the scalar fed to the PID, no 1D array built or sent
+            return DataToExport('Picoscope', data=[ DataFromPlugins(name='ND_Bd', data=[ np.array([ND_Bd]) ], dim='Data0D', labels=['ND_Bd'], do_plot=True) ]), updates
+
+        # Plot a reference of the B, one value per sample of the trace : B step of the pulse each sample belongs to,
+        # zero outside the pulses and after the last complete B step
+        if pulse_lengths is None:
+            pulse_starts = np.arange(number_of_pulses) * width_of_pulse
+            pulse_lengths = np.full(number_of_pulses, width_of_pulse)
+        samples = np.arange(ChannelB.size)
+        sample_pulse = (np.searchsorted(pulse_starts, samples, side='right') - 1).clip(0)
+        B_high = (np.arange(number_of_pulses) // width_of_B) % 2 == 0
+        in_B_step = (samples >= pulse_starts[0]) & (samples < pulse_starts[sample_pulse] + pulse_lengths[sample_pulse]) & (sample_pulse < number_of_B * width_of_B)
+        Ref = np.where(in_B_step & B_high[sample_pulse], ChannelB.max() * scaleB, 0.)
 
 
         # --- Plot the Data 
         data_to_export = []
         # 1D Data Plots
         
-        if self.settings.child('display_param', 'lockin_display', 'pulse_train').value(): data_to_export.append( DataFromPlugins(name='Raw Trace', data=[ChannelA, ChannelB, Ref], dim='Data1D', labels=['Channel A', 'Channel B', "LockIn Reference"], do_plot=True, do_save=True) )
+        # Full traces are only scaled (float32) when displayed
+        if self.settings.child('display_param', 'lockin_display', 'pulse_train').value(): data_to_export.append( DataFromPlugins(name='Raw Trace', data=[ChannelA * np.float32(scaleA), ChannelB * np.float32(scaleB), Ref.astype(np.float32)], dim='Data1D', labels=['Channel A', 'Channel B', "LockIn Reference"], do_plot=True, do_save=True) )
         if self.settings.child('display_param', 'lockin_display', 'pulse_train_int').value(): data_to_export.append( DataFromPlugins(name='Integrated and Background Removed', data=[ ChannelA_values, ChannelB_values ], dim='Data1D', labels=['Channel A', 'Channel B'], do_plot=True) )
         # DataPlot_Integrated = DataFromPlugins(name='Integrated and Background Removed', data=[ ChannelA_values, ChannelB_values ], dim='Data1D', labels=['Channel A', 'Channel B'], do_plot=True)
 
 
         # 0D Data Plots
         if self.settings.child('display_param', 'lockin_display', 'ND_Bd').value(): data_to_export.append( DataFromPlugins(name='ND_Bd', data= ND_Bd,  dim='Data0D', labels=['ND_Bd'], do_plot=True) )
+        if self.settings.child('display_param', 'lockin_display', 'ND_Bd_stats').value(): data_to_export.append( DataFromPlugins(name='ND_Bd Statistics', data=[ np.array([ND_Bd_se]), np.array([stats_mean]), np.array([stats_se]) ], dim='Data0D', labels=['ND_Bd SE (grab)', 'ND_Bd Running Mean', 'ND_Bd Running SE'], do_plot=True) )
         
 
         # --- Export the Data
-        data = DataToExport('Picoscope', data=data_to_export)
-        
-
-        self.dte_signal.emit(data)
-
-
-
+        return DataToExport('Picoscope', data=data_to_export), updates
 
 
     def callback(self):
@@ -259,11 +548,10 @@ class DAQ_1DViewer_Picoscope_Lockin(DAQ_Viewer_base):
 
     def stop(self):
         """Stop the current grab hardware wise if necessary"""
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_stop_acquisition()  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
-        ##############################
+        if self.processing is not None: self.processing.clear()
+        if getattr(self.controller, 'pipelineRunning', False):
+            self.controller.stop_pipeline()
+            self.emit_status(ThreadCommand('Update_Status', ['Pipelined acquisition stopped']))
         return ''
 
 
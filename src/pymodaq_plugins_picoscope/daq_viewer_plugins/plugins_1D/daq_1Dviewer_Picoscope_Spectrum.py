@@ -0,0 +1,278 @@
+from time import sleep
+
+import numpy as np
+from pymodaq.utils.daq_utils import ThreadCommand
+from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport
+from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
+from pymodaq.utils.parameter import Parameter
+
+from ...hardware.Picoscope4000_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000
+from ...hardware.Picoscope4000a_wrapper import Picoscope_Wrapper as Picoscope_Wrapper4000a
+from ...hardware.discovery import FIRST_FREE
+from ...hardware.profiles import profile_names
+from ...hardware.plugin_mixin import PicoscopePluginMixin
+from ...hardware.spectrum import WelchAccumulator, WINDOWS
+
+
+class DAQ_1DViewer_Picoscope_Spectrum(PicoscopePluginMixin, DAQ_Viewer_base):
+    """ Instrument plugin class for a 1D viewer showing the power spectral density of the Picoscope channels.
+
+    The PSD is estimated with Welch's method and averaged over all the segments acquired since the last reset, grab
+    after grab. In block mode each grab is one capture. In streaming mode (4000a) the scope acquires continuously and
+    each grab processes the samples received since the previous one, so low frequencies only need a long enough
+    accumulation, not a giant block.
+
+    Attributes:
+    -----------
+    controller: object
+        The particular object that allow the communication with the hardware, in general a python wrapper around the
+         hardware library.
+
+    """
+
+    params = comon_parameters+[
+        {"title": "Picoscope Series Version",
+         "name": "pico_type",
+         "type": "itemselect",
+         "value": dict(all_items=["Picoscope 4000", "Picoscope 4000a"], selected=["Picoscope 4000a"])
+        } ,
+
+        {'title':'Serial Number : Need to Reload Detector if changed !!', 'name':'serial', 'type':'itemselect', 'value':dict(all_items=[FIRST_FREE], selected=[FIRST_FREE])},
+        {'title':'Detect Units', 'name':'detect_units', 'type':'bool_push', 'value':False, 'default':False },
+
+        {'title':'Aquisition Parameters : Need to Reload Detector if changed !!',
+         'name':'aquisition_param',
+         'type':'group',
+         'children':[
+             {'title':'Aquisition Time (ms)', 'name':'aquisition_time', 'type':'float', 'value':10, 'default':10 },
+             {'title':'Sampling Frequency (MHz)', 'name':'sampling_freq', 'type':'float', 'value':0.2, 'default':0.2 },
+             {'title':'Number of Samples (kS)', 'name':'num_samples', 'type':'float', 'value':2, 'default':2, 'readonly':True },
+             {'title':'Trigger Channel', 'name':'trig_chan', 'type':'itemselect', 'value':dict(all_items=["A", "B", "External"], selected=["B"])},
+             {'title':'Trigger Level (mV)', 'name':'trig_lvl', 'type':'float', 'value':500, 'default':500 } ]
+        } ,
+
+        {'title':'Acquisition Profiles',
+         'name':'profile_param',
+         'type':'group',
+         'children':[
+             {'title':'Profile', 'name':'profile', 'type':'itemselect', 'value':dict(all_items=profile_names(), selected=profile_names()[:1])},
+             {'title':'Apply Profile', 'name':'apply_profile', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'New Profile Name', 'name':'profile_name', 'type':'str', 'value':'', 'default':'' },
+             {'title':'Save Settings as Profile', 'name':'save_profile', 'type':'bool_push', 'value':False, 'default':False } ]
+        } ,
+
+        {'title':'Spectrum Parameters',
+         'name':'spectrum_param',
+         'type':'group',
+         'children':[
+             {'title':'Acquisition Mode', 'name':'acq_mode', 'type':'itemselect', 'value':dict(all_items=["Block", "Streaming (4000a)"], selected=["Block"])},
+             {'title':'Streaming Buffer (kS)', 'name':'stream_buffer', 'type':'float', 'value':1000, 'default':1000, 'min':1 },
+             {'title':'Segment Length (S)', 'name':'nperseg', 'type':'int', 'value':1024, 'default':1024, 'min':8 },
+             {'title':'Overlap (%)', 'name':'overlap', 'type':'float', 'value':50, 'default':50, 'min':0, 'max':95 },
+             {'title':'Window', 'name':'window', 'type':'itemselect', 'value':dict(all_items=list(WINDOWS), selected=["Hann"])},
+             {'title':'Accumulate Spectra', 'name':'accumulate', 'type':'bool', 'value':True, 'default':True },
+             {'title':'Reset Spectrum', 'name':'reset_spectrum', 'type':'bool_push', 'value':False, 'default':False },
+             {'title':'Averaged Segments', 'name':'segments_count', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+             {'title':'Resolution (Hz)', 'name':'resolution', 'type':'float', 'value':0, 'default':0, 'readonly':True } ]
+        } ,
+
+        ]
+
+
+    # ----- Initialise
+
+    def ini_attributes(self):
+
+        if self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000": self.controller: Picoscope_Wrapper4000 = None
+        elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a": self.controller: Picoscope_Wrapper4000a = None
+        self.detect_units()
+
+        self.spectrum: WelchAccumulator = None
+        self.sampling_freq = None  # Hz, of the data fed to the spectrum
+
+        # Set all read only values
+        self.settings.child('aquisition_param', 'num_samples').setValue( self.settings.child('aquisition_param', 'sampling_freq').value()*1e6 * self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3 * 1e-3 )
+
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the detector settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within detector_settings) whose value has been changed by the user
+        """
+
+        print("Commit setting : ", param)
+        if param.name() in ["pico_type", "detect_units"]:
+            self.detect_units(refresh = param.name() == "detect_units")
+
+        if param.name() == "apply_profile":
+            self.apply_profile()
+
+        if param.name() == "save_profile":
+            self.save_profile()
+
+        if param.name() in ["aquisition_time", "sampling_freq"]:
+            sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value()
+            aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()
+            self.settings.child('aquisition_param', 'num_samples').setValue( (sampling_freq*1e6) * (aquire_time*1e-3) * 1e-3 )
+
+        if param.name() in ["nperseg", "overlap", "window", "reset_spectrum"]:   # Rebuilt at the next grab
+            self.spectrum = None
+            self.settings.child('spectrum_param', 'segments_count').setValue( 0 )
+
+        if param.name() in ["acq_mode", "stream_buffer"] and self.controller is not None:
+            self.spectrum = None
+            if getattr(self.controller, 'streamingRunning', False): self.controller.stop_streaming()
+
+
+    def profile_applied(self):
+        """Drop the spectrum of the previous configuration"""
+        self.spectrum = None   # Rebuilt at the next grab
+        self.settings.child('spectrum_param', 'segments_count').setValue( 0 )
+
+
+    def ini_detector(self, controller=None):
+        """Detector communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator/detector by controller
+            (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+
+        # Define Trigger Channel
+        trigger_channel_number_dic = {"A":0, "B":1, "C":9}
+        trigger_channel_number = trigger_channel_number_dic [self.settings.child('aquisition_param', 'trig_chan').value()['selected'][0] ]
+
+        if (trigger_channel_number==9) and (self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a"):
+            print("ERROR : External channel not available for Picoscope 4000a")
+        else:
+
+            if self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000":
+                print("Initialise 4000")
+                self.controller = Picoscope_Wrapper4000(
+                                                    aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
+                                                    sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
+                                                    trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial()
+                                                    )
+            elif self.settings.child('pico_type').value()["selected"][0] == "Picoscope 4000a":
+                print("Initialise 4000a")
+                self.controller = Picoscope_Wrapper4000a(
+                                                    aquire_time = self.settings.child('aquisition_param', 'aquisition_time').value()*1e-3,
+                                                    sampling_freq = self.settings.child('aquisition_param', 'sampling_freq').value(),
+                                                    trigger = self.settings.child('aquisition_param', 'trig_lvl').value(),
+                                                    trigger_chan = trigger_channel_number,
+                                                    serial = self.selected_serial(),
+                                                    progress = self.report_open_progress
+                                                    )
+            else:
+                print("Problem +")
+
+            info = "Log info on Picoscope initialisation : Not coded Yet"
+            initialized = True
+
+
+        return info, initialized
+
+
+    def close(self):
+        """Terminate the communication protocol"""
+        if getattr(self.controller, 'streamingRunning', False): self.controller.stop_streaming()
+        self.controller.__del__()
+
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """Start a grab from the detector
+
+        Parameters
+        ----------
+        Naverage: int
+            Number of hardware averaging (if hardware averaging is possible, self.hardware_averaging should be set to
+            True in class preamble and you should code this implementation)
+        kwargs: dict
+            others optionals arguments
+        """
+        streaming = self.settings.child('spectrum_param', 'acq_mode').value()['selected'][0] != "Block"
+        if streaming and not hasattr(self.controller, 'start_streaming'):
+            self.emit_status(ThreadCommand('Update_Status', ['Streaming only available for Picoscope 4000a, using block mode']))
+            streaming = False
+
+        if streaming:
+            channels, sampling_freq = self.grab_streaming()
+        elif hasattr(self.controller, 'get_channel_scales'):
+            time, channels = self.controller.start_a_grab_snap(raw=True)
+            sampling_freq = (len(time) - 1) / (time[-1] - time[0])
+        else:
+            time, channels = self.controller.start_a_grab_snap()
+            sampling_freq = (len(time) - 1) / (time[-1] - time[0])
+
+        self.process_and_show_data(channels, sampling_freq, continuous=streaming)
+
+
+    def grab_streaming(self):
+        """Samples received since the last grab, waiting until at least one segment is there"""
+        if not self.controller.streamingRunning:
+            self.controller.start_streaming(bufferSize=self.settings.child('spectrum_param', 'stream_buffer').value()*1e3)
+            self.spectrum = None
+
+        nperseg = self.settings.child('spectrum_param', 'nperseg').value()
+        chunks = [self.controller.get_streaming_latest()]
+        received = chunks[0][0].size
+        while received < nperseg:
+            sleep(max(nperseg * self.controller.streamingInterval / 4, 1e-3))
+            chunks.append(self.controller.get_streaming_latest())
+            received += chunks[-1][0].size
+
+        channels = [np.concatenate([chunk[channel] for chunk in chunks]) for channel in range(2)]
+        return channels, 1 / self.controller.streamingInterval
+
+
+    def process_and_show_data(self, channels, sampling_freq, continuous=False):
+            if self.spectrum is None or not self.settings.child('spectrum_param', 'accumulate').value() or sampling_freq != self.sampling_freq:
+                self.spectrum = WelchAccumulator( nperseg = self.settings.child('spectrum_param', 'nperseg').value(),
+                                                  overlap = self.settings.child('spectrum_param', 'overlap').value() * 1e-2,
+                                                  window = self.settings.child('spectrum_param', 'window').value()['selected'][0] )
+                self.sampling_freq = sampling_freq
+
+            # Spectra of the raw counts, scaled to mV once on the averaged PSD
+            self.spectrum.update(channels, continuous=continuous)
+            scales = self.controller.get_channel_scales() if hasattr(self.controller, 'get_channel_scales') else None
+            frequencies, psd = self.spectrum.psd(sampling_freq, scales)
+
+            self.settings.child('spectrum_param', 'segments_count').setValue( self.spectrum.count )
+            self.settings.child('spectrum_param', 'resolution').setValue( frequencies[1] )
+            if psd is None:
+                self.emit_status(ThreadCommand('Update_Status', ['Capture shorter than one segment, reduce the Segment Length']))
+                return
+
+            dwa1D = DataFromPlugins(name='PSD', data=[psd[0].astype(np.float32), psd[1].astype(np.float32)], dim='Data1D', labels=['PSD A (mV²/Hz)', 'PSD B (mV²/Hz)'], do_plot=True,
+                                    axes=[Axis('Frequency', units='Hz', data=frequencies, index=0)])
+
+            data = DataToExport('Picoscope', data=[ dwa1D ])
+
+            self.dte_signal.emit(data)
+
+
+    def stop(self):
+        """Stop the current grab hardware wise if necessary"""
+        if getattr(self.controller, 'streamingRunning', False):
+            self.controller.stop_streaming()
+            self.emit_status(ThreadCommand('Update_Status', ['Streaming stopped']))
+        return ''
+
+
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Min/max preview pyramid of the raw traces saved in PyMoDAQ h5 files
+
+@author: dqml-lab
+"""
+import numpy as np
+import tables
+
+from pymodaq.utils.h5modules.backends import Node, H5Backend
+from pymodaq.utils.h5modules.exporter import ExporterFactory, H5Exporter
+from pymodaq.utils.logger import set_logger, get_module_name
+
+logger = set_logger(get_module_name(__file__))
+
+
+PREVIEW_FACTORS = (16, 256, 4096)  # each level decimates the previous one by 16
+BLOCK_SAMPLES = 4096 * 256  # raw samples read at once along the trace, a multiple of the largest factor
+
+
+def preview_name(name, factor):
+    return f'{name}_preview{factor}'
+
+
+def _minmax(mins, maxs, step):
+    """ Min of mins and max of maxs over bins of step along the last axis, the last bin may be partial """
+    starts = np.arange(0, mins.shape[-1], step)
+    return np.minimum.reduceat(mins, starts, axis=-1), np.maximum.reduceat(maxs, starts, axis=-1)
+
+
+def _interleave(mins, maxs):
+    """ min, max, min, max... : the envelope plotted as is, as on a scope display """
+    envelope = np.empty(mins.shape[:-1] + (2 * mins.shape[-1],), dtype=mins.dtype)
+    envelope[..., 0::2] = mins
+    envelope[..., 1::2] = maxs
+    return envelope
+
+
+def write_node_pyramid(h5file: tables.File, array: tables.Array):
+    """ Preview levels of one data array, next to it in its channel group
+
+    The array is read by blocks of BLOCK_SAMPLES along its last axis, a trace larger than the memory is decimated
+    too. Each level is a CArray of the interleaved min/max of bins of factor samples, without the data_type
+    attribute, so the PyMoDAQ loaders (and the h5 browser) keep on showing the raw data only.
+    """
+    size = array.shape[-1]
+    factors = [factor for factor in PREVIEW_FACTORS if size > factor]
+    group = array._v_parent
+
+    levels = {}
+    for factor in factors:
+        name = preview_name(array.name, factor)
+        if name in group: h5file.remove_node(group, name)
+        shape = array.shape[:-1] + (2 * -(-size // factor),)
+        levels[factor] = h5file.create_carray(group, name, atom=tables.Atom.from_dtype(array.dtype), shape=shape,
+                                              filters=array.filters, title=f'min/max preview x{factor} of {array.name}')
+        levels[factor].attrs['preview_of'] = array.name
+        levels[factor].attrs['decimation'] = factor
+
+    for start in range(0, size, BLOCK_SAMPLES):
+        mins = maxs = array[..., start:start + BLOCK_SAMPLES]
+        previous = 1
+        for factor in factors:
+            mins, maxs = _minmax(mins, maxs, factor // previous)
+            first = 2 * (start // factor)
+            levels[factor][..., first:first + 2 * mins.shape[-1]] = _interleave(mins, maxs)
+            previous = factor
+
+    return list(levels.values())
+
+
+def write_preview_pyramid(filename, where='/'):
+    """ Add the preview levels of all the data arrays hanging from where, in place
+
+    To be called on a closed file, once the acquisition saved it. Returns the number of arrays decimated. The
+    H5PreviewPyramidExporter calls it on its copy of a PyMoDAQ file, the H5Writer of the stream recorder writes the
+    levels of its /A and /B arrays itself when it closes a file.
+    """
+    h5saver = H5Backend(backend='tables')
+    h5saver.open_file(str(filename), 'a')
+    count = 0
+    try:
+        paths = [array._v_pathname for array in h5saver.h5file.walk_nodes(where, classname='Array')]  # the walk does not survive new nodes
+        for path in paths:
+            array = h5saver.h5file.get_node(path)
+            if 'data_type' not in array.attrs or 'data' not in array.attrs['data_type']: continue
+            if 'preview_of' in array.attrs or array.ndim == 0 or array.shape[-1] <= PREVIEW_FACTORS[0]: continue
+            write_node_pyramid(h5saver.h5file, array)
+            count += 1
+        h5saver.flush()
+    finally:
+        h5saver.close_file()
+    return count
+
+
+def read_preview(array, start=0, stop=None, nPoints=1000):
+    """ Envelope of array[..., start:stop] with at least nPoints points, from the coarsest level that has them
+
+    array is a pytables array (or a pymodaq Node of one) with its preview levels next to it. Returns the raw sample
+    index of each point and the values, the raw data itself when the range is too short for any level.
+    """
+    if isinstance(array, Node): array = array.node
+    size = array.shape[-1]
+    stop = size if stop is None else min(stop, size)
+    group = array._v_parent
+
+    for factor in reversed(PREVIEW_FACTORS):
+        name = preview_name(array.name, factor)
+        if name not in group or 2 * (stop - start) // factor < nPoints: continue
+        first, last = start // factor, -(-stop // factor)
+        envelope = group._f_get_child(name)[..., 2 * first:2 * last]
+        index = np.repeat(np.arange(first, last) * factor + factor // 2, 2)
+        return index, envelope
+
+    return np.arange(start, stop), array[..., start:stop]
+
+
+@ExporterFactory.register_exporter()
+class H5PreviewPyramidExporter(H5Exporter):
+    """ Copy of the h5 file with the min/max preview levels of the data hanging from the exported node """
+
+    FORMAT_DESCRIPTION = "Picoscope h5 file with preview pyramid"
+    FORMAT_EXTENSION = "h5"
+
+    def export_data(self, node: Node, filename: str) -> None:
+        """Copy the whole file, then decimate the node data in the copy"""
+        if node.backend != 'tables':
+            raise NotImplementedError("preview pyramid export only supported with the tables backend")
+        node.node._v_file.copy_file(dstfilename=str(filename), overwrite=True)
+
+        count = write_preview_pyramid(filename, node.path)
+        logger.info(f"Preview pyramid x{', x'.join(str(factor) for factor in PREVIEW_FACTORS)} of {count} arrays in {filename}")
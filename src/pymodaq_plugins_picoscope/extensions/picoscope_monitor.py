@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Dashboard extension monitoring all the Picoscope viewers at once
+
+@author: dqml-lab
+"""
+from time import perf_counter
+
+import numpy as np
+import pyqtgraph as pg
+from qtpy import QtWidgets, QtCore
+
+from pymodaq.utils import gui_utils as gutils
+from pymodaq.utils.config import Config, ConfigError
+from pymodaq.utils.logger import set_logger, get_module_name
+
+from pymodaq_plugins_picoscope.utils import Config as PluginConfig
+
+logger = set_logger(get_module_name(__file__))
+
+main_config = Config()
+plugin_config = PluginConfig()
+
+EXTENSION_NAME = 'Picoscope Monitor'  # the name that will be displayed in the extension list in the dashboard
+CLASS_NAME = 'PicoscopeMonitor'
+
+COLUMNS = ['Viewer', 'Grab Rate (Hz)', 'Grab Duration (ms)', 'Dead Time (%)', 'Dropped', 'Discarded', 'Lock-in']
+
+# Readonly plugin settings shown per device : (group, name) of each counter, the first one found is used
+DROP_COUNTERS = [('readout_param', 'worker_dropped'), ('processing_param', 'dropped')]
+
+
+def decimate_minmax(data, nPoints):
+    """ Min/max envelope of a trace in nPoints/2 bins, peaks survive the decimation (as in a scope display) """
+    data = np.asarray(data).ravel()
+    nBins = max(nPoints // 2, 1)
+    if data.size <= nPoints: return np.arange(data.size), data
+
+    width = data.size // nBins
+    binned = data[:nBins * width].reshape(nBins, width)
+    envelope = np.empty(2 * nBins, dtype=np.float32)
+    envelope[0::2] = binned.min(axis=1)
+    envelope[1::2] = binned.max(axis=1)
+    index = np.repeat(np.arange(nBins) * width + width // 2, 2)
+    return index, envelope
+
+
+class PicoscopeMonitor(gutils.CustomApp):
+    """ One low overhead view of every Picoscope viewer of the dashboard
+
+    Each grab of a viewer only stores a reference to its data and counts it. The display is refreshed by a timer at a
+    fixed low rate, independent of the acquisitions : min/max decimated traces, lock-in scalars (0D data), grab rate,
+    dead time and drop counters per device.
+    """
+
+    params = [
+        {'title':'Refresh Period (ms)', 'name':'refresh_period', 'type':'int', 'value':500, 'default':500, 'min':50 },
+        {'title':'Trace Points', 'name':'trace_points', 'type':'int', 'value':500, 'default':500, 'min':10 },
+        {'title':'Viewers', 'name':'viewers', 'type':'str', 'value':'', 'readonly':True },
+    ]
+
+    def __init__(self, parent: gutils.DockArea, dashboard):
+        super().__init__(parent, dashboard)
+
+        self.monitored = []  # one dict per viewer, see find_viewers
+        self.timer = QtCore.QTimer()
+        self.last_refresh = perf_counter()
+
+        self.setup_ui()
+        self.find_viewers()
+        self.timer.start(self.settings.child('refresh_period').value())
+
+    def setup_docks(self):
+        self.docks['devices'] = gutils.Dock('Devices')
+        self.dockarea.addDock(self.docks['devices'])
+        self.table = QtWidgets.QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        self.docks['devices'].addWidget(self.table)
+
+        self.docks['traces'] = gutils.Dock('Live Traces (decimated)')
+        self.dockarea.addDock(self.docks['traces'], 'bottom', self.docks['devices'])
+        self.traces = pg.GraphicsLayoutWidget()
+        self.docks['traces'].addWidget(self.traces)
+
+        self.docks['settings'] = gutils.Dock('Settings')
+        self.dockarea.addDock(self.docks['settings'], 'right', self.docks['devices'])
+        self.docks['settings'].addWidget(self.settings_tree)
+
+    def setup_actions(self):
+        self.add_action('pause', 'Pause', 'pause', "Pause the display (acquisitions go on)", checkable=True)
+        self.add_action('refresh', 'Find Viewers', 'Refresh2', "Look again for the Picoscope viewers of the dashboard")
+
+    def connect_things(self):
+        self.timer.timeout.connect(self.refresh)
+        self.connect_action('refresh', self.find_viewers)
+
+    def value_changed(self, param):
+        if param.name() == 'refresh_period':
+            self.timer.setInterval(param.value())
+
+    # ----- Monitoring
+
+    def find_viewers(self):
+        """ Follow every DAQ_Viewer running one of the Picoscope plugins """
+        for viewer in self.monitored:
+            viewer['module'].grab_done_signal.disconnect(viewer['slot'])
+        self.monitored = []
+        self.traces.clear()
+
+        for module in self.modules_manager.detectors_all:
+            if 'Picoscope' not in str(module.detector): continue
+            viewer = {'module': module, 'data': None, 'grabs': 0, 'curves': []}
+            viewer['slot'] = lambda dte, viewer=viewer: self.store(viewer, dte)
+            module.grab_done_signal.connect(viewer['slot'])
+            viewer['plot'] = self.traces.addPlot(title=module.title)
+            self.traces.nextRow()
+            self.monitored.append(viewer)
+
+        self.table.setRowCount(len(self.monitored))
+        self.settings.child('viewers').setValue(', '.join(viewer['module'].title for viewer in self.monitored))
+
+    @staticmethod
+    def store(viewer, dte):
+        """ Called at every grab : only keep the latest data, processed at the next refresh """
+        viewer['data'] = dte
+        viewer['grabs'] += 1
+
+    def refresh(self):
+        now = perf_counter()
+        elapsed = now - self.last_refresh
+        self.last_refresh = now
+        if self.is_action_checked('pause'): return
+
+        for row, viewer in enumerate(self.monitored):
+            rate = viewer['grabs'] / elapsed
+            viewer['grabs'] = 0
+            self.update_row(row, viewer, rate)
+            if viewer['data'] is not None: self.update_traces(viewer)
+
+    def detector_setting(self, viewer, *path):
+        """ Value of a setting of the plugin, None if this plugin does not have it """
+        try:
+            return viewer['module'].settings.child('detector_settings', *path).value()
+        except Exception:
+            return None
+
+    def update_row(self, row, viewer, rate):
+        grab_duration = self.detector_setting(viewer, 'readout_param', 'grab_duration')
+        duty_cycle = self.detector_setting(viewer, 'readout_param', 'duty_cycle')
+        if duty_cycle: dead_time = 100 - duty_cycle
+        elif grab_duration and rate > 0: dead_time = max(100 - grab_duration * 1e-3 * rate * 1e2, 0)
+        else: dead_time = None
+        dropped = next((value for value in (self.detector_setting(viewer, *path) for path in DROP_COUNTERS) if value is not None), None)
+        discarded = self.detector_setting(viewer, 'readout_param', 'discarded')
+
+        scalars = []
+        if viewer['data'] is not None:
+            for dwa in viewer['data'].get_data_from_dim('Data0D'):
+                scalars += [f'{label} = {float(np.asarray(array).ravel()[0]):.4g}' for label, array in zip(dwa.labels, dwa.data)]
+
+        values = [viewer['module'].title, f'{rate:.2f}',
+                  '' if grab_duration is None else f'{grab_duration:.2f}',
+                  '' if dead_time is None else f'{dead_time:.1f}',
+                  '' if dropped is None else str(dropped),
+                  '' if discarded is None else str(discarded),
+                  ', '.join(scalars)]
+        for column, value in enumerate(values):
+            self.table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+
+    def update_traces(self, viewer):
+        """ Decimated copy of the first 1D data of the viewer """
+        dwas = viewer['data'].get_data_from_dim('Data1D')
+        if len(dwas) == 0: return
+        dwa = dwas[0]
+
+        nPoints = self.settings.child('trace_points').value()
+        while len(viewer['curves']) < len(dwa.data):
+            viewer['curves'].append(viewer['plot'].plot(pen=pg.intColor(len(viewer['curves']))))
+        for curve, array in zip(viewer['curves'], dwa.data):
+            index, envelope = decimate_minmax(array, nPoints)
+            curve.setData(index, envelope)
+
+    def quit(self):
+        self.timer.stop()
+        for viewer in self.monitored:
+            viewer['module'].grab_done_signal.disconnect(viewer['slot'])
+        self.monitored = []
+
+
+def main():
+    from pymodaq.utils.gui_utils.utils import mkQApp
+    from pymodaq.utils.gui_utils.loader_utils import load_dashboard_with_preset
+    from pymodaq.utils.messenger import messagebox
+
+    app = mkQApp(EXTENSION_NAME)
+    try:
+        preset_file_name = plugin_config('presets', f'preset_for_{CLASS_NAME.lower()}')
+        load_dashboard_with_preset(preset_file_name, EXTENSION_NAME)
+        app.exec()
+
+    except ConfigError as e:
+        messagebox(f'No entry with name f"preset_for_{CLASS_NAME.lower()}" has been configured'
+                   f'in the plugin config file. The toml entry should be:\n'
+                   f'[presets]'
+                   f"preset_for_{CLASS_NAME.lower()} = {'a name for an existing preset'}"
+                   )
+
+if __name__ == '__main__':
+    main()
@@ -16,9 +16,10 @@ class Picoscope_Wrapper:
 
     ############## My methods
 
-    def __init__(self, aquire_time=.5, sampling_freq=0.20, trigger=500, trigger_chan=1) -> None:
+    def __init__(self, aquire_time=.5, sampling_freq=0.20, trigger=500, trigger_chan=1, serial=None) -> None:
         """
         Max Sampling Freq = 80 MHz
+        serial : serial number of the unit to open, None for the first free one
         """
 
         self.aquire_time = aquire_time
@@ -33,6 +34,7 @@ class Picoscope_Wrapper:
         self.timebase = int( 80/sampling_freq - 1 )  # Page 24 of PG
 
         self.chandle = ctypes.c_int16()
+        self.serial = serial
         self.status = {}
         self.maxADC = ctypes.c_int16(32767)
 
@@ -76,9 +78,10 @@ class Picoscope_Wrapper:
         # Initialise Device
         # ----------
 
-        # Open 4000 series PicoScope
+        # Open 4000 series PicoScope, only the requested one if a serial is given
         # Returns handle to chandle for use in future API functions
-        self.status["openunit"] = ps.ps4000OpenUnit(ctypes.byref(self.chandle))
+        if self.serial is None: self.status["openunit"] = ps.ps4000OpenUnit(ctypes.byref(self.chandle))
+        else: self.status["openunit"] = ps.ps4000OpenUnitEx(ctypes.byref(self.chandle), self.serial.encode())
 
         # Check power Status
         try:
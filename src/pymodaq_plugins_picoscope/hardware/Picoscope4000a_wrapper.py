@@ -5,19 +5,34 @@ Created on Mon Feb 3 2025
 @author: dqml-lab
 """
 import ctypes
+import queue
+import threading
 import numpy as np
+from time import perf_counter, sleep
 from picosdk.ps4000a import ps4000a as ps
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+from .handle_cache import handle_cache
+from .segment_planner import plan_segments
+from .siggen import SigGen
 from math import *
 
 
+CHANNEL_INPUT_RANGES_MV = np.array([10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000])
+TIME_UNITS_S = np.array([1e-15, 1e-12, 1e-9, 1e-6, 1e-3, 1.])  # PS4000A_TIME_UNITS, FS to S
+FREQUENCY_COUNTER_RANGES_HZ = np.array([2e3, 2e4, 20., 200.])  # PS4000A_FREQUENCY_COUNTER_RANGE, full scale
+RAPID_BLOCK_REARM_S = 2e-6  # margin for the trigger re-arm between two rapid block segments
+RAPID_BLOCK_PRE_TRIGGER_SAMPLES = 8  # default pre-trigger of the rapid block segments
+
+
 class Picoscope_Wrapper:
 
     ############## My methods
 
-    def __init__(self, aquire_time=.5, sampling_freq=0.20, trigger=500, trigger_chan=1) -> None:
+    def __init__(self, aquire_time=.5, sampling_freq=0.20, trigger=500, trigger_chan=1, serial=None, progress=None) -> None:
         """
         Max Sampling Freq = 80 MHz
+        serial : serial number of the unit to open, None for the first free one
+        progress : called with the open progress (%) while the unit boots
         """
 
         self.aquire_time = aquire_time
@@ -32,6 +47,9 @@ class Picoscope_Wrapper:
         self.timebase = int( 80/sampling_freq - 1 )  # Page 24 of PG
 
         self.chandle = ctypes.c_int16()
+        self.serial = serial
+        self.openProgress = progress
+        self.handleHeld = False  # handle taken from handle_cache and not given back yet
         self.status = {}
         self.maxADC = ctypes.c_int16(32767)
 
@@ -42,6 +60,54 @@ class Picoscope_Wrapper:
         self.bufferB = None
         self.chARange = None
         self.chBRange = None
+
+        self.nCaptures = 1
+        self.nSegments = 1  # memory segments of the single block configuration, one to give the capture all the memory
+        self.segmentPlan = None  # SegmentPlan of the rapid block captures, see plan_segments
+        self.rapidBufferA = None
+        self.rapidBufferB = None
+
+        self.etsMode = 0
+        self.etsSampleTimeps = None
+        self.etsTimeBuffer = None
+
+        self.frequencyCounterRange = None  # PS4000A_FREQUENCY_COUNTER_RANGE while the channels count frequencies
+
+        self.sigGen = None  # SigGen of the unit, waveform of the sweeps
+        self.sweepBufferA = None
+        self.sweepBufferB = None
+
+        self.overlapped = False  # Deferred readout, see start_a_grab_snap
+        self.lastGrabDuration = None  # s, capture and readout only
+
+        self.pipelineRunning = False
+        self.pipelineBuffers = None  # [slot][channel] int16 arrays, see start_a_pipelined_grab
+        self.pipelineSlot = 0
+        self.pipelineSamples = None
+        self.pipelineOverflow = None
+        self.pipelineLastReturn = None
+        self.dutyCycle = None
+        self.pipelineArmTime = None
+        self.discardedCaptures = 0
+
+        self.streamingRunning = False
+        self.streamingInterval = None  # s
+        self.streamBufferA = None
+        self.streamBufferB = None
+        self._streamingChunks = []
+        self._streamingCallback = None
+        self.streamingSamples = 0  # samples per channel received since start_streaming, absolute index of the next one
+        self.streamingTriggers = []  # absolute indexes of the driver triggers received by the last get_streaming_latest
+        self.streamingAutoStopped = False
+
+        self.workerRunning = False
+        self.workerQueue = None  # (time, [A, B]) int16 captures, see start_acquisition_worker
+        self.workerLatestOnly = False
+        self.workerAcquired = 0
+        self.workerDropped = 0
+        self.workerError = None
+        self._workerThread = None
+        self._workerStop = threading.Event()
         
         print()
         print("----- Setting up Picoscope with parameters : ")
@@ -53,20 +119,23 @@ class Picoscope_Wrapper:
         print()
 
         self.initialize_picoscope()
+        self.sigGen = SigGen(self.chandle)
 
 
     def __del__(self):
         print("Stopping Picoscope")
+        if self.workerRunning: self.stop_acquisition_worker()
         
+        if not self.handleHeld: return  # Already given back (close then garbage collection)
+
         # Stop the scope
         handle = self.chandle
         self.status["stop"] = ps.ps4000aStop(handle)
         assert_pico_ok(self.status["stop"])
 
-        # Close unit / Disconnect the scope
-        handle = self.chandle
-        self.status["close"] = ps.ps4000aCloseUnit(handle)
-        assert_pico_ok(self.status["close"])
+        # Give the unit back to the cache, it is only closed once idle
+        handle_cache.release(self.serial)
+        self.handleHeld = False
 
 
     def initialize_picoscope(self):
@@ -75,24 +144,16 @@ class Picoscope_Wrapper:
         # Initialise Device
         # ----------
 
-        # Open 4000 series PicoScope
+        # Open 4000 series PicoScope, or take it already open from the handle cache
         # Returns handle to chandle for use in future API functions
-        self.status["openunit"] = ps.ps4000aOpenUnit(ctypes.byref(self.chandle), None)
+        self.chandle, self.serial, reused = handle_cache.acquire(self.serial, self.openProgress)
+        self.handleHeld = True
 
-        # Check power Status
-        try:
-            assert_pico_ok(self.status["openunit"])
-        except: # PicoNotOkError:
-            powerStatus = self.status["openunit"]
-
-            if powerStatus == 286:
-                self.status["changePowerSource"] = ps.ps4000aChangePowerSource(self.chandle, powerStatus)
-            elif powerStatus == 282:
-                self.status["changePowerSource"] = ps.ps4000aChangePowerSource(self.chandle, powerStatus)
-            else:
-                raise
-
-            assert_pico_ok(self.status["changePowerSource"])
+        if reused:
+            # Undo what the previous wrapper may have left on the unit, the rest is set up below
+            self.status["stop"] = ps.ps4000aStop(self.chandle)
+            self.status["setEts"] = ps.ps4000aSetEts(self.chandle, 0, 0, 0, None)
+            for channel in range(2): ps.ps4000aSetFrequencyCounter(self.chandle, channel, 0, 0, 0, 0)
 
         # ----------
         # Setup Channels, Trigger, Time
@@ -148,10 +209,11 @@ class Picoscope_Wrapper:
 
         # ----- Set  up memory segments
         handle = self.chandle
-        nSegments = 10
         nMaxSamples = ctypes.c_int32(0)
-        self.status["setMemorySegments"] = ps.ps4000aMemorySegments(self.chandle, 10, ctypes.byref(nMaxSamples))
+        self.status["setMemorySegments"] = ps.ps4000aMemorySegments(self.chandle, self.nSegments, ctypes.byref(nMaxSamples))
         assert_pico_ok(self.status["setMemorySegments"])
+        if self.maxSamples > nMaxSamples.value // 2:  # nMaxSamples is shared by the two channels
+            print("WARNING : ", self.maxSamples, " samples per channel, the memory segments only hold ", nMaxSamples.value // 2)
 
         # ----- Set number of captures
         handle = self.chandle
@@ -177,18 +239,56 @@ class Picoscope_Wrapper:
 
     ############## PMD mandatory methods
 
-    def get_the_x_axis(self):
-        print("Tut")
-        return 0
-        # return self.data_transfer.time_data().magnitude
+    def get_the_x_axis(self, nSamples=None):
+        """ Time axis (s) of the last block capture """
+        if nSamples is None: nSamples = self.maxSamples
+        if self.etsMode:
+            # Interleaved ETS sample times, in fs
+            return np.ctypeslib.as_array(self.etsTimeBuffer)[:nSamples] * 1e-15
+        return np.linspace(0, (nSamples-1) * self.timeIntervalns.value * 1e-9, nSamples)
+
 
+    def get_channel_scales(self):
+        """ mV per ADC count of channels A and B, to scale the raw int16 data """
+        return [CHANNEL_INPUT_RANGES_MV[self.chARange] / self.maxADC.value, CHANNEL_INPUT_RANGES_MV[self.chBRange] / self.maxADC.value]
 
-    def start_a_grab_snap(self):
+
+    def start_a_grab_snap(self, raw=False):
+        """ Single block capture
+
+        With raw, channels are the int16 ADC counts, as views on the driver buffers (valid until the next grab), to
+        be scaled with get_channel_scales. Otherwise they are converted to mV.
+        """
+
+        if self.streamingRunning: self.stop_streaming()
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.rapidBufferA is not None: self.setup_single_block()
 
         # ----------
         # Get Data
         # ----------
 
+        t_start = perf_counter()
+
+        # Creates a overflow location for data
+        overflow = (ctypes.c_int16 * 10)()
+        # Creates converted types maxsamples
+        cmaxSamples = ctypes.c_int32(self.maxSamples)
+
+        # ---- Readout parameters
+        start_index = 0
+        pointer_to_number_of_samples = ctypes.byref(cmaxSamples)
+        downsample_ratio = 0
+        downsample_ratio_mode = PS4000a_RATIO_MODE_NONE = 0
+        segmentIndex = 0
+        pointer_to_overflow = ctypes.byref(overflow)
+
+        if self.overlapped:
+            # Deferred readout : the driver copies the data as soon as the capture ends,
+            # saving the GetValues round trip to the scope
+            self.status["getValuesOverlapped"] = ps.ps4000aGetValuesOverlapped(self.chandle, start_index, pointer_to_number_of_samples, downsample_ratio, downsample_ratio_mode, segmentIndex, pointer_to_overflow)
+            assert_pico_ok(self.status["getValuesOverlapped"])
+
         # ----- Run Block Capture
         # This will continue to run until buffer is full, then ps4000aIsReady gives a "go"
         handle = self.chandle
@@ -210,33 +310,719 @@ class Picoscope_Wrapper:
         while ready.value == check.value:
             self.status["isReady"] = ps.ps4000aIsReady(self.chandle, ctypes.byref(ready))
 
-        # Creates a overflow location for data
-        overflow = (ctypes.c_int16 * 10)()
-        # Creates converted types maxsamples
-        cmaxSamples = ctypes.c_int32(self.maxSamples)
+        # ---- Collect data from buffer
+        if not self.overlapped:
+            self.status["getValues"] = ps.ps4000aGetValues(self.chandle, start_index, pointer_to_number_of_samples, downsample_ratio, downsample_ratio_mode, segmentIndex, pointer_to_overflow)
+            assert_pico_ok(self.status["getValues"])
 
+        self.lastGrabDuration = perf_counter() - t_start
 
-        # ---- Collect data from buffer
-        handle = self.chandle
-        start_index = 0
-        pointer_to_number_of_samples = ctypes.byref(cmaxSamples)
-        downsample_ratio = 0
-        downsample_ratio_mode = PS4000a_RATIO_MODE_NONE = 0
-        segmentIndex = 0
-        pointer_to_overflow = ctypes.byref(overflow)
+        # Create time data
+        time = self.get_the_x_axis(cmaxSamples.value)
 
-        self.status["getValues"] = ps.ps4000aGetValues(self.chandle, start_index, pointer_to_number_of_samples, downsample_ratio, downsample_ratio_mode, segmentIndex, pointer_to_overflow)
-        assert_pico_ok(self.status["getValues"])
+        if raw:
+            return time, [np.ctypeslib.as_array(self.bufferA)[:cmaxSamples.value], np.ctypeslib.as_array(self.bufferB)[:cmaxSamples.value]]
 
         # # convert from adc to mV
         channelA_data =  adc2mV(self.bufferA, self.chARange, self.maxADC)
         channelB_data =  adc2mV(self.bufferB, self.chBRange, self.maxADC)
 
-        # Create time data
-        time = np.linspace(0, ((cmaxSamples.value)-1) * self.timeIntervalns.value * 1e-9, cmaxSamples.value)
-
         return time, [np.array(channelA_data), np.array(channelB_data)]
 
+
+    def set_ets(self, mode=0, etsCycles=20, etsInterleave=4):
+        """ Equivalent time sampling, for repetitive signals only
+
+        The scope interleaves etsInterleave sets of samples taken over etsCycles trigger cycles, reaching effective
+        sample intervals well below the real-time one (the timebase is then ignored). The sample times are written in
+        a time buffer that becomes the time axis of start_a_grab_snap.
+
+        Parameters
+        ----------
+        mode: int
+            PS4000A_ETS_MODE, 0 : Off, 1 : Fast, 2 : Slow
+        etsCycles: int
+            number of cycles to store, the driver picks the best etsInterleave of them
+        etsInterleave: int
+            number of interleaved waveforms making one ETS waveform
+        """
+        handle = self.chandle
+        sampleTimePicoseconds = ctypes.c_int32(0)
+        self.status["setEts"] = ps.ps4000aSetEts(handle, mode, etsCycles, etsInterleave, ctypes.byref(sampleTimePicoseconds))
+        assert_pico_ok(self.status["setEts"])
+
+        if mode:
+            self.etsTimeBuffer = (ctypes.c_int64 * self.maxSamples)()
+            self.status["setEtsTimeBuffer"] = ps.ps4000aSetEtsTimeBuffer(handle, ctypes.byref(self.etsTimeBuffer), self.maxSamples)
+            assert_pico_ok(self.status["setEtsTimeBuffer"])
+        else:
+            self.etsTimeBuffer = None
+
+        self.etsMode = mode
+        self.etsSampleTimeps = sampleTimePicoseconds.value
+        print("ETS Mode = ", mode, ",  Effective step size = ", self.etsSampleTimeps * 1e-3, " ns")
+
+
+    def set_frequency_counter(self, enabled=True, fcRange=0, threshold=0., hysteresis=50.):
+        """ Switch both channels to (or back from) the hardware frequency counter
+
+        While enabled, the channel samples are frequencies measured by the scope, maxADC being the full scale of fcRange
+        (PS4000A_FREQUENCY_COUNTER_RANGE, see FREQUENCY_COUNTER_RANGES_HZ). An edge is counted when the signal
+        crosses threshold (mV) +/- hysteresis/2. The trigger is off meanwhile, read_frequencies never waits for one.
+        """
+        if self.workerRunning: self.stop_acquisition_worker()
+        if self.streamingRunning: self.stop_streaming()
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.rapidBufferA is not None: self.setup_single_block()
+        if self.etsMode: self.set_ets(0)
+        handle = self.chandle
+
+        for channel, chRange in enumerate([self.chARange, self.chBRange]):
+            thresholdMajor = mV2adc(threshold + hysteresis/2, chRange, self.maxADC)
+            thresholdMinor = mV2adc(threshold - hysteresis/2, chRange, self.maxADC)
+            self.status["setFrequencyCounter"] = ps.ps4000aSetFrequencyCounter(handle, channel, int(enabled), int(fcRange), thresholdMajor, thresholdMinor)
+            assert_pico_ok(self.status["setFrequencyCounter"])
+
+        if enabled:
+            self.status["trigger"] = ps.ps4000aSetSimpleTrigger(handle, 0, self.trigger_chan_number, 0, 2, 0, 0)
+        else:
+            threshold = mV2adc(self.trigger_threshold, self.chBRange, self.maxADC)
+            self.status["trigger"] = ps.ps4000aSetSimpleTrigger(handle, 1, self.trigger_chan_number, threshold, 2, 0, 1)
+        assert_pico_ok(self.status["trigger"])
+
+        self.frequencyCounterRange = int(fcRange) if enabled else None
+
+
+    def read_frequencies(self, nSamples=100):
+        """ Frequencies (Hz) of channel A and B, mean of the counter readings of a short untriggered capture
+
+        Only nSamples are captured and transferred, not the acquisition window, so readings come at a high rate.
+        """
+        handle = self.chandle
+        nSamples = max(min(int(nSamples), self.maxSamples), 1)
+
+        t_start = perf_counter()
+        self.status["runBlock"] = ps.ps4000aRunBlock(handle, 0, nSamples, self.timebase, None, 0, None, None)
+        assert_pico_ok(self.status["runBlock"])
+        self._wait_ready()
+
+        cmaxSamples = ctypes.c_uint32(nSamples)
+        overflow = ctypes.c_int16(0)
+        self.status["getValues"] = ps.ps4000aGetValues(handle, 0, ctypes.byref(cmaxSamples), 0, 0, 0, ctypes.byref(overflow))
+        assert_pico_ok(self.status["getValues"])
+        self.lastGrabDuration = perf_counter() - t_start
+
+        scale = FREQUENCY_COUNTER_RANGES_HZ[self.frequencyCounterRange] / self.maxADC.value
+        return [np.ctypeslib.as_array(buffer)[:cmaxSamples.value].mean() * scale for buffer in (self.bufferA, self.bufferB)]
+
+
+    def start_a_sweep_snap(self, startFrequency, stopFrequency, nSteps, dwellTime, raw=False):
+        """ Capture a whole frequency response in one run of the generator sweep
+
+        The generator sweeps nSteps frequencies (dwellTime (s) each, waveform of self.sigGen) and is started by the
+        scope trigger, so the capture begins with the first step. The generator has no trigger output per step : a
+        single block spans the sweep and is cut in one segment per step, aligned on the steps to the sample.
+
+        Returns
+        -------
+        time: step time axis (s)
+        frequencies: (nSteps,) Hz
+        channels: [A, B] as (nSteps, samples) arrays in mV, or raw int16 counts (views, valid until the next sweep)
+        """
+        if self.workerRunning: self.stop_acquisition_worker()
+        if self.streamingRunning: self.stop_streaming()
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.rapidBufferA is not None: self.setup_single_block()
+        if self.etsMode: self.set_ets(0)
+        handle = self.chandle
+
+        frequencies = self.sigGen.set_sweep(startFrequency, stopFrequency, nSteps, dwellTime)
+
+        nSteps = len(frequencies)
+        dt = self.timeIntervalns.value * 1e-9
+        samples = max(int(round(dwellTime / dt)), 1)
+        totalSamples = nSteps * samples
+
+        if self.sweepBufferA is None or self.sweepBufferA.size != totalSamples:
+            self.sweepBufferA = np.zeros(totalSamples, dtype=np.int16)
+            self.sweepBufferB = np.zeros(totalSamples, dtype=np.int16)
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, self.sweepBufferA.ctypes.data, totalSamples, 0, mode)
+        assert_pico_ok(self.status["setDataBufferA"])
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, self.sweepBufferB.ctypes.data, totalSamples, 0, mode)
+        assert_pico_ok(self.status["setDataBufferB"])
+
+        t_start = perf_counter()
+        try:
+            self.status["runBlock"] = ps.ps4000aRunBlock(handle, 0, totalSamples, self.timebase, None, 0, None, None)
+            assert_pico_ok(self.status["runBlock"])
+            self._wait_ready()
+
+            cmaxSamples = ctypes.c_uint32(totalSamples)
+            overflow = ctypes.c_int16(0)
+            self.status["getValues"] = ps.ps4000aGetValues(handle, 0, ctypes.byref(cmaxSamples), 0, 0, 0, ctypes.byref(overflow))
+            assert_pico_ok(self.status["getValues"])
+        finally:
+            # Give the data buffers back to start_a_grab_snap
+            self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, ctypes.byref(self.bufferA), self.maxSamples, 0, mode)
+            self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, ctypes.byref(self.bufferB), self.maxSamples, 0, mode)
+        self.lastGrabDuration = perf_counter() - t_start
+
+        time = np.arange(samples) * dt
+        channels = [self.sweepBufferA.reshape(nSteps, samples), self.sweepBufferB.reshape(nSteps, samples)]
+        if raw: return time, frequencies, channels
+
+        scaleA, scaleB = self.get_channel_scales()
+        return time, frequencies, [channels[0] * scaleA, channels[1] * scaleB]
+
+
+    def setup_rapid_block(self, nCaptures, samples=None):
+        """ Split the memory in nCaptures segments, one triggered capture of samples each (default : the single block
+        samples shared between the captures)
+
+        Each channel gets one contiguous (nCaptures, samples) int16 array, every row being registered as the buffer
+        of its segment, so a single GetValuesBulk fills the whole matrix.
+        """
+        if self.etsMode: self.set_ets(0)  # ETS is for single block captures only
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.streamingRunning: self.stop_streaming()
+
+        handle = self.chandle
+        nCaptures = int(nCaptures)
+        samples = self.maxSamples // nCaptures if samples is None else int(samples)
+
+        nMaxSamples = ctypes.c_int32(0)
+        self.status["setMemorySegments"] = ps.ps4000aMemorySegments(handle, nCaptures, ctypes.byref(nMaxSamples))
+        assert_pico_ok(self.status["setMemorySegments"])
+
+        self.status["SetNoOfCaptures"] = ps.ps4000aSetNoOfCaptures(handle, nCaptures)
+        assert_pico_ok(self.status["SetNoOfCaptures"])
+
+        self.rapidBufferA = np.zeros((nCaptures, samples), dtype=np.int16)
+        self.rapidBufferB = np.zeros((nCaptures, samples), dtype=np.int16)
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        for segment in range(nCaptures):
+            self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, self.rapidBufferA[segment].ctypes.data, samples, segment, mode)
+            assert_pico_ok(self.status["setDataBufferA"])
+            self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, self.rapidBufferB[segment].ctypes.data, samples, segment, mode)
+            assert_pico_ok(self.status["setDataBufferB"])
+
+        self.nCaptures = nCaptures
+
+
+    def setup_single_block(self):
+        """ Go back to the single capture configuration of initialize_picoscope """
+        handle = self.chandle
+
+        nMaxSamples = ctypes.c_int32(0)
+        self.status["setMemorySegments"] = ps.ps4000aMemorySegments(handle, self.nSegments, ctypes.byref(nMaxSamples))
+        assert_pico_ok(self.status["setMemorySegments"])
+
+        self.status["SetNoOfCaptures"] = ps.ps4000aSetNoOfCaptures(handle, 1)
+        assert_pico_ok(self.status["SetNoOfCaptures"])
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, ctypes.byref(self.bufferA), self.maxSamples, 0, mode)
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, ctypes.byref(self.bufferB), self.maxSamples, 0, mode)
+
+        self.nCaptures = 1
+        self.rapidBufferA = None
+        self.rapidBufferB = None
+
+
+    def apply_profile(self, profile, resolved=None):
+        """ Reconfigure the open unit for an acquisition profile (see profiles.py)
+
+        Only the driver calls for what differs from the current configuration are made, and the data buffers are only
+        reallocated when the number of samples changes. resolved are the driver values found the first time this
+        profile was applied on this unit : if they still match the profile, GetTimebase2 is not called again.
+
+        Returns the resolved values of the profile, to be cached by the caller.
+        """
+        if self.workerRunning: self.stop_acquisition_worker()
+        if self.streamingRunning: self.stop_streaming()
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.rapidBufferA is not None: self.setup_single_block()
+        handle = self.chandle
+
+        aquire_time = profile["aquisition_time"] * 1e-3
+        sampling_freq = profile["sampling_freq"]
+        postTriggerSamples = int( sampling_freq*1e6 * aquire_time - self.preTriggerSamples)
+        maxSamples = int(self.preTriggerSamples + postTriggerSamples)
+        timebase = int( 80/sampling_freq - 1 )
+        nSegments = int(profile.get("n_segments", self.nSegments))
+
+        # ----- Channels
+        ranges_changed = False
+        for channel, name in enumerate("AB"):
+            chRange = int(profile.get(f"range_{name}", getattr(self, f"ch{name}Range")))
+            if chRange == getattr(self, f"ch{name}Range"): continue
+            self.status[f"setCh{name}"] = ps.ps4000aSetChannel(handle, channel, 1, 1, chRange, 0)
+            assert_pico_ok(self.status[f"setCh{name}"])
+            setattr(self, f"ch{name}Range", chRange)
+            ranges_changed = True
+
+        # ----- Trigger (the threshold depends on the range)
+        trigger_chan = {"A":0, "B":1}[profile.get("trig_chan", "AB"[self.trigger_chan_number])]
+        trigger = profile.get("trig_lvl", self.trigger_threshold)
+        if ranges_changed or trigger_chan != self.trigger_chan_number or trigger != self.trigger_threshold:
+            threshold = mV2adc(trigger, self.chBRange, self.maxADC)
+            self.status["trigger"] = ps.ps4000aSetSimpleTrigger(handle, 1, trigger_chan, threshold, 2, 0, 1)
+            assert_pico_ok(self.status["trigger"])
+            self.trigger_chan_number = trigger_chan
+            self.trigger_threshold = trigger
+
+        # ----- Memory segments
+        if nSegments != self.nSegments:
+            nMaxSamples = ctypes.c_int32(0)
+            self.status["setMemorySegments"] = ps.ps4000aMemorySegments(handle, nSegments, ctypes.byref(nMaxSamples))
+            assert_pico_ok(self.status["setMemorySegments"])
+            self.nSegments = nSegments
+
+        # ----- Timebase, only searched when not resolved yet
+        key = f"{timebase}:{maxSamples}:{nSegments}"
+        if resolved is not None and resolved.get("key") == key:
+            self.timeIntervalns = ctypes.c_float(resolved["time_interval_ns"])
+        else:
+            self.timeIntervalns = ctypes.c_float()
+            returnedMaxSamples = ctypes.c_int32()
+            self.status["getTimebase2"] = ps.ps4000aGetTimebase2(handle, timebase, maxSamples, ctypes.byref(self.timeIntervalns), ctypes.byref(returnedMaxSamples), 0)
+            assert_pico_ok(self.status["getTimebase2"])
+            resolved = {"key": key, "time_interval_ns": self.timeIntervalns.value, "max_samples": returnedMaxSamples.value, "buffer_length": maxSamples}
+
+        # ----- Buffers, only reallocated for a new size
+        if maxSamples != self.maxSamples:
+            if self.etsMode: self.set_ets(0)  # The ETS time buffer has the old size
+            self.bufferA = (ctypes.c_int16 * maxSamples)()
+            self.bufferB = (ctypes.c_int16 * maxSamples)()
+            mode = PS4000A_RATIO_MODE_NONE = 0
+            self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, ctypes.byref(self.bufferA), maxSamples, 0, mode)
+            self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, ctypes.byref(self.bufferB), maxSamples, 0, mode)
+
+        self.aquire_time = aquire_time
+        self.num_points = sampling_freq*1e6 * aquire_time
+        self.sampling_frequency = sampling_freq
+        self.postTriggerSamples = postTriggerSamples
+        self.maxSamples = maxSamples
+        self.timebase = timebase
+
+        return resolved
+
+
+    def plan_segments(self, samples, triggerRate=None, readoutPeriod=None):
+        """ Choose the number of segments of samples each that maximises the captures per readout (see
+        segment_planner.py), and set the rapid block up for it
+
+        triggerRate (Hz) and readoutPeriod (s) bound the count to the triggers expected during one readout period.
+        Returns the SegmentPlan, to be given to start_a_rapid_block_snap.
+        """
+        if self.workerRunning: self.stop_acquisition_worker()
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.streamingRunning: self.stop_streaming()
+        if self.etsMode: self.set_ets(0)
+
+        self.segmentPlan = plan_segments(self.chandle, samples, triggerRate, readoutPeriod)
+        self.setup_rapid_block(self.segmentPlan.segments, self.segmentPlan.samples)
+        print("Segment plan : ", self.segmentPlan)
+        return self.segmentPlan
+
+
+    def segment_samples(self, period):
+        """ Samples of a rapid block segment that fits between two triggers period (s) apart
+
+        A segment must end, and the device re-arm, before the next trigger : a segment as long as the period misses
+        every other trigger.
+        """
+        dt = self.timeIntervalns.value * 1e-9
+        return max(int(period / dt) - ceil(RAPID_BLOCK_REARM_S / dt), RAPID_BLOCK_PRE_TRIGGER_SAMPLES + 1)
+
+
+    def start_a_rapid_block_snap(self, nCaptures, raw=False, samples=None, preTriggerSamples=None):
+        """ Capture nCaptures triggered segments and their trigger time offsets
+
+        Each segment is triggered on its own pulse, a few samples after its start (RAPID_BLOCK_PRE_TRIGGER_SAMPLES)
+        unless preTriggerSamples is given. For periodic triggers the segments must be shorter than the period minus
+        the re-arm time (see segment_samples), so that every pulse gets its segment. The trigger time offsets (s) are
+        the sub-sample times to add to the nominal trigger sample of each segment. samples (per segment) is usually
+        taken from plan_segments.
+
+        Returns
+        -------
+        time: segment time axis (s)
+        channels: [A, B] as (nCaptures, samples) arrays in mV, or raw int16 counts (views, valid until the next grab)
+        trigger_offsets: (nCaptures,) array in s
+        """
+        if self.rapidBufferA is None or self.nCaptures != nCaptures or (samples is not None and self.rapidBufferA.shape[1] != samples):
+            self.setup_rapid_block(nCaptures, samples)
+
+        handle = self.chandle
+        samples = self.rapidBufferA.shape[1]
+        if preTriggerSamples is None: preTriggerSamples = RAPID_BLOCK_PRE_TRIGGER_SAMPLES
+        noOfPreTriggerSamples = min(int(preTriggerSamples), samples)
+        noOfPostTriggerSamples = samples - noOfPreTriggerSamples
+
+        t_start = perf_counter()
+
+        overflow = (ctypes.c_int16 * self.nCaptures)()
+        cmaxSamples = ctypes.c_uint32(samples)
+        if self.overlapped:
+            # Deferred readout of all the segments, done by the driver at the end of the capture
+            self.status["getValuesOverlappedBulk"] = ps.ps4000aGetValuesOverlappedBulk(handle, 0, ctypes.byref(cmaxSamples), 0, 0, 0, self.nCaptures - 1, ctypes.byref(overflow))
+            assert_pico_ok(self.status["getValuesOverlappedBulk"])
+
+        self.status["runBlock"] = ps.ps4000aRunBlock(handle, noOfPreTriggerSamples, noOfPostTriggerSamples, self.timebase, None, 0, None, None)
+        assert_pico_ok(self.status["runBlock"])
+
+        # --- Check for end of capture
+        ready = ctypes.c_int16(0)
+        check = ctypes.c_int16(0)
+        while ready.value == check.value:
+            self.status["isReady"] = ps.ps4000aIsReady(handle, ctypes.byref(ready))
+
+        # ---- Collect all segments at once
+        if not self.overlapped:
+            self.status["getValuesBulk"] = ps.ps4000aGetValuesBulk(handle, ctypes.byref(cmaxSamples), 0, self.nCaptures - 1, 0, 0, ctypes.byref(overflow))
+            assert_pico_ok(self.status["getValuesBulk"])
+
+        self.lastGrabDuration = perf_counter() - t_start
+
+        # ---- Trigger time offsets of every segment
+        times = (ctypes.c_int64 * self.nCaptures)()
+        timeUnits = (ctypes.c_int32 * self.nCaptures)()
+        self.status["getValuesTriggerTimeOffsetBulk"] = ps.ps4000aGetValuesTriggerTimeOffsetBulk64(handle, ctypes.byref(times), ctypes.byref(timeUnits), 0, self.nCaptures - 1)
+        assert_pico_ok(self.status["getValuesTriggerTimeOffsetBulk"])
+        trigger_offsets = np.ctypeslib.as_array(times) * TIME_UNITS_S[np.ctypeslib.as_array(timeUnits)]
+
+        time = np.linspace(0, (samples - 1) * self.timeIntervalns.value * 1e-9, samples)
+
+        if raw: return time, [self.rapidBufferA, self.rapidBufferB], trigger_offsets
+
+        # convert from adc to mV
+        scaleA, scaleB = self.get_channel_scales()
+        return time, [self.rapidBufferA * scaleA, self.rapidBufferB * scaleB], trigger_offsets
+
+    def _arm_pipeline_slot(self, slot):
+        """ Point the data buffers to the given slot and start its capture """
+        handle = self.chandle
+        bufferA, bufferB = self.pipelineBuffers[slot]
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, bufferA.ctypes.data, self.maxSamples, 0, mode)
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, bufferB.ctypes.data, self.maxSamples, 0, mode)
+
+        self.pipelineSamples = ctypes.c_uint32(self.maxSamples)
+        self.pipelineOverflow = ctypes.c_int16(0)
+        if self.overlapped:
+            self.status["getValuesOverlapped"] = ps.ps4000aGetValuesOverlapped(handle, 0, ctypes.byref(self.pipelineSamples), 0, 0, 0, ctypes.byref(self.pipelineOverflow))
+            assert_pico_ok(self.status["getValuesOverlapped"])
+
+        self.status["runBlock"] = ps.ps4000aRunBlock(handle, self.preTriggerSamples, self.postTriggerSamples, self.timebase, None, 0, None, None)
+        assert_pico_ok(self.status["runBlock"])
+        self.pipelineSlot = slot
+        self.pipelineArmTime = perf_counter()
+
+
+    def _wait_ready(self):
+        """ Poll until the armed capture is complete, return the time (perf_counter) it was seen complete """
+        ready = ctypes.c_int16(0)
+        check = ctypes.c_int16(0)
+        while ready.value == check.value:
+            self.status["isReady"] = ps.ps4000aIsReady(self.chandle, ctypes.byref(ready))
+        return perf_counter()
+
+
+    def start_pipeline(self):
+        """ Allocate two buffer slots and arm the first capture """
+        if self.streamingRunning: self.stop_streaming()
+        if self.rapidBufferA is not None: self.setup_single_block()
+
+        self.pipelineBuffers = [[np.zeros(self.maxSamples, dtype=np.int16), np.zeros(self.maxSamples, dtype=np.int16)] for slot in range(2)]
+        self._arm_pipeline_slot(0)
+        self.pipelineRunning = True
+        self.pipelineLastReturn = None
+        self.dutyCycle = None
+
+
+    def stop_pipeline(self):
+        """ Abort the armed capture and give the data buffers back to start_a_grab_snap """
+        handle = self.chandle
+        self.status["stop"] = ps.ps4000aStop(handle)
+        assert_pico_ok(self.status["stop"])
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, ctypes.byref(self.bufferA), self.maxSamples, 0, mode)
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, ctypes.byref(self.bufferB), self.maxSamples, 0, mode)
+
+        self.pipelineRunning = False
+        self.pipelineBuffers = None
+
+
+    def start_a_pipelined_grab(self, raw=False, settleTime=None):
+        """ Read the capture armed by the previous call and immediately arm the next one
+
+        Captures alternate between two buffer slots : the next capture runs on the scope while the caller converts
+        and processes the one returned here, so the scope is no longer idle during processing. The slot itself is only
+        overwritten two grabs later, so raw int16 views stay valid during the processing of this grab.
+        The duty cycle is the fraction of the time between two grabs spent capturing.
+
+        In a scan the capture is armed during the actuator move. With settleTime None it is kept whatever its timing.
+        Otherwise (s) a capture that may have started less than settleTime after this call (i.e. during the move or
+        while settling) is discarded, and the slot is re-armed once settled. The number of discarded captures is
+        counted in discardedCaptures.
+        """
+        t_start = perf_counter()
+        if not self.pipelineRunning:
+            if settleTime: sleep(settleTime)
+            self.start_pipeline()
+
+        # --- Check for end of capture, the earliest start of a capture ending at t_ready is t_ready - capture_time
+        capture_time = self.maxSamples * self.timeIntervalns.value * 1e-9
+        while True:
+            t_ready = self._wait_ready()
+            if settleTime is None or self.pipelineArmTime >= t_start + settleTime or t_ready - capture_time >= t_start + settleTime: break
+
+            self.discardedCaptures += 1
+            sleep(max(t_start + settleTime - perf_counter(), 0))
+            self._arm_pipeline_slot(self.pipelineSlot)
+
+        # ---- Collect data from buffer
+        nSamples = self.pipelineSamples
+        if not self.overlapped:
+            overflow = ctypes.c_int16(0)
+            self.status["getValues"] = ps.ps4000aGetValues(self.chandle, 0, ctypes.byref(nSamples), 0, 0, 0, ctypes.byref(overflow))
+            assert_pico_ok(self.status["getValues"])
+        nSamples = nSamples.value
+
+        # ---- Re-arm at once on the other slot
+        slot = self.pipelineSlot
+        self._arm_pipeline_slot(1 - slot)
+
+        t_return = perf_counter()
+        self.lastGrabDuration = t_return - t_start
+        if self.pipelineLastReturn is not None:
+            capture_time = self.maxSamples * self.timeIntervalns.value * 1e-9
+            self.dutyCycle = min(capture_time / (t_return - self.pipelineLastReturn), 1.)
+        self.pipelineLastReturn = t_return
+
+        bufferA, bufferB = self.pipelineBuffers[slot]
+        time = self.get_the_x_axis(nSamples)
+        if raw: return time, [bufferA[:nSamples], bufferB[:nSamples]]
+
+        # convert from adc to mV
+        scaleA, scaleB = self.get_channel_scales()
+        return time, [bufferA[:nSamples] * scaleA, bufferB[:nSamples] * scaleB]
+
+
+    def start_streaming(self, bufferSize=100000, sampleInterval_ns=None, preTriggerSamples=0, postTriggerSamples=None, autoStop=False):
+        """ Continuous acquisition of channels A and B
+
+        The driver writes the samples in two int16 buffers of bufferSize, used as a ring, and get_streaming_latest
+        copies out what arrived since the previous call. bufferSize must hold the samples arriving between two calls.
+
+        The trigger of the unit (set up in initialize_picoscope) does not gate the streaming, the driver only reports
+        where it fired : its absolute sample index is stored in streamingTriggers. With autoStop, the driver stops by
+        itself preTriggerSamples + postTriggerSamples around the trigger (streamingAutoStopped), a one shot capture.
+
+        Parameters
+        ----------
+        bufferSize: int
+            size of the driver buffers (samples per channel)
+        sampleInterval_ns: int or None
+            requested sample interval, the block mode one if None. The interval actually used by the driver is
+            stored in streamingInterval (s)
+        preTriggerSamples, postTriggerSamples: int
+            samples kept before and after the trigger with autoStop, postTriggerSamples is bufferSize if None
+        autoStop: bool
+            stop after the trigger window instead of running until stop_streaming
+        """
+        if self.pipelineRunning: self.stop_pipeline()
+        if self.rapidBufferA is not None: self.setup_single_block()
+        if self.streamingRunning: self.stop_streaming()
+
+        handle = self.chandle
+        bufferSize = int(bufferSize)
+        self.streamBufferA = np.zeros(bufferSize, dtype=np.int16)
+        self.streamBufferB = np.zeros(bufferSize, dtype=np.int16)
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, self.streamBufferA.ctypes.data, bufferSize, 0, mode)
+        assert_pico_ok(self.status["setDataBufferA"])
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, self.streamBufferB.ctypes.data, bufferSize, 0, mode)
+        assert_pico_ok(self.status["setDataBufferB"])
+
+        if sampleInterval_ns is None: sampleInterval_ns = self.timeIntervalns.value
+        sampleInterval = ctypes.c_int32(int(round(sampleInterval_ns)))
+        sampleUnits = PS4000A_NS = 2
+        maxPreTriggerSamples = int(preTriggerSamples)
+        maxPostTriggerSamples = bufferSize if postTriggerSamples is None else int(postTriggerSamples)
+        autoStopOn = int(autoStop)  # 0 : run until stop_streaming
+        downsampleRatio = 1
+        self.status["runStreaming"] = ps.ps4000aRunStreaming(handle, ctypes.byref(sampleInterval), sampleUnits, maxPreTriggerSamples, maxPostTriggerSamples, autoStopOn, downsampleRatio, mode, bufferSize)
+        assert_pico_ok(self.status["runStreaming"])
+
+        self.streamingInterval = sampleInterval.value * 1e-9
+        self.streamingSamples = 0
+        self.streamingTriggers = []
+        self.streamingAutoStopped = False
+        self._streamingChunks = []
+        self._streamingCallback = ps.StreamingReadyType(self._streaming_ready)
+        self.streamingRunning = True
+
+
+    def _streaming_ready(self, handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, param):
+        """ Driver callback : copy the new samples out of the ring before it wraps, note where the trigger fired """
+        end = startIndex + noOfSamples
+        self._streamingChunks.append((self.streamBufferA[startIndex:end].copy(), self.streamBufferB[startIndex:end].copy()))
+        if triggered: self.streamingTriggers.append(self.streamingSamples + triggerAt)  # triggerAt is relative to startIndex
+        if autoStop: self.streamingAutoStopped = True
+        self.streamingSamples += noOfSamples
+
+
+    def get_streaming_latest(self):
+        """ int16 samples of channels A and B received since the previous call (empty arrays if none yet)
+
+        The driver triggers in these samples are in streamingTriggers, as absolute sample indexes.
+        """
+        self._streamingChunks = []
+        self.streamingTriggers = []
+        self.status["getStreamingLatestValues"] = ps.ps4000aGetStreamingLatestValues(self.chandle, self._streamingCallback, None)
+
+        if not self._streamingChunks: return [np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)]
+        if len(self._streamingChunks) == 1: return list(self._streamingChunks[0])
+        return [np.concatenate([chunk[channel] for chunk in self._streamingChunks]) for channel in range(2)]
+
+
+    def stop_streaming(self):
+        """ Stop the streaming and give the data buffers back to start_a_grab_snap """
+        handle = self.chandle
+        self.status["stop"] = ps.ps4000aStop(handle)
+        assert_pico_ok(self.status["stop"])
+
+        mode = PS4000A_RATIO_MODE_NONE = 0
+        self.status["setDataBufferA"] = ps.ps4000aSetDataBuffer(handle, 0, ctypes.byref(self.bufferA), self.maxSamples, 0, mode)
+        self.status["setDataBufferB"] = ps.ps4000aSetDataBuffer(handle, 1, ctypes.byref(self.bufferB), self.maxSamples, 0, mode)
+
+        self.streamingRunning = False
+        self.streamBufferA = None
+        self.streamBufferB = None
+        self._streamingCallback = None
+
+
+    def start_acquisition_worker(self, depth=4, latestOnly=False, pipelined=False):
+        """ Acquire continuously in a worker thread, feeding a queue read with get_acquired
+
+        The consumer no longer sets the acquisition pace. When the queue holds depth captures, the worker either waits
+        for the consumer (latestOnly False, no capture lost, for saving) or drops the oldest capture (latestOnly True,
+        for display). While the worker runs, no other acquisition method must be called.
+
+        Parameters
+        ----------
+        depth: int
+            maximum number of captures waiting in the queue
+        latestOnly: bool
+            drop policy, see above
+        pipelined: bool
+            capture with start_a_pipelined_grab instead of start_a_grab_snap
+        """
+        if self.workerRunning: self.stop_acquisition_worker()
+
+        self.workerQueue = queue.Queue(maxsize=max(int(depth), 1))
+        self.workerLatestOnly = latestOnly
+        self.workerAcquired = 0
+        self.workerDropped = 0
+        self.workerError = None
+        self._workerStop.clear()
+        self._workerThread = threading.Thread(target=self._acquisition_loop, args=(pipelined,), name='picoscope_acquisition', daemon=True)
+        self.workerRunning = True
+        self._workerThread.start()
+
+
+    def _acquisition_loop(self, pipelined):
+        try:
+            while not self._workerStop.is_set():
+                time, channels = self.start_a_pipelined_grab(raw=True) if pipelined else self.start_a_grab_snap(raw=True)
+                # The driver buffers are reused by the next capture
+                capture = (time, [channel.copy() for channel in channels])
+                self.workerAcquired += 1
+
+                if self.workerLatestOnly:
+                    while True:
+                        try:
+                            self.workerQueue.put_nowait(capture)
+                            break
+                        except queue.Full:
+                            try:
+                                self.workerQueue.get_nowait()
+                                self.workerDropped += 1
+                            except queue.Empty: pass
+                else:
+                    while not self._workerStop.is_set():
+                        try:
+                            self.workerQueue.put(capture, timeout=0.1)
+                            break
+                        except queue.Full: pass
+        except Exception as e:
+            self.workerError = e  # raised by get_acquired, forgotten when the worker is started again
+        finally:
+            if self.pipelineRunning: self.stop_pipeline()
+            self.workerRunning = False
+
+
+    def get_acquired(self, timeout=None):
+        """ Next capture of the worker : time, [A, B] in int16 counts (scale with get_channel_scales)
+
+        With latestOnly the newest capture is returned and the older ones waiting in the queue are dropped.
+        Errors of the worker are raised here.
+        """
+        t_start = perf_counter()
+        while True:
+            if self.workerError is not None: raise self.workerError
+            try:
+                capture = self.workerQueue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if not self.workerRunning: raise RuntimeError("Acquisition worker not running")
+                if timeout is not None and perf_counter() - t_start > timeout: raise TimeoutError("No capture from the acquisition worker")
+
+        if self.workerLatestOnly:
+            while True:
+                try:
+                    capture = self.workerQueue.get_nowait()
+                    self.workerDropped += 1
+                except queue.Empty: break
+        return capture
+
+
+    def stop_acquisition_worker(self):
+        """ Stop the worker after its current capture and forget the captures still queued """
+        self._workerStop.set()
+        if self._workerThread is not None: self._workerThread.join()
+        self._workerThread = None
+        self.workerRunning = False
+
+
+    def measure_overlapped_gain(self, nGrabs=20):
+        """ Time nGrabs grabs with the serial then the overlapped readout
+
+        Returns
+        -------
+        serial, overlapped: mean capture + readout duration of a grab (s) in each mode
+        """
+        overlapped = self.overlapped
+        durations = []
+        for mode in [False, True]:
+            self.overlapped = mode
+            grab_durations = []
+            for i in range(nGrabs):
+                self.start_a_grab_snap()
+                grab_durations.append(self.lastGrabDuration)
+            durations.append(np.mean(grab_durations))
+        self.overlapped = overlapped
+
+        return durations[0], durations[1]
+
+
     def set_timebase(self, aquire_time=None, sampling_freq=None):
         if aquire_time: self.num_points = self.sampling_frequency*1e6 *aquire_time
         elif sampling_freq: self.num_points = sampling_freq*1e6 *self.aquire_time
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory history of the last Picoscope captures
+
+@author: dqml-lab
+"""
+import numpy as np
+
+
+class CaptureHistory:
+    """ Ring of the last depth captures of several channels, kept as int16 ADC counts in one preallocated array
+
+    The running sum and the persistence histogram (amplitude bin vs sample) are updated incrementally : the newest
+    capture is added and the one it overwrites is removed, so appending costs O(samples) whatever the depth.
+    Min/max envelopes are computed over the ring on request only.
+
+    Parameters
+    ----------
+    depth: int
+        number of captures kept
+    nChannels, nSamples: int
+        shape of one capture
+    nBins: int
+        number of amplitude bins of the persistence, rounded to a power of two so a bin is a bit shift of the counts
+    """
+
+    def __init__(self, depth, nChannels, nSamples, nBins=256) -> None:
+        self.depth = int(depth)
+        self.shape = (nChannels, nSamples)
+
+        self._shift = 16 - min(max(int(round(np.log2(nBins))), 1), 16)
+        self.nBins = 2 ** (16 - self._shift)
+
+        self.ring = np.zeros((self.depth, nChannels, nSamples), dtype=np.int16)
+        self.count = 0
+        self.index = 0  # next row of the ring to write
+
+        self._sum = np.zeros((nChannels, nSamples), dtype=np.int64)
+        self.persistence = np.zeros((nChannels, self.nBins, nSamples), dtype=np.int32)
+
+        # Flat persistence index of every (channel, sample) in bin 0
+        self._base_index = np.arange(nChannels)[:, None] * self.nBins * nSamples + np.arange(nSamples)[None, :]
+
+    def _persistence_index(self, capture):
+        bins = (capture.astype(np.int32) + 32768) >> self._shift
+        return self._base_index + bins * self.shape[1]
+
+    def append(self, channels):
+        """ Add a capture, given as one int16 array per channel """
+        persistence = self.persistence.reshape(-1)
+        row = self.ring[self.index]
+
+        if self.count == self.depth:
+            # Forget the capture about to be overwritten
+            self._sum -= row
+            np.add.at(persistence, self._persistence_index(row), -1)
+        else:
+            self.count += 1
+
+        for channel, data in enumerate(channels):
+            row[channel] = data
+        self._sum += row
+        np.add.at(persistence, self._persistence_index(row), 1)
+
+        self.index = (self.index + 1) % self.depth
+
+    def average(self):
+        """ Mean of the captures in the ring, (nChannels, nSamples) in counts """
+        return self._sum / max(self.count, 1)
+
+    def envelope(self):
+        """ Min and max of the captures in the ring, (nChannels, nSamples) int16 each """
+        captures = self.ring[:self.count]
+        return captures.min(axis=0), captures.max(axis=0)
+
+    def bin_centers(self):
+        """ Amplitude of the persistence bins, in counts """
+        return (np.arange(self.nBins) + 0.5) * 2 ** self._shift - 32768
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Enumeration of the connected Picoscope units, without opening them
+
+@author: dqml-lab
+"""
+import ctypes
+
+from picosdk.functions import assert_pico_ok
+
+
+FIRST_FREE = "First Free"
+
+_serials = {}  # pico_type : serial numbers found by the last enumeration
+
+
+def _enumerate_function(pico_type):
+    if pico_type == "Picoscope 4000a":
+        from picosdk.ps4000a import ps4000a
+        return ps4000a.ps4000aEnumerateUnits
+    if pico_type == "Picoscope 4000":
+        from picosdk.ps4000 import ps4000
+        return ps4000.ps4000EnumerateUnits
+    raise ValueError(f"No enumeration for {pico_type}")
+
+
+def enumerate_units(pico_type="Picoscope 4000a", refresh=False):
+    """ Serial numbers of the units of one series connected to this computer
+
+    Only the driver of this series is asked (EnumerateUnits), no unit is opened, so the units stay free for the other
+    plugins. The result is cached, refresh=True enumerates again (units plugged or unplugged since).
+    """
+    if refresh or pico_type not in _serials:
+        count = ctypes.c_int16(0)
+        serials = ctypes.create_string_buffer(256)
+        serialLth = ctypes.c_int16(len(serials))
+        assert_pico_ok(_enumerate_function(pico_type)(ctypes.byref(count), serials, ctypes.byref(serialLth)))
+
+        _serials[pico_type] = [serial for serial in serials.value.decode().split(',') if serial][:count.value]
+
+    return list(_serials[pico_type])
+
+
+def serial_items(pico_type="Picoscope 4000a", refresh=False):
+    """ Choices of the serial number setting of the plugins, FIRST_FREE then the enumerated units """
+    try:
+        return [FIRST_FREE] + enumerate_units(pico_type, refresh)
+    except Exception as e:
+        print("Enumeration of the ", pico_type, " units failed : ", e)
+        return [FIRST_FREE]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of the open Picoscope 4000a units
+
+@author: dqml-lab
+"""
+import atexit
+import ctypes
+import threading
+from time import sleep
+
+from picosdk.ps4000a import ps4000a as ps
+from picosdk.functions import assert_pico_ok
+
+
+PICO_OK = 0
+PICO_BATCH_AND_SERIAL = 4
+
+
+class HandleCache:
+    """ Keep the ps4000a units open from one Picoscope_Wrapper to the next, keyed by serial number
+
+    Opening a unit enumerates the USB devices and loads the firmware, which takes seconds, and reloading a detector
+    builds a new wrapper. The wrappers take their handle here and give it back when deleted, the unit stays open and
+    the next wrapper gets it at once. Handles are reference counted, a unit no wrapper uses is closed after
+    idleTimeout (s). A cached handle is pinged before being handed out : the unit is only opened again if it was lost
+    (unplugged, powered off).
+
+    Units are opened with ps4000aOpenUnitAsync and polled with ps4000aOpenUnitProgress, without holding the cache
+    lock : the calling thread can report the progress, and the other plugins keep their access to the cache. The
+    driver boots one unit at a time, the next open is started as soon as the previous one is done.
+    """
+
+    def __init__(self, idleTimeout=300.) -> None:
+        self.idleTimeout = idleTimeout
+        self._lock = threading.Condition(threading.RLock())
+        self._units = {}  # serial : {"handle", "references", "timer"}
+        self._opening = set()  # serials being opened
+
+    def acquire(self, serial=None, progress=None):
+        """ Open (or take from the cache) the unit with this serial, any free unit if None
+
+        progress, if given, is called with the open progress (%) while the unit boots
+
+        Returns
+        -------
+        handle: ctypes.c_int16
+        serial: str
+        reused: bool
+            True if the unit was already open, its settings are then the ones left by the previous wrapper
+        """
+        with self._lock:
+            while serial is not None and serial in self._opening: self._lock.wait()   # Opened by another plugin
+
+            for key, unit in self._units.items():
+                if serial is None and unit["references"] > 0: continue   # Do not share a unit nobody asked for
+                if serial is not None and key != serial: continue
+
+                if self._ping(unit["handle"]):
+                    self._hold(unit)
+                    print("Picoscope ", key, " taken from the handle cache")
+                    return unit["handle"], key, True
+
+                print("Picoscope ", key, " lost, opening it again")
+                self._forget(key)
+                break
+
+            self._opening.add(serial)
+
+        try:
+            handle = self._open(serial, progress)
+            found = self._serial(handle)
+        finally:
+            with self._lock:
+                self._opening.discard(serial)
+                self._lock.notify_all()
+
+        with self._lock:
+            unit = self._units[found] = {"handle": handle, "references": 0, "timer": None}
+            self._hold(unit)
+            return handle, found, False
+
+    def release(self, serial):
+        """ Give the handle back, the unit is closed once unused for idleTimeout """
+        with self._lock:
+            unit = self._units.get(serial)
+            if unit is None: return
+            unit["references"] = max(unit["references"] - 1, 0)
+            if unit["references"] == 0:
+                unit["timer"] = threading.Timer(self.idleTimeout, self._close_idle, args=(serial, unit))
+                unit["timer"].daemon = True
+                unit["timer"].start()
+
+    def close_all(self):
+        """ Close every cached unit, in use or not """
+        with self._lock:
+            for serial in list(self._units): self._forget(serial)
+
+    # ----- Internal
+
+    def _hold(self, unit):
+        unit["references"] += 1
+        if unit["timer"] is not None: unit["timer"].cancel()
+        unit["timer"] = None
+
+    def _close_idle(self, serial, unit):
+        with self._lock:
+            if self._units.get(serial) is unit and unit["references"] == 0:
+                print("Picoscope ", serial, " idle, closing it")
+                self._forget(serial)
+
+    def _forget(self, serial):
+        """ Close the unit (errors ignored, it may be gone) and remove it from the cache """
+        unit = self._units.pop(serial)
+        if unit["timer"] is not None: unit["timer"].cancel()
+        ps.ps4000aStop(unit["handle"])
+        ps.ps4000aCloseUnit(unit["handle"])
+
+    @staticmethod
+    def _ping(handle):
+        return ps.ps4000aPingUnit(handle) == PICO_OK
+
+    @staticmethod
+    def _open(serial, progress=None):
+        """ Open a unit without blocking in the driver, switching to the USB power source when the unit asks for it """
+        serial = None if serial is None else serial.encode()
+
+        # Only one unit boots at a time, wait for the end of the other opens
+        started = ctypes.c_int16(0)
+        while True:
+            assert_pico_ok(ps.ps4000aOpenUnitAsync(ctypes.byref(started), serial))
+            if started.value: break
+            sleep(0.1)
+
+        handle = ctypes.c_int16()
+        percent = ctypes.c_int16(0)
+        complete = ctypes.c_int16(0)
+        reported = None
+        while True:
+            status = ps.ps4000aOpenUnitProgress(ctypes.byref(handle), ctypes.byref(percent), ctypes.byref(complete))
+            if progress is not None and percent.value != reported:
+                reported = percent.value
+                progress(reported)
+            if complete.value or status != PICO_OK: break
+            sleep(0.05)
+
+        # Check power Status
+        try:
+            assert_pico_ok(status)
+        except: # PicoNotOkError:
+            if status in [282, 286]:
+                assert_pico_ok(ps.ps4000aChangePowerSource(handle, status))
+            else:
+                raise
+        return handle
+
+    @staticmethod
+    def _serial(handle):
+        serial = ctypes.create_string_buffer(32)
+        requiredSize = ctypes.c_int16(0)
+        assert_pico_ok(ps.ps4000aGetUnitInfo(handle, serial, len(serial), ctypes.byref(requiredSize), PICO_BATCH_AND_SERIAL))
+        return serial.value.decode()
+
+
+handle_cache = HandleCache()
+atexit.register(handle_cache.close_all)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Lock-in helpers shared by the Picoscope plugins
+
+@author: dqml-lab
+"""
+from math import sqrt
+
+import numpy as np
+
+
+class RunningStatistics:
+    """ Online (Welford) mean and variance of a scalar, accumulated grab after grab
+
+    Only the count, the mean and the sum of squared deviations are kept, so updating is O(1) and no
+    history of previous grabs is needed.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2: return float('nan')
+        return self._m2 / (self.count - 1)
+
+    @property
+    def standard_error(self):
+        if self.count < 2: return float('nan')
+        return sqrt(self.variance / self.count)
+
+
+def align_segments(segments, shifts):
+    """ Read every row of segments shifted by its own (fractional) number of samples
+
+    Row i is linearly interpolated at positions k + shifts[i]. The gather uses index arrays built from a single
+    arange, so all pulses are aligned at once without a Python loop. Positions outside the row are clamped to its
+    edges. Raw int16 counts are interpolated in float64, their differences do not fit in int16.
+    """
+    segments = np.asarray(segments, dtype=np.float64)
+    width = segments.shape[1]
+
+    positions = np.clip(np.arange(width)[None, :] + np.asarray(shifts)[:, None], 0, width - 1)
+    index = np.minimum(positions.astype(np.intp), width - 2)
+    frac = positions - index
+
+    left = np.take_along_axis(segments, index, axis=1)
+    right = np.take_along_axis(segments, index + 1, axis=1)
+    return left + frac * (right - left)
+
+
+def pulse_matrix(traces, starts, lengths):
+    """ Gather the pulses [starts, starts + lengths) of traces into a zero padded matrix
+
+    traces can hold several channels sampled together (channels, samples), they then share the same index array and
+    the result is (channels, pulses, max(lengths)). Padding is zero so that sums over a row are unaffected. Without
+    any pulse the matrix is empty, (channels, 0, 0).
+    """
+    if len(lengths) == 0: return np.zeros(traces.shape[:-1] + (0, 0), dtype=traces.dtype)
+    columns = np.arange(lengths.max())
+    index = np.minimum(starts[:, None] + columns[None, :], traces.shape[-1] - 1)
+    valid = columns[None, :] < lengths[:, None]
+    return np.where(valid, traces[..., index], 0)
+
+
+def fixed_width_pulses(channels, number_of_pulses):
+    """ Cut channels (channels, samples) into number_of_pulses equal pulses, (channels, number_of_pulses, width)
+
+    The samples left after the last complete pulse are ignored.
+    """
+    channels = np.asarray(channels)
+    width_of_pulse = channels.shape[-1] // number_of_pulses if number_of_pulses > 0 else 0
+    return channels[..., :number_of_pulses * width_of_pulse].reshape(channels.shape[:-1] + (number_of_pulses, width_of_pulse))
+
+
+def pulse_integrals(pulses, lengths=None):
+    """ Background removed integral of every pulse of pulses (..., pulses, width) : its second half minus its first
+
+    With lengths (zero padded pulses of pulse_matrix), the halves are those of each pulse length and the padding sums
+    to zero. Integer counts are summed exactly in int64, so only the integrals need scaling.
+    """
+    pulses = np.asarray(pulses)
+    acc = np.int64 if np.issubdtype(pulses.dtype, np.integer) else np.float64
+    if lengths is None:
+        half = pulses.shape[-1] // 2
+        return np.sum(pulses[..., half:], axis=-1, dtype=acc) - np.sum(pulses[..., :half], axis=-1, dtype=acc)
+    background = np.arange(pulses.shape[-1]) < (np.asarray(lengths) // 2)[:, None]
+    return np.sum(pulses, axis=-1, dtype=acc) - 2 * np.sum(pulses, axis=-1, dtype=acc, where=background)
+
+
+def nd_bd_cycles(ND, number_of_B, width_of_B):
+    """ ND_Bd of every B cycle : mean difference between the ND of a B step and of the next one
+
+    ND holds one normalised value per pulse, cut into number_of_B steps of width_of_B pulses. The pulses after the
+    last step and an unpaired last step are dropped. Raises ValueError without two complete B steps.
+    """
+    if number_of_B < 2 or width_of_B < 1 or len(ND) < 2 * width_of_B:
+        raise ValueError(f'{len(ND)} pulses do not hold two B steps of {width_of_B} pulses')
+    number_of_B = min(number_of_B, len(ND) // width_of_B)
+    ND_reshaped = np.asarray(ND)[:number_of_B * width_of_B].reshape(number_of_B, width_of_B)
+    if len(ND_reshaped) % 2 != 0: ND_reshaped = ND_reshaped[:-1]
+    return np.mean( ND_reshaped[::2] - ND_reshaped[1::2], axis=1 )
+
+
+def fixed_width_nd_bd(channels, number_of_pulses, number_of_B, scales=(1., 1.)):
+    """ ND_Bd of a trace of number_of_pulses equal pulses, modulated by number_of_B equal B steps
+
+    channels is (2, samples), channel A and the reference B in counts or mV. A is normalised by B pulse by pulse, and
+    ND_Bd is the mean difference between consecutive B steps. Raises ValueError without two complete B steps.
+    """
+    if number_of_B < 1: raise ValueError('No B step in the trace')
+    values = pulse_integrals(fixed_width_pulses(channels, number_of_pulses))
+    ND = (values[0] * scales[0]) / (values[1] * scales[1])
+    return np.mean( nd_bd_cycles(ND, number_of_B, number_of_pulses // number_of_B) )
+
+
+class PulseFinder:
+    """ Locate the pulses of a trace from the rising edges of its reference channel
+
+    A rising edge is a crossing of threshold by a signal that went below threshold - hysteresis since the previous
+    edge. Once found, the pulse period is cached: next grabs only look for the first edge and for the last predicted
+    one, and the whole trace is searched again only if the prediction drifted by more than tolerance (fraction of the
+    period).
+    """
+
+    def __init__(self, threshold=500., hysteresis=50., tolerance=0.01) -> None:
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.tolerance = tolerance
+        self.period = None  # samples
+
+    def reset(self):
+        self.period = None
+
+    def find_edges(self, reference, scale=1.):
+        """ Indices of all the rising edges of reference, given in units of threshold / scale (e.g. raw counts) """
+        marks = np.zeros(reference.shape, dtype=np.int8)
+        marks[reference > self.threshold / scale] = 1
+        marks[reference < (self.threshold - self.hysteresis) / scale] = -1
+
+        # Forward fill the last crossed level (Schmitt trigger state), an edge is a change from low to high
+        last_mark = np.maximum.accumulate(np.where(marks != 0, np.arange(marks.size), 0))
+        state = marks[last_mark]
+        return np.flatnonzero(np.diff(state) == 2) + 1
+
+    def _predicted_edges(self, reference, scale):
+        """ Edges from the cached period, or None if there is no edge or the last one drifted too much """
+        period = self.period
+        first = self.find_edges(reference[:int(2 * period)], scale)
+        if first.size == 0: return None
+        first = first[0]
+
+        number_of_edges = int((reference.size - 1 - first) / period) + 1
+        if number_of_edges < 2: return None
+        predicted_last = first + (number_of_edges - 1) * period
+
+        # Look for the last edge around its predicted position only
+        window_start = max(int(predicted_last - period / 2), 0)
+        last = self.find_edges(reference[window_start:int(predicted_last + period / 2)], scale)
+        if last.size == 0: return None
+        last = last[0] + window_start
+        if abs(last - predicted_last) > self.tolerance * period: return None
+
+        # Follow slow drifts of the period
+        self.period = (last - first) / (number_of_edges - 1)
+        return np.rint(first + np.arange(number_of_edges) * self.period).astype(np.intp)
+
+    def find_pulses(self, reference, scale=1.):
+        """ Start and length of every complete pulse of reference
+
+        Pulses are centered on their edge (first half background, second half signal) and run up to the next pulse.
+        scale converts reference to the units of the thresholds, so raw ADC counts can be searched without scaling
+        the whole trace.
+
+        Returns
+        -------
+        starts: ndarray of int
+        lengths: ndarray of int
+            both empty when the reference has less than two edges (no period to cut the pulses with)
+        """
+        edges = None
+        if self.period is not None: edges = self._predicted_edges(reference, scale)
+        if edges is None:
+            edges = self.find_edges(reference, scale)
+            if edges.size < 2: return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+            self.period = (edges[-1] - edges[0]) / (edges.size - 1)
+
+        starts = edges - int(round(self.period / 2))
+        ends = np.append(starts[1:], starts[-1] + int(round(self.period)))
+        keep = (starts >= 0) & (ends <= reference.size)
+        return starts[keep], (ends - starts)[keep]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Scalar measurements of Picoscope traces
+
+@author: dqml-lab
+"""
+import numpy as np
+
+
+MEASUREMENTS = ["Mean", "RMS", "Peak to Peak", "Min", "Max", "Gated Integral"]
+
+
+def channel_measurements(channels, scales=(1., 1.), dt=1., gate=None):
+    """ Mean, RMS, peak to peak, min, max and gated integral of every channel
+
+    The channels are stacked once and each statistic is a single reduction along the samples of all channels
+    together. Integer ADC counts are accumulated exactly in int64 (sum and sum of squares) and only the resulting
+    scalars are scaled.
+
+    Parameters
+    ----------
+    channels: list of ndarray
+        one trace per channel, all the same length
+    scales: sequence of float
+        unit per count of each channel (mV)
+    dt: float
+        sample interval (s), the integral is in unit.s
+    gate: slice or None
+        samples of the gated integral, the whole trace if None
+
+    Returns
+    -------
+    dict: MEASUREMENTS names to an array of one value per channel
+    """
+    data = np.stack(channels)
+    scales = np.asarray(scales, dtype=np.float64)
+    acc = np.int64 if np.issubdtype(data.dtype, np.integer) else np.float64
+    nSamples = data.shape[-1]
+
+    total = np.sum(data, axis=-1, dtype=acc)
+    squares = np.einsum('ij,ij->i', data, data, dtype=acc)
+    minimum = data.min(axis=-1)
+    maximum = data.max(axis=-1)
+    gated = total if gate is None else np.sum(data[:, gate], axis=-1, dtype=acc)
+
+    return {"Mean": total * scales / nSamples,
+            "RMS": np.sqrt(squares / nSamples) * scales,
+            "Peak to Peak": (maximum.astype(np.float64) - minimum) * scales,
+            "Min": minimum * scales,
+            "Max": maximum * scales,
+            "Gated Integral": gated * scales * dt}
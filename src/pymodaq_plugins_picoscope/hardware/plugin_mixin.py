@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Settings helpers shared by the Picoscope plugins
+
+@author: dqml-lab
+"""
+from pymodaq.utils.daq_utils import ThreadCommand
+
+from .discovery import FIRST_FREE, serial_items
+from .profiles import profile_names, load_profile, save_profile, load_resolved, store_resolved, profile_from_settings, settings_from_profile
+
+
+class PicoscopePluginMixin:
+    """ Unit selection, open progress, profiles and pipelined settle time of the Picoscope plugins
+
+    Mixed in before DAQ_Viewer_base or DAQ_Move_base. Each helper only uses the settings it is about : 'serial' (and
+    'pico_type' if the plugin has it), the 'profile_param' group, the 'readout_param' premove and settle_time.
+    A plugin drops what depends on the previous configuration of the unit in profile_applied.
+    """
+
+    def pico_series(self):
+        """Series of the units listed in the serial number setting"""
+        return self.settings.child('pico_type').value()["selected"][0]
+
+
+    def detect_units(self, refresh=False):
+        """List the connected units of the series (without opening them) in the serial number setting"""
+        items = serial_items(self.pico_series(), refresh)
+        selected = self.settings.child('serial').value()['selected']
+        if not selected or selected[0] not in items: selected = [FIRST_FREE]
+        self.settings.child('serial').setValue( dict(all_items=items, selected=selected) )
+
+
+    def selected_serial(self):
+        """Serial number to open, None for the first free unit"""
+        selected = self.settings.child('serial').value()['selected']
+        return None if not selected or selected[0] == FIRST_FREE else selected[0]
+
+
+    def report_open_progress(self, percent):
+        """Status bar progress of the unit boot, called while the unit opens"""
+        self.emit_status(ThreadCommand('Update_Status', [f'Opening Picoscope : {percent} %']))
+
+
+    def settle_time(self):
+        """Settle time (s) given to the pipelined grab, None to keep the captures armed during the moves"""
+        if self.settings.child('readout_param', 'premove').value()['selected'][0] == "Keep": return None
+        return self.settings.child('readout_param', 'settle_time').value() * 1e-3
+
+
+    def apply_profile(self):
+        """Load the selected profile in the settings, and configure the open 4000a unit with it without reloading"""
+        selected = self.settings.child('profile_param', 'profile').value()['selected']
+        if not selected: return
+        profile = load_profile(selected[0])
+        settings_from_profile(self.settings, profile)
+
+        if hasattr(self.controller, 'apply_profile'):
+            resolved = self.controller.apply_profile(profile, load_resolved(selected[0], self.controller.serial))
+            store_resolved(selected[0], self.controller.serial, resolved)
+            self.profile_applied()
+        elif self.controller is not None:
+            self.emit_status(ThreadCommand('Update_Status', ['Profile loaded in the settings, reload the detector to apply it']))
+
+
+    def profile_applied(self):
+        """Called once a profile configured the open unit"""
+        pass
+
+
+    def save_profile(self):
+        """Save the current settings as a profile, under the new name or over the selected profile"""
+        name = self.settings.child('profile_param', 'profile_name').value().strip()
+        if not name:
+            selected = self.settings.child('profile_param', 'profile').value()['selected']
+            if not selected: return
+            name = selected[0]
+        save_profile(name, profile_from_settings(self.settings, self.controller))
+        self.settings.child('profile_param', 'profile').setValue( dict(all_items=profile_names(), selected=[name]) )
+        self.settings.child('profile_param', 'profile_name').setValue( '' )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Processing of Picoscope captures off the acquisition thread
+
+@author: dqml-lab
+"""
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ProcessingQueue:
+    """ Process captures on a worker thread, fed by a bounded queue
+
+    Jobs run one at a time and in submission order, so the processing may keep state from one capture to the next
+    (running statistics, pulse finder). The results come back to the submitting thread : submit returns the future of
+    the job, and take_latest waits for the most recent result. Nothing is emitted from the worker thread.
+
+    When depth jobs are already in the queue, submit either waits for the oldest one to be processed (policy "Block",
+    no capture is lost) or drops the oldest one not started yet (policy "Drop Oldest", for display only outputs,
+    acquisition never waits for the processing).
+
+    NumPy releases the GIL in its heavy loops, so the processing really runs in parallel with the acquisition.
+
+    Parameters
+    ----------
+    function: callable
+        processing of one capture, called with the arguments given to submit
+    depth: int
+        maximum number of jobs queued or running
+    dropOldest: bool
+        policy when the queue is full
+    """
+
+    def __init__(self, function, depth=2, dropOldest=False) -> None:
+        self.function = function
+        self.depth = max(int(depth), 1)
+        self.dropOldest = dropOldest
+
+        self.processed = 0
+        self.dropped = 0
+        self.processedEvent = threading.Event()  # set each time a job is processed, cleared by take_latest
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='picoscope_processing')
+        self._jobs = deque()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._latest = None
+
+    @property
+    def queued(self):
+        """ Number of jobs submitted and not processed yet """
+        self._collect()
+        return len(self._jobs)
+
+    def _collect(self):
+        """ Forget the finished jobs, raising the error of a failed one on the caller thread """
+        while self._jobs and self._jobs[0].done():
+            job = self._jobs.popleft()
+            if not job.cancelled() and job.exception() is not None: raise job.exception()
+
+    def _run(self, args):
+        try:
+            return self.function(*args)
+        except Exception:
+            traceback.print_exc()
+            raise
+
+    def _done(self, job, generation):
+        """ Signal a processed job, called once its future holds the result or the error """
+        if job.cancelled(): return
+        self.processed += 1
+        # Jobs submitted before clear are processed for nothing, their result would belong to a stopped grab
+        if generation != self._generation: return
+        with self._lock:
+            if job.exception() is None: self._latest = job.result()
+            self.processedEvent.set()
+
+    def submit(self, *args):
+        """ Queue the processing of one capture, the arguments must not be modified afterwards. Returns its future """
+        self._collect()
+        while len(self._jobs) >= self.depth:
+            if self.dropOldest:
+                waiting = [job for job in self._jobs if not job.running()]
+                if waiting and waiting[0].cancel():
+                    self._jobs.remove(waiting[0])
+                    self.dropped += 1
+                    continue
+            self._jobs[0].result()
+            self._collect()
+
+        generation = self._generation
+        job = self._executor.submit(self._run, args)
+        self._jobs.append(job)
+        job.add_done_callback(lambda job: self._done(job, generation))
+        return job
+
+    def take_latest(self):
+        """ Wait for a job to be processed and return the most recent result not taken yet
+
+        The results of the jobs processed in the meantime are skipped. The error of a failed job is raised here.
+        """
+        while True:
+            self.processedEvent.wait()
+            with self._lock:
+                result, self._latest = self._latest, None
+                self.processedEvent.clear()
+            self._collect()
+            if result is not None: return result
+
+    def clear(self):
+        """ Drop the queued jobs and ignore the result of the running one """
+        self._generation += 1
+        for job in self._jobs: job.cancel()
+        self._jobs.clear()
+        with self._lock:
+            self._latest = None
+            self.processedEvent.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=True)
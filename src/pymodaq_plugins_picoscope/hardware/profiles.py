@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Named acquisition profiles of the Picoscope plugins, persisted in the plugin configuration
+
+A profile is a [profiles.<name>] table of the plugin config (see resources/config_template.toml) :
+aquisition_time (ms), sampling_freq (MHz), n_segments, range_A, range_B, trig_chan, trig_lvl (mV) and
+processing_mode. Its resolved driver values are cached per unit serial in [profiles.<name>.resolved].
+
+@author: dqml-lab
+"""
+from .. import config
+
+
+PROFILE_KEYS = ["aquisition_time", "sampling_freq", "n_segments", "range_A", "range_B", "trig_chan", "trig_lvl", "processing_mode"]
+
+
+def profile_names():
+    try:
+        return config.get_children('profiles')
+    except Exception:
+        return []
+
+
+def load_profile(name):
+    """ Settings of the profile, without its resolved values """
+    return {key: value for key, value in config('profiles', name).items() if key in PROFILE_KEYS}
+
+
+def save_profile(name, profile):
+    """ Store (or replace) a profile, the resolved values of a replaced profile are dropped """
+    config['profiles', name] = None
+    for key in PROFILE_KEYS:
+        if key in profile: config['profiles', name, key] = profile[key]
+    config.save()
+
+
+def load_resolved(name, serial):
+    """ Driver values cached the last time the profile was applied on this unit, None if never """
+    try:
+        return dict(config('profiles', name, 'resolved', serial))
+    except Exception:
+        return None
+
+
+def store_resolved(name, serial, resolved):
+    """ Cache the driver values of the profile for this unit, the config file is only written when they changed """
+    if resolved is None or load_resolved(name, serial) == resolved: return
+    config['profiles', name, 'resolved', serial] = dict(resolved)
+    config.save()
+
+
+def open_range(controller, name, default=7):
+    """ Range index of a channel of the open unit, the default one when no unit is open (index 0 is a valid range) """
+    value = getattr(controller, name, None)
+    return default if value is None else value
+
+
+def profile_from_settings(settings, controller=None):
+    """ Profile of the current plugin settings, ranges and segments taken from the controller when open """
+    profile = {"aquisition_time": settings.child('aquisition_param', 'aquisition_time').value(),
+               "sampling_freq": settings.child('aquisition_param', 'sampling_freq').value(),
+               "trig_chan": settings.child('aquisition_param', 'trig_chan').value()['selected'][0],
+               "trig_lvl": settings.child('aquisition_param', 'trig_lvl').value(),
+               "n_segments": getattr(controller, 'nSegments', 1),
+               "range_A": open_range(controller, 'chARange'),
+               "range_B": open_range(controller, 'chBRange')}
+    if 'processing_param' in [child.name() for child in settings.children()]:
+        profile["processing_mode"] = settings.child('processing_param', 'processing_mode').value()['selected'][0]
+    return profile
+
+
+def settings_from_profile(settings, profile):
+    """ Show the profile in the plugin settings (the plugins without a processing mode ignore it) """
+    settings.child('aquisition_param', 'aquisition_time').setValue( profile["aquisition_time"] )
+    settings.child('aquisition_param', 'sampling_freq').setValue( profile["sampling_freq"] )
+    settings.child('aquisition_param', 'num_samples').setValue( profile["sampling_freq"]*1e6 * profile["aquisition_time"]*1e-3 * 1e-3 )
+    settings.child('aquisition_param', 'trig_lvl').setValue( profile["trig_lvl"] )
+    trig_chan = settings.child('aquisition_param', 'trig_chan').value()
+    settings.child('aquisition_param', 'trig_chan').setValue( dict(all_items=trig_chan['all_items'], selected=[profile["trig_chan"]]) )
+
+    if "processing_mode" in profile and 'processing_param' in [child.name() for child in settings.children()]:
+        processing_mode = settings.child('processing_param', 'processing_mode').value()
+        settings.child('processing_param', 'processing_mode').setValue( dict(all_items=processing_mode['all_items'], selected=[profile["processing_mode"]]) )
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Memory segment planning of the Picoscope 4000a rapid block captures
+
+@author: dqml-lab
+"""
+import ctypes
+
+from picosdk.ps4000a import ps4000a as ps
+from picosdk.functions import assert_pico_ok
+
+
+class SegmentPlan:
+    """ Rapid block configuration chosen by plan_segments
+
+    Attributes
+    ----------
+    segments: int
+        captures per readout, one memory segment each
+    samples: int
+        samples per capture and per channel
+    segmentSamples: int
+        samples per channel the segments can hold with this segment count
+    maxSegments: int
+        segments the device supports
+    transferBytes: int
+        size of one readout (all segments, all channels)
+    """
+
+    def __init__(self, segments, samples, segmentSamples, maxSegments, channels=2) -> None:
+        self.segments = segments
+        self.samples = samples
+        self.segmentSamples = segmentSamples
+        self.maxSegments = maxSegments
+        self.transferBytes = segments * samples * channels * 2  # int16
+
+    def __repr__(self) -> str:
+        return f"SegmentPlan({self.segments} x {self.samples} samples, {self.transferBytes / 1e3:.1f} kB per readout)"
+
+
+def _segment_samples(handle, segments, channels):
+    """ Split the memory in segments, returns the samples per channel each segment holds """
+    nMaxSamples = ctypes.c_int32(0)
+    assert_pico_ok(ps.ps4000aMemorySegments(handle, segments, ctypes.byref(nMaxSamples)))
+    return nMaxSamples.value // channels  # nMaxSamples is shared by the enabled channels
+
+
+def plan_segments(handle, samples, triggerRate=None, readoutPeriod=None, channels=2):
+    """ Largest number of segments of samples each that the device memory holds
+
+    The count is bounded by ps4000aGetMaxSegments, by the memory (per segment limit returned by
+    ps4000aMemorySegments, which includes the segment overheads) and, when the trigger rate (Hz) is known, by the
+    triggers expected in readoutPeriod (s) : a readout does not wait longer than that for its last segment.
+    The memory is left split in the planned segments.
+
+    Returns
+    -------
+    SegmentPlan
+    """
+    samples = int(samples)
+    maxSegments = ctypes.c_uint32(0)
+    assert_pico_ok(ps.ps4000aGetMaxSegments(handle, ctypes.byref(maxSegments)))
+
+    memory = _segment_samples(handle, 1, channels)
+    if samples > memory: raise ValueError(f"{samples} samples per capture, the memory only holds {memory}")
+
+    segments = min(maxSegments.value, memory // samples)
+    if triggerRate and readoutPeriod: segments = min(segments, max(int(triggerRate * readoutPeriod), 1))
+
+    # The overhead of each segment is only known from the driver, shrink until the captures fit
+    segmentSamples = _segment_samples(handle, segments, channels)
+    while segmentSamples < samples and segments > 1:
+        segments = max(min(segments - 1, segments * segmentSamples // samples), 1)
+        segmentSamples = _segment_samples(handle, segments, channels)
+
+    return SegmentPlan(segments, samples, segmentSamples, maxSegments.value, channels)
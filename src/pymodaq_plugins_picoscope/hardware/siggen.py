@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Built-in signal generator of the Picoscope 4000a units
+
+@author: dqml-lab
+"""
+import numpy as np
+from picosdk.ps4000a import ps4000a as ps
+from picosdk.functions import assert_pico_ok
+
+
+WAVE_TYPES = {"Sine":0, "Square":1, "Triangle":2, "Ramp Up":3, "Ramp Down":4, "Sinc":5, "Gaussian":6, "Half Sine":7, "DC Voltage":8}  # PS4000A_WAVE_TYPE
+SIGGEN_NONE = 0
+SIGGEN_SCOPE_TRIG = 1  # PS4000A_SIGGEN_TRIG_SOURCE
+
+
+class SigGen:
+    """ Built-in waveforms of the generator output, on an open handle (see handle_cache)
+
+    set_builtin sets the waveform, set_frequency only changes its frequency (ps4000aSetSigGenPropertiesBuiltIn, the
+    waveform is not sent again). set_sweep makes the generator step through the frequencies by itself.
+
+    Amplitudes are in mV, frequencies in Hz.
+    """
+
+    def __init__(self, handle) -> None:
+        self.handle = handle
+        self.status = {}
+
+        self.waveType = WAVE_TYPES["Sine"]
+        self.pkToPk = 1000.
+        self.offset = 0.
+        self.frequency = 1000.
+        self.enabled = True
+
+    def set_builtin(self, waveType=None, pkToPk=None, offset=None, frequency=None, enabled=None):
+        """ Output a fixed frequency waveform, None keeps the current value (a disabled output is a 0 mV waveform) """
+        if waveType is not None: self.waveType = int(waveType)
+        if pkToPk is not None: self.pkToPk = pkToPk
+        if offset is not None: self.offset = offset
+        if frequency is not None: self.frequency = frequency
+        if enabled is not None: self.enabled = enabled
+
+        pkToPk_uV = int(self.pkToPk * 1e3) if self.enabled else 0
+        self.status["setSigGenBuiltIn"] = ps.ps4000aSetSigGenBuiltIn(self.handle, int(self.offset * 1e3), pkToPk_uV, self.waveType,
+                                                                     self.frequency, self.frequency, 0, 1, 0, 0, 0, 0, 0, SIGGEN_NONE, 0)
+        assert_pico_ok(self.status["setSigGenBuiltIn"])
+
+    def set_frequency(self, frequency):
+        """ Change the frequency of the current waveform """
+        self.status["setSigGenPropertiesBuiltIn"] = ps.ps4000aSetSigGenPropertiesBuiltIn(self.handle, frequency, frequency, 0, 1, 0, 0, 0, 0, SIGGEN_NONE, 0)
+        assert_pico_ok(self.status["setSigGenPropertiesBuiltIn"])
+        self.frequency = frequency
+
+    def set_sweep(self, startFrequency, stopFrequency, nSteps, dwellTime, triggerSource=SIGGEN_SCOPE_TRIG):
+        """ One up sweep of nSteps frequencies held dwellTime (s) each, started by triggerSource
+
+        Returns the frequencies of the steps.
+        """
+        nSteps = max(int(nSteps), 1)
+        increment = (stopFrequency - startFrequency) / (nSteps - 1) if nSteps > 1 else 0.
+        self.status["setSigGenBuiltIn"] = ps.ps4000aSetSigGenBuiltIn(self.handle, int(self.offset * 1e3), int(self.pkToPk * 1e3), self.waveType,
+                                                                     startFrequency, stopFrequency, increment, dwellTime,
+                                                                     0, 0, 0, 1, 0, triggerSource, 0)   # Up, 1 sweep, rising trigger
+        assert_pico_ok(self.status["setSigGenBuiltIn"])
+        return startFrequency + increment * np.arange(nSteps)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Power spectral density of Picoscope captures, accumulated grab after grab
+
+@author: dqml-lab
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sp_fft
+
+
+WINDOWS = {"Hann": np.hanning,
+           "Hamming": np.hamming,
+           "Blackman": np.blackman,
+           "Bartlett": np.bartlett,
+           "Rectangular": np.ones}
+
+
+class WelchAccumulator:
+    """ Welch PSD of several channels, averaged over all the segments seen since the last reset
+
+    The window and its normalisation are computed once. The FFT length never changes, so scipy reuses its cached FFT
+    plan on every grab, and the FFT runs on all the cores (workers=-1). Segments are read as strided views of the
+    data, only the windowed copy is allocated.
+
+    For streaming, chunks are continuous : the samples left after the last complete segment are kept and the next
+    chunk continues from them, so segments (and their overlap) span chunk boundaries. Block captures are not
+    continuous and start from scratch (continuous=False).
+
+    Parameters
+    ----------
+    nperseg: int
+        samples per segment
+    overlap: float
+        overlap of consecutive segments, fraction of nperseg in [0, 1)
+    window: str
+        one of WINDOWS
+    """
+
+    def __init__(self, nperseg=1024, overlap=0.5, window="Hann") -> None:
+        self.nperseg = int(nperseg)
+        self.step = max(int(round(self.nperseg * (1 - overlap))), 1)
+
+        self.window = WINDOWS[window](self.nperseg).astype(np.float32)
+        self._window_power = float(np.sum(self.window.astype(np.float64) ** 2))
+
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # averaged segments
+        self._sum = None
+        self._tail = None
+
+    def update(self, channels, continuous=True):
+        """ Add all the complete segments of channels, (nChannels, nSamples) in any unit """
+        data = np.asarray(channels)
+        if continuous and self._tail is not None and self._tail.shape[0] == data.shape[0]:
+            data = np.concatenate([self._tail, data], axis=-1)
+
+        nSegments = (data.shape[-1] - self.nperseg) // self.step + 1 if data.shape[-1] >= self.nperseg else 0
+        if nSegments > 0:
+            segments = sliding_window_view(data, self.nperseg, axis=-1)[:, :nSegments * self.step:self.step]
+            # Constant detrend and window, in float32
+            segments = segments - segments.mean(axis=-1, keepdims=True, dtype=np.float32)
+            spectra = sp_fft.rfft(segments * self.window, axis=-1, workers=-1)
+            power = np.sum(spectra.real ** 2 + spectra.imag ** 2, axis=1, dtype=np.float64)
+
+            if self._sum is None or self._sum.shape != power.shape: self._sum = power
+            else: self._sum += power
+            self.count += nSegments
+
+        self._tail = data[:, nSegments * self.step:] if continuous else None
+
+    def psd(self, fs, scales=None):
+        """ One-sided PSD (unit**2 / Hz, times scales**2 per channel) and its frequencies (Hz) """
+        frequencies = np.fft.rfftfreq(self.nperseg, 1 / fs)
+        if self.count == 0: return frequencies, None
+
+        psd = self._sum / (self.count * fs * self._window_power)
+        # One-sided : double everything but DC and Nyquist
+        if self.nperseg % 2 == 0: psd[:, 1:-1] *= 2
+        else: psd[:, 1:] *= 2
+        if scales is not None: psd *= np.asarray(scales)[:, None] ** 2
+
+        return frequencies, psd
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Continuous recording of the Picoscope 4000a streaming to rotating files
+
+@author: dqml-lab
+"""
+import json
+import os
+import queue
+import threading
+import numpy as np
+from pathlib import Path
+from time import perf_counter, sleep, strftime
+
+
+class RotatingWriter:
+    """ Raw int16 samples of channels A and B split in files of fileSamples samples per channel
+
+    Subclasses open, append to and close one file. write takes chunks of any size and rotates at the boundary.
+    metadata (sample interval, mV per count...) is stored with every file.
+    """
+    extension = ''
+
+    def __init__(self, directory, prefix='picoscope', fileSamples=50_000_000, metadata=None) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = f"{prefix}_{strftime('%Y%m%d_%H%M%S')}"
+        self.fileSamples = int(fileSamples)
+        self.metadata = dict(metadata or {})
+
+        self.files = []  # paths of the files written so far
+        self.fileIndex = -1
+        self.fileWritten = 0  # samples per channel in the current file
+        self.isOpen = False
+
+    def write(self, a, b):
+        start = 0
+        while start < len(a):
+            if not self.isOpen or self.fileWritten == self.fileSamples: self._rotate()
+            n = min(len(a) - start, self.fileSamples - self.fileWritten)
+            self._append(a[start:start + n], b[start:start + n])
+            self.fileWritten += n
+            start += n
+
+    def close(self):
+        if self.isOpen: self._close_file()
+        self.isOpen = False
+
+    def _rotate(self):
+        if self.isOpen: self._close_file()
+        self.fileIndex += 1
+        self.fileWritten = 0
+        path = self.directory.joinpath(f"{self.prefix}_{self.fileIndex:04d}.{self.extension}")
+        self._open_file(path)
+        self.files.append(path)
+        self.isOpen = True
+
+    def _open_file(self, path): raise NotImplementedError
+    def _append(self, a, b): raise NotImplementedError
+    def _close_file(self): raise NotImplementedError
+
+
+class MemmapWriter(RotatingWriter):
+    """ .bin files of interleaved A, B int16 samples, shape (samples, 2), written through a memory map
+
+    Each file is allocated at its full size and truncated to the samples written when closed. Its metadata and
+    sample count go in a .json file of the same name, to read it back with np.memmap(..., shape=(samples, 2)).
+    """
+    extension = 'bin'
+
+    def _open_file(self, path):
+        self.path = path
+        self.memmap = np.memmap(path, dtype=np.int16, mode='w+', shape=(self.fileSamples, 2))
+
+    def _append(self, a, b):
+        self.memmap[self.fileWritten:self.fileWritten + len(a), 0] = a
+        self.memmap[self.fileWritten:self.fileWritten + len(a), 1] = b
+
+    def _close_file(self):
+        self.memmap.flush()
+        del self.memmap
+        os.truncate(self.path, self.fileWritten * 2 * np.dtype(np.int16).itemsize)
+        with open(self.path.with_suffix('.json'), 'w') as f:
+            json.dump(dict(self.metadata, samples=self.fileWritten, shape=[self.fileWritten, 2], dtype='int16', channels=['A', 'B']), f, indent=2)
+
+
+class H5Writer(RotatingWriter):
+    """ .h5 files with one enlargeable int16 array per channel (/A and /B), metadata in the root attributes
+
+    The arrays are tagged data_type 'data'. With preview, the min/max preview pyramid of each array (see
+    exporters.preview_pyramid) is written when its file is closed, on the writer thread : the queue of the recorder
+    holds the chunks received meanwhile.
+    """
+    extension = 'h5'
+
+    def __init__(self, directory, prefix='picoscope', fileSamples=50_000_000, metadata=None, preview=True) -> None:
+        super().__init__(directory, prefix, fileSamples, metadata)
+        self.preview = preview
+
+    def _open_file(self, path):
+        import tables
+        self.h5file = tables.open_file(str(path), mode='w', title='Picoscope stream')
+        self.arrays = [self.h5file.create_earray('/', channel, atom=tables.Int16Atom(), shape=(0,), expectedrows=self.fileSamples)
+                       for channel in ['A', 'B']]
+        for array in self.arrays: array.attrs['data_type'] = 'data'
+        for key, value in self.metadata.items(): self.h5file.root._v_attrs[key] = value
+
+    def _append(self, a, b):
+        self.arrays[0].append(a)
+        self.arrays[1].append(b)
+
+    def _close_file(self):
+        self.h5file.root._v_attrs['samples'] = self.fileWritten
+        if self.preview:
+            from ..exporters.preview_pyramid import write_node_pyramid
+            for array in self.arrays: write_node_pyramid(self.h5file, array)
+        self.h5file.close()
+
+
+WRITERS = {'h5': H5Writer, 'raw': MemmapWriter}
+
+
+class StreamRecorder:
+    """ Record the streaming of a Picoscope_Wrapper without any GUI in the loop
+
+    The calling thread (run) only polls the driver with get_streaming_latest and queues the chunks, a writer thread
+    empties the queue into the writer. The queue is bounded to maxBufferedBytes : when the disk does not keep up,
+    new chunks are dropped and counted instead of blocking the polling, which would overrun the driver ring.
+
+    Attributes
+    ----------
+    samples: int
+        samples per channel received from the driver
+    recorded: int
+        samples per channel written
+    droppedSamples: int
+        samples per channel lost because the queue was full
+    highWaterBytes: int
+        largest amount of data waiting for the writer
+    """
+
+    def __init__(self, scope, writer: RotatingWriter, maxBufferedBytes=256e6, pollPeriod=0.005) -> None:
+        self.scope = scope
+        self.writer = writer
+        self.maxBufferedBytes = int(maxBufferedBytes)
+        self.pollPeriod = pollPeriod
+
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writerThread = None
+        self.writerError = None
+
+        self.bufferedBytes = 0
+        self.highWaterBytes = 0
+        self.highWaterChunks = 0
+        self.samples = 0
+        self.recorded = 0
+        self.droppedSamples = 0
+        self.droppedChunks = 0
+        self.startTime = None
+        self.stopTime = None
+
+    def start(self, bufferSize=1_000_000, sampleInterval_ns=None):
+        """ Start the streaming and the writer thread """
+        self._stop.clear()
+        self.writerError = None
+        self._writerThread = threading.Thread(target=self._write_loop, name='picoscope_writer', daemon=True)
+        self._writerThread.start()
+        self.scope.start_streaming(bufferSize, sampleInterval_ns)
+        self.startTime = perf_counter()
+
+    def poll(self):
+        """ Queue what the driver received since the previous call, returns the samples per channel received """
+        a, b = self.scope.get_streaming_latest()
+        n = len(a)
+        if n == 0: return 0
+        self.samples += n
+
+        size = a.nbytes + b.nbytes
+        with self._lock:
+            if self.bufferedBytes + size > self.maxBufferedBytes:
+                self.droppedSamples += n
+                self.droppedChunks += 1
+                return n
+            self.bufferedBytes += size
+            self.highWaterBytes = max(self.highWaterBytes, self.bufferedBytes)
+        self.queue.put((a, b))
+        self.highWaterChunks = max(self.highWaterChunks, self.queue.qsize())
+        return n
+
+    def run(self, duration=None, report=None, reportPeriod=1.):
+        """ Poll until duration (s) is elapsed or stop is called, report(stats) every reportPeriod (s) """
+        lastReport = perf_counter()
+        while not self._stop.is_set():
+            if self.writerError is not None: raise self.writerError
+            if self.poll() == 0: sleep(self.pollPeriod)
+
+            now = perf_counter()
+            if report is not None and now - lastReport >= reportPeriod:
+                lastReport = now
+                report(self.stats())
+            if duration is not None and now - self.startTime >= duration: break
+
+    def stop(self):
+        """ Stop the streaming, write what is queued and close the files. Returns the final stats """
+        self._stop.set()
+        if self.scope.streamingRunning: self.scope.stop_streaming()
+        self.stopTime = perf_counter()
+        if self._writerThread is not None: self._writerThread.join()
+        self._writerThread = None
+        self.writer.close()
+        if self.writerError is not None: raise self.writerError
+        return self.stats()
+
+    def _write_loop(self):
+        try:
+            while True:
+                try:
+                    a, b = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop.is_set(): break
+                    continue
+                self.writer.write(a, b)
+                self.recorded += len(a)
+                with self._lock: self.bufferedBytes -= a.nbytes + b.nbytes
+        except Exception as e:
+            self.writerError = e
+
+    def stats(self):
+        """ Sustained rates (MS/s, both channels), buffer high-water marks and drops since start """
+        elapsed = (self.stopTime or perf_counter()) - self.startTime
+        return dict(elapsed=elapsed,
+                    samples=self.samples,
+                    recorded=self.recorded,
+                    acquiredMSs=2 * self.samples / elapsed / 1e6,
+                    recordedMSs=2 * self.recorded / elapsed / 1e6,
+                    bufferedMB=self.bufferedBytes / 1e6,
+                    highWaterMB=self.highWaterBytes / 1e6,
+                    highWaterChunks=self.highWaterChunks,
+                    droppedSamples=self.droppedSamples,
+                    droppedChunks=self.droppedChunks,
+                    files=len(self.writer.files))
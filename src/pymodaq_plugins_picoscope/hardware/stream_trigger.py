@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Software trigger on the Picoscope streaming, fixed windows around each event
+
+@author: dqml-lab
+"""
+import numpy as np
+
+
+RISING = 0
+FALLING = 1
+
+
+class StreamTrigger:
+    """ Windows of preSamples + postSamples around every level crossing of a continuous stream
+
+    The chunks of the stream are appended to a ring kept twice in one array (sample k at k % capacity and
+    k % capacity + capacity), so any window of the last capacity samples is a contiguous slice : the windows are
+    returned as views of the ring, without copy. A view stays valid until capacity - window more samples are fed,
+    the windows whose samples are overwritten by the rest of the same chunk are copied.
+
+    The crossings are found on a whole chunk at once, the last sample of the previous chunk included so no crossing
+    is missed at the chunk boundaries. There is no re-arm : an event during the window of the previous one gets its
+    own window (unless holdoff says otherwise). Events from another source (the driver trigger of the streaming) can
+    be given to feed as absolute sample indexes.
+
+    Parameters
+    ----------
+    preSamples, postSamples: int
+        samples before and after the crossing (the crossing is the first sample past the level)
+    level: int
+        trigger level, in the units of the stream (int16 ADC counts)
+    channel: int
+        index of the channel the crossings are looked for on
+    direction: int
+        RISING or FALLING
+    holdoff: int
+        minimum samples between two events, 0 to keep them all
+    capacity: int
+        samples per channel of the ring, 16 windows at least
+    nChannels: int
+        channels of the stream
+
+    Attributes
+    ----------
+    events: int
+        events detected
+    emitted: int
+        windows returned by feed
+    missed: int
+        events without a full window, too close to the start of the stream
+    """
+
+    def __init__(self, preSamples, postSamples, level, channel=1, direction=RISING, holdoff=0, capacity=1 << 20, nChannels=2, dtype=np.int16) -> None:
+        self.preSamples = int(preSamples)
+        self.postSamples = int(postSamples)
+        self.window = self.preSamples + self.postSamples
+        self.level = level
+        self.channel = int(channel)
+        self.direction = direction
+        self.holdoff = int(holdoff)
+        self.capacity = max(int(capacity), 16 * self.window)
+
+        self.ring = np.zeros((nChannels, 2 * self.capacity), dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        """ Forget the stream, the next chunk starts at sample 0 """
+        self.total = 0  # samples per channel fed, absolute index of the next one
+        self.pending = np.zeros(0, dtype=np.int64)  # events waiting for their post-trigger samples
+        self.lastEvent = None
+        self.last = None  # last sample of the trigger channel, for the crossings at the chunk boundary
+        self.events = 0
+        self.emitted = 0
+        self.missed = 0
+
+    def _write(self, chunk):
+        """ Append a chunk of at most capacity samples to both copies of the ring """
+        n = chunk.shape[1]
+        p = self.total % self.capacity
+        self.ring[:, p:p + n] = chunk
+        if p + n > self.capacity:
+            self.ring[:, :p + n - self.capacity] = self.ring[:, self.capacity:p + n]  # wrapped part, at the start too
+        first = min(p + n, self.capacity) - p
+        self.ring[:, p + self.capacity:p + self.capacity + first] = chunk[:, :first]  # and the rest, at the end too
+        self.total += n
+
+    def _crossings(self, trace):
+        """ Absolute indexes of the level crossings in trace, the new samples of the trigger channel """
+        previous = np.empty(len(trace), dtype=trace.dtype)
+        previous[1:] = trace[:-1]
+        previous[0] = trace[0] if self.last is None else self.last
+        if self.direction == RISING: crossed = (previous < self.level) & (trace >= self.level)
+        else: crossed = (previous > self.level) & (trace <= self.level)
+        return np.flatnonzero(crossed) + self.total
+
+    def _apply_holdoff(self, events):
+        if self.holdoff <= 0 or len(events) == 0: return events
+        kept = []
+        for event in events:
+            if self.lastEvent is None or event - self.lastEvent >= self.holdoff:
+                kept.append(event)
+                self.lastEvent = event
+        return np.array(kept, dtype=np.int64)
+
+    def feed(self, channels, triggers=()):
+        """ Append the new samples of the stream, returns the windows completed by them
+
+        Parameters
+        ----------
+        channels: list of ndarray
+            new samples of each channel, all of the same length
+        triggers: iterable of int
+            absolute indexes of events found elsewhere (driver trigger), added to the crossings
+
+        Returns
+        -------
+        list of (int, ndarray): absolute index of the event and its window, shape (nChannels, preSamples + postSamples)
+        """
+        chunk = np.asarray(channels)
+        end = self.total + chunk.shape[1]
+        windows = []
+
+        # Pieces short enough for the windows they complete not to be overwritten by the piece itself
+        step = self.capacity - self.window
+        for start in range(0, chunk.shape[1], step):
+            piece = chunk[:, start:start + step]
+            events = self._crossings(piece[self.channel])
+            self.last = piece[self.channel, -1]
+            self._write(piece)
+
+            events = np.concatenate([events, [trigger for trigger in triggers if self.total - piece.shape[1] <= trigger < self.total]]).astype(np.int64)
+            events = self._apply_holdoff(np.sort(events))
+            self.events += len(events)
+
+            tooEarly = events < self.preSamples
+            self.missed += int(np.count_nonzero(tooEarly))
+            self.pending = np.concatenate([self.pending, events[~tooEarly]])
+
+            complete = self.pending + self.postSamples <= self.total
+            for event in self.pending[complete]:
+                first = (event - self.preSamples) % self.capacity
+                window = self.ring[:, first:first + self.window]
+                if end - (event - self.preSamples) > self.capacity: window = window.copy()  # overwritten by the rest of this chunk
+                windows.append((int(event), window))
+            self.pending = self.pending[~complete]
+
+        self.emitted += len(windows)
+        return windows
@@ -0,0 +1,140 @@
+from time import perf_counter
+from typing import List
+
+import numpy as np
+
+from pymodaq.extensions.pid.utils import PIDModelGeneric, main
+from pymodaq.utils.data import DataToExport, DataCalculated, DataToActuators, DataActuator
+
+
+class PIDModelPicoscopeLockin(PIDModelGeneric):
+    """ Stabilise one actuator on the ND_Bd output of the Picoscope lock-in
+
+    The detector is a DAQ_1DViewer_Picoscope_Lockin with its PID Output display enabled, so each grab only emits the
+    ND_Bd scalar. convert_input takes that channel by name, nothing else is converted.
+
+    The loop period (between two inputs) and the detector latency (from the actuator command to the next input) are
+    shown in the model parameters, to set the PID rate from measured numbers. They are refreshed twice a second at
+    most, the loop itself is not slowed down by the display.
+
+    A grab without ND_Bd (no pulse, fewer than two B steps) emits NaN : the previous input is then fed to the PID again
+    (the setpoint if there is none yet) and the skipped inputs are counted.
+    """
+    limits = dict(max=dict(state=False, value=100),
+                  min=dict(state=False, value=-100),)
+    konstants = dict(kp=0.1, ki=0.000, kd=0.0000)
+
+    Nsetpoints = 1  # number of setpoints
+    setpoint_ini = [0.]  # number and values of initial setpoints
+    setpoints_names = ['ND_Bd']  # number and names of setpoints
+
+    actuators_name = ["Actuator"]  # names of actuator's control modules involved in the PID
+    detectors_name = ['Picoscope Lockin']  # names of detector's control modules involved in the PID
+
+    params = [
+        {'title':'Input Channel', 'name':'input_channel', 'type':'str', 'value':'ND_Bd', 'default':'ND_Bd' },
+        {'title':'Loop Period (ms)', 'name':'loop_period', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Mean Loop Period (ms)', 'name':'mean_period', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Max Loop Period (ms)', 'name':'max_period', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Detector Latency (ms)', 'name':'detector_latency', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Mean Loop Rate (Hz)', 'name':'loop_rate', 'type':'float', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Skipped Inputs (NaN)', 'name':'skipped_inputs', 'type':'int', 'value':0, 'default':0, 'readonly':True },
+        {'title':'Reset Latency Statistics', 'name':'reset_latency', 'type':'bool_push', 'value':False, 'default':False },
+    ]
+
+    def __init__(self, pid_controller):
+        super().__init__(pid_controller)
+        self.reset_latency()
+
+    def update_settings(self, param):
+        """
+        Get a parameter instance whose value has been modified by a user on the UI
+        Parameters
+        ----------
+        param: (Parameter) instance of Parameter object
+        """
+        if param.name() == 'reset_latency':
+            self.reset_latency()
+            self.settings.child('skipped_inputs').setValue( 0 )
+
+    def ini_model(self):
+        super().ini_model()
+        self.reset_latency()
+
+    def reset_latency(self):
+        self.last_input_time = None
+        self.last_output_time = None
+        self.last_display_time = 0.
+        self.iterations = 0
+        self.total_period = 0.
+        self.max_period = 0.
+        self.skipped_inputs = 0
+
+    def update_latency(self, now):
+        """ Loop period and detector latency of this iteration, displayed every 0.5 s """
+        if self.last_input_time is not None:
+            period = now - self.last_input_time
+            self.iterations += 1
+            self.total_period += period
+            self.max_period = max(self.max_period, period)
+
+            if now - self.last_display_time > 0.5:
+                self.last_display_time = now
+                mean_period = self.total_period / self.iterations
+                self.settings.child('loop_period').setValue( period * 1e3 )
+                self.settings.child('mean_period').setValue( mean_period * 1e3 )
+                self.settings.child('max_period').setValue( self.max_period * 1e3 )
+                self.settings.child('loop_rate').setValue( 1 / mean_period )
+                if self.last_output_time is not None:
+                    self.settings.child('detector_latency').setValue( (now - self.last_output_time) * 1e3 )
+        self.last_input_time = now
+
+    def convert_input(self, measurements: DataToExport):
+        """
+        Take the lock-in output channel as the PID input
+        Parameters
+        ----------
+        measurements: DataToExport
+            Data from the declared detectors
+
+        Returns
+        -------
+        DataToExport: the ND_Bd value as a 0D DataCalculated
+
+        """
+        self.update_latency(perf_counter())
+
+        dwa = measurements.get_data_from_name(self.settings.child('input_channel').value())
+        value = float(np.asarray(dwa[0]).ravel()[0])
+        if not np.isfinite(value):
+            # Skipped grab : a NaN would stay in the integral term and be sent to the actuator
+            self.skipped_inputs += 1
+            self.settings.child('skipped_inputs').setValue( self.skipped_inputs )
+            value = self.curr_input[0] if self.curr_input is not None else self.pid_controller.setpoints[0]
+        self.curr_input = [value]
+        return DataToExport('inputs', data=[DataCalculated('pid_calculated', data=[np.array([value])])])
+
+    def convert_output(self, outputs: List[float], dt: float, stab=True):
+        """
+        Convert the output of the PID in units to be fed into the actuator
+        Parameters
+        ----------
+        outputs: List of float
+            output value from the PID from which the model extract a value of the same units as the actuator
+        dt: float
+            Ellapsed time since the last call to this function
+        stab: bool
+
+        Returns
+        -------
+        DataToActuators: the relative moves of the actuator
+
+        """
+        self.curr_output = outputs
+        self.last_output_time = perf_counter()
+        return DataToActuators('pid', mode='rel',
+                               data=[DataActuator(self.actuators_name[ind], data=outputs[ind]) for ind in range(len(outputs))])
+
+
+if __name__ == '__main__':
+    main("PicoscopeLockinPID.xml")  # preset with the lock-in detector and the stabilised actuator
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the capture history ring, on synthetic captures
+
+@author: dqml-lab
+"""
+import numpy as np
+
+from pymodaq_plugins_picoscope.hardware.capture_history import CaptureHistory
+
+
+def random_captures(n, nSamples=64, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(-32768, 32767, size=(2, nSamples), dtype=np.int16) for _ in range(n)]
+
+
+def test_history_keeps_the_last_captures():
+    history = CaptureHistory(depth=3, nChannels=2, nSamples=64)
+    captures = random_captures(5)
+    for capture in captures: history.append(capture)
+    last = np.stack(captures[-3:])
+
+    assert history.count == 3
+    np.testing.assert_allclose(history.average(), last.mean(axis=0))
+    minimum, maximum = history.envelope()
+    np.testing.assert_array_equal(minimum, last.min(axis=0))
+    np.testing.assert_array_equal(maximum, last.max(axis=0))
+
+
+def test_history_partially_filled():
+    history = CaptureHistory(depth=4, nChannels=2, nSamples=64)
+    captures = random_captures(2)
+    for capture in captures: history.append(capture)
+    assert history.count == 2
+    np.testing.assert_allclose(history.average(), np.stack(captures).mean(axis=0))
+
+
+def test_incremental_persistence_matches_the_ring():
+    history = CaptureHistory(depth=3, nChannels=2, nSamples=64, nBins=200)
+    assert history.nBins == 256
+    for capture in random_captures(7): history.append(capture)
+
+    # Histogram of the captures in the ring, recomputed from scratch
+    bins = (history.ring.astype(np.int32) + 32768) >> (16 - 8)
+    expected = np.zeros_like(history.persistence)
+    for channel in range(2):
+        for sample in range(64):
+            expected[channel, :, sample] = np.bincount(bins[:, channel, sample], minlength=256)
+    np.testing.assert_array_equal(history.persistence, expected)
+    np.testing.assert_array_equal(history.persistence.sum(axis=1), 3)
+
+
+def test_bin_centers_cover_the_int16_range():
+    centers = CaptureHistory(depth=1, nChannels=1, nSamples=8, nBins=256).bin_centers()
+    assert centers.size == 256
+    assert centers[0] == -32768 + 128
+    assert centers[-1] == 32767 - 127
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the lock-in helpers, on synthetic traces
+
+@author: dqml-lab
+"""
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoscope.hardware.lockin import RunningStatistics, align_segments, pulse_matrix, PulseFinder, fixed_width_nd_bd, pulse_integrals, nd_bd_cycles
+
+
+def test_running_statistics_matches_numpy():
+    values = np.random.default_rng(0).normal(3., 2., 1000)
+    stats = RunningStatistics()
+    for value in values: stats.update(value)
+
+    assert stats.count == values.size
+    assert stats.mean == pytest.approx(np.mean(values))
+    assert stats.variance == pytest.approx(np.var(values, ddof=1))
+    assert stats.standard_error == pytest.approx(np.std(values, ddof=1) / np.sqrt(values.size))
+
+
+def test_running_statistics_needs_two_values():
+    stats = RunningStatistics()
+    stats.update(1.)
+    assert stats.mean == 1.
+    assert np.isnan(stats.variance)
+    assert np.isnan(stats.standard_error)
+
+
+def test_running_statistics_reset():
+    stats = RunningStatistics()
+    for value in [1., 2., 3.]: stats.update(value)
+    stats.reset()
+    assert stats.count == 0
+    stats.update(5.)
+    assert stats.mean == 5.
+
+
+def test_align_segments_fractional_shift_of_a_ramp():
+    segments = np.tile(np.arange(10, dtype=float), (3, 1))
+    shifts = np.array([0., 0.5, 2.25])
+    aligned = align_segments(segments, shifts)
+
+    # A ramp read at k + shift is k + shift, up to the clamped end of the row
+    for row, shift in zip(aligned, shifts):
+        expected = np.minimum(np.arange(10) + shift, 9)
+        np.testing.assert_allclose(row, expected)
+
+
+def test_align_segments_clamps_at_the_edges():
+    segments = np.array([[5., 1., 2., 3., 7.]])
+    np.testing.assert_allclose(align_segments(segments, [-2.])[0], [5., 5., 5., 1., 2.])
+    np.testing.assert_allclose(align_segments(segments, [3.])[0], [3., 7., 7., 7., 7.])
+
+
+def test_align_segments_of_int16_counts():
+    segments = np.array([[-20000, 20000, 20000, -20000]], dtype=np.int16)
+    np.testing.assert_allclose(align_segments(segments, [0.5])[0], [0., 20000., 0., -20000.])
+    np.testing.assert_allclose(align_segments(segments, [0.5]), align_segments(segments.astype(float), [0.5]))
+
+
+def square_train(size=1000, period=100, first_edge=50, high=30, level=1000.):
+    """ Reference channel : level during high samples from every edge, 0 elsewhere """
+    reference = np.zeros(size)
+    for edge in range(first_edge, size, period): reference[edge:edge + high] = level
+    return reference
+
+
+def test_pulse_finder_finds_every_period():
+    finder = PulseFinder(threshold=500., hysteresis=50.)
+    np.testing.assert_array_equal(finder.find_edges(square_train()), np.arange(50, 1000, 100))
+
+    starts, lengths = finder.find_pulses(square_train())
+    np.testing.assert_array_equal(starts, np.arange(0, 1000, 100))
+    np.testing.assert_array_equal(lengths, np.full(10, 100))
+    assert finder.period == pytest.approx(100.)
+
+
+def test_pulse_finder_cached_period_and_raw_counts():
+    finder = PulseFinder(threshold=500., hysteresis=50.)
+    finder.find_pulses(square_train())
+    # Next grab : same train in counts of 0.5 mV, found from the cached period
+    starts, lengths = finder.find_pulses(square_train(level=2000.), scale=0.5)
+    np.testing.assert_array_equal(starts, np.arange(0, 1000, 100))
+    assert finder.period == pytest.approx(100.)
+
+
+def test_pulse_finder_without_pulses():
+    finder = PulseFinder(threshold=500., hysteresis=50.)
+    for reference in [np.zeros(1000), square_train(first_edge=950)]:
+        starts, lengths = finder.find_pulses(reference)
+        assert starts.size == 0 and lengths.size == 0
+    assert finder.period is None
+
+
+def test_pulse_matrix_zero_pads():
+    traces = np.stack([np.arange(20), -np.arange(20)])
+    matrix = pulse_matrix(traces, np.array([0, 5]), np.array([3, 5]))
+    assert matrix.shape == (2, 2, 5)
+    np.testing.assert_array_equal(matrix[0], [[0, 1, 2, 0, 0], [5, 6, 7, 8, 9]])
+    np.testing.assert_array_equal(matrix[1], -matrix[0])
+
+
+def test_pulse_matrix_without_pulses():
+    matrix = pulse_matrix(np.zeros((2, 20)), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    assert matrix.shape == (2, 0, 0)
+
+
+def lockin_trace(number_of_pulses=8, width_of_pulse=10, width_of_B=2, high=3, low=1, dtype=np.int16):
+    """ Channel A and reference B : pulses in the second half of each period, A alternating between high and low
+    every width_of_B pulses """
+    B = np.zeros((number_of_pulses, width_of_pulse), dtype=dtype)
+    B[:, width_of_pulse // 2:] = 100
+    A = np.zeros((number_of_pulses, width_of_pulse), dtype=dtype)
+    steps = (np.arange(number_of_pulses) // width_of_B) % 2 == 0
+    A[:, width_of_pulse // 2:] = np.where(steps, high, low)[:, None]
+    return np.stack([A.reshape(-1), B.reshape(-1)])
+
+
+def test_fixed_width_nd_bd():
+    # ND is 3/100 on the even B steps and 1/100 on the odd ones
+    assert fixed_width_nd_bd(lockin_trace(), number_of_pulses=8, number_of_B=4) == pytest.approx(0.02)
+    assert fixed_width_nd_bd(lockin_trace().astype(float), 8, 4, scales=(2., 1.)) == pytest.approx(0.04)
+
+
+def test_fixed_width_nd_bd_drops_incomplete_steps():
+    # 3 B steps : the last one has no pair, the extra samples of the trace are ignored
+    channels = np.concatenate([lockin_trace(number_of_pulses=6), np.ones((2, 5), dtype=np.int16)], axis=1)
+    assert fixed_width_nd_bd(channels, number_of_pulses=6, number_of_B=3) == pytest.approx(0.02)
+
+
+def test_fixed_width_nd_bd_needs_two_b_steps():
+    for number_of_pulses, number_of_B in [(8, 0), (8, 1), (0, 4), (3, 4)]:
+        with pytest.raises(ValueError):
+            fixed_width_nd_bd(lockin_trace(), number_of_pulses, number_of_B)
+
+
+def test_pulse_integrals_of_padded_pulses():
+    pulses = np.array([[1, 1, 5, 5, 0, 0], [1, 1, 1, 4, 4, 4]])
+    np.testing.assert_array_equal(pulse_integrals(pulses, np.array([4, 6])), [8, 9])
+    np.testing.assert_array_equal(pulse_integrals(pulses[:, :4]), [8, 3])
+
+
+def test_nd_bd_cycles_drops_the_unpaired_step():
+    ND = np.array([3., 3., 1., 1., 5., 5., 2., 2., 9.])
+    np.testing.assert_allclose(nd_bd_cycles(ND, number_of_B=4, width_of_B=2), [2., 3.])
+    np.testing.assert_allclose(nd_bd_cycles(ND, number_of_B=3, width_of_B=3), [-4 / 3])
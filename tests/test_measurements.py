@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the scalar measurements, on synthetic traces
+
+@author: dqml-lab
+"""
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoscope.hardware.measurements import channel_measurements, MEASUREMENTS
+
+
+def test_measurements_of_raw_counts():
+    rng = np.random.default_rng(0)
+    channels = [rng.integers(-32768, 32767, 10000, dtype=np.int16) for _ in range(2)]
+    scales = (0.5, 2.)
+    results = channel_measurements(channels, scales=scales, dt=1e-6, gate=slice(100, 200))
+
+    assert list(results) == MEASUREMENTS
+    for channel, data, scale in zip(range(2), channels, scales):
+        data = data.astype(np.float64)
+        assert results["Mean"][channel] == pytest.approx(data.mean() * scale)
+        assert results["RMS"][channel] == pytest.approx(np.sqrt(np.mean(data ** 2)) * scale)
+        assert results["Peak to Peak"][channel] == pytest.approx(np.ptp(data) * scale)
+        assert results["Min"][channel] == pytest.approx(data.min() * scale)
+        assert results["Max"][channel] == pytest.approx(data.max() * scale)
+        assert results["Gated Integral"][channel] == pytest.approx(data[100:200].sum() * scale * 1e-6)
+
+
+def test_measurements_of_float_traces():
+    t = np.linspace(0, 1, 1000, endpoint=False)
+    results = channel_measurements([np.sin(2 * np.pi * 5 * t), np.full(1000, 3.)])
+    np.testing.assert_allclose(results["Mean"], [0., 3.], atol=1e-12)
+    np.testing.assert_allclose(results["RMS"], [1 / np.sqrt(2), 3.])
+    np.testing.assert_allclose(results["Gated Integral"], [0., 3000.], atol=1e-9)
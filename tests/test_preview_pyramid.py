@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the min/max preview pyramid, on synthetic h5 files
+
+@author: dqml-lab
+"""
+import numpy as np
+import pytest
+
+tables = pytest.importorskip('tables')
+
+from pymodaq_plugins_picoscope.exporters.preview_pyramid import (BLOCK_SAMPLES, PREVIEW_FACTORS, preview_name,
+                                                                 read_preview, write_preview_pyramid)
+
+
+def expected_level(data, factor):
+    """ Interleaved min/max of bins of factor samples, the last one partial """
+    starts = np.arange(0, data.shape[-1], factor)
+    envelope = np.empty(data.shape[:-1] + (2 * starts.size,), dtype=data.dtype)
+    envelope[..., 0::2] = np.minimum.reduceat(data, starts, axis=-1)
+    envelope[..., 1::2] = np.maximum.reduceat(data, starts, axis=-1)
+    return envelope
+
+
+@pytest.fixture
+def h5_file(tmp_path):
+    """ A raw trace longer than one block, a 2D data array and an array that is not data """
+    rng = np.random.default_rng(0)
+    filename = tmp_path.joinpath('traces.h5')
+    with tables.open_file(str(filename), 'w') as h5file:
+        group = h5file.create_group('/', 'Detector000')
+        trace = h5file.create_carray(group, 'Data00', obj=rng.integers(-32768, 32767, BLOCK_SAMPLES + 1000, dtype=np.int16))
+        trace.attrs['data_type'] = 'data'
+        image = h5file.create_carray(group, 'Data01', obj=rng.normal(size=(3, 5000)))
+        image.attrs['data_type'] = 'data'
+        h5file.create_carray(group, 'Axis00', obj=np.arange(5000.))
+    return filename
+
+
+def test_write_preview_pyramid(h5_file):
+    assert write_preview_pyramid(h5_file) == 2
+
+    with tables.open_file(str(h5_file), 'r') as h5file:
+        group = h5file.get_node('/Detector000')
+        for name in ['Data00', 'Data01']:
+            data = group._f_get_child(name).read()
+            for factor in PREVIEW_FACTORS:
+                if data.shape[-1] <= factor:
+                    assert preview_name(name, factor) not in group
+                    continue
+                level = group._f_get_child(preview_name(name, factor))
+                assert level.attrs['decimation'] == factor
+                assert 'data_type' not in level.attrs
+                np.testing.assert_array_equal(level.read(), expected_level(data, factor))
+        assert preview_name('Axis00', PREVIEW_FACTORS[0]) not in group
+
+
+def test_write_preview_pyramid_twice(h5_file):
+    write_preview_pyramid(h5_file)
+    assert write_preview_pyramid(h5_file) == 2  # levels are replaced, not decimated themselves
+
+
+def test_read_preview(h5_file):
+    write_preview_pyramid(h5_file)
+    with tables.open_file(str(h5_file), 'r') as h5file:
+        trace = h5file.get_node('/Detector000/Data00')
+        data = trace.read()
+
+        index, envelope = read_preview(trace, nPoints=500)
+        assert envelope.size >= 500
+        assert envelope.min() == data.min() and envelope.max() == data.max()
+        assert index.size == envelope.size
+
+        # A short range has no level with enough points : raw samples
+        index, envelope = read_preview(trace, 100, 300, nPoints=1000)
+        np.testing.assert_array_equal(index, np.arange(100, 300))
+        np.testing.assert_array_equal(envelope, data[100:300])
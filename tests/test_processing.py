@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the processing queue
+
+@author: dqml-lab
+"""
+import threading
+
+import pytest
+
+from pymodaq_plugins_picoscope.hardware.processing import ProcessingQueue
+
+
+def test_block_returns_every_result_in_order():
+    queue = ProcessingQueue(lambda x: 2 * x, depth=2)
+    try:
+        jobs = [queue.submit(i) for i in range(5)]
+        assert [job.result() for job in jobs] == [0, 2, 4, 6, 8]
+        assert queue.queued == 0
+        assert queue.processed == 5 and queue.dropped == 0
+    finally:
+        queue.shutdown()
+
+
+def test_drop_oldest_keeps_the_latest():
+    started, release = threading.Event(), threading.Event()
+
+    def slow(x):
+        started.set()
+        release.wait()
+        return x
+
+    queue = ProcessingQueue(slow, depth=2, dropOldest=True)
+    try:
+        queue.submit(0)
+        started.wait()
+        for i in range(1, 4): queue.submit(i)  # 0 is running, 1 and 2 are dropped by the next captures
+        last = queue.submit(4)  # and 3 by this one
+        assert queue.dropped == 3
+        release.set()
+        last.result()
+        assert queue.take_latest() == 4
+        assert queue.processed == 2
+    finally:
+        queue.shutdown()
+
+
+def test_take_latest_raises_the_error_of_a_job():
+    def fail(x):
+        raise ValueError(f'bad capture {x}')
+
+    queue = ProcessingQueue(fail, depth=1, dropOldest=True)
+    try:
+        queue.submit(1)
+        with pytest.raises(ValueError):
+            queue.take_latest()
+    finally:
+        queue.shutdown()
+
+
+def test_clear_ignores_the_running_job():
+    started, release = threading.Event(), threading.Event()
+
+    def slow(x):
+        started.set()
+        release.wait()
+        return x
+
+    queue = ProcessingQueue(slow, depth=2)
+    try:
+        queue.submit(1)
+        started.wait()
+        queue.clear()
+        release.set()
+        queue.submit(2)
+        assert queue.take_latest() == 2
+    finally:
+        queue.shutdown()
+
+
+def test_processed_event_is_set_once_the_job_is_done():
+    # take_latest must find the error of a failed job as soon as the event wakes it up
+    def fail(x):
+        raise ValueError(f'bad capture {x}')
+
+    jobs, done_when_set = [], []
+
+    class RecordingEvent(threading.Event):
+        def set(self):
+            done_when_set.append(jobs[-1].done())
+            super().set()
+
+    queue = ProcessingQueue(fail, depth=1, dropOldest=True)
+    queue.processedEvent = RecordingEvent()
+    try:
+        jobs.append(queue.submit(1))
+        with pytest.raises(ValueError):
+            queue.take_latest()
+        assert done_when_set == [True]
+    finally:
+        queue.shutdown()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the profile helpers
+
+@author: dqml-lab
+"""
+from types import SimpleNamespace
+
+from pymodaq_plugins_picoscope.hardware.profiles import open_range
+
+
+def test_open_range_keeps_the_first_range():
+    controller = SimpleNamespace(chARange=0, chBRange=3)
+    assert open_range(controller, 'chARange') == 0
+    assert open_range(controller, 'chBRange') == 3
+
+
+def test_open_range_without_unit():
+    assert open_range(None, 'chARange') == 7
+    assert open_range(SimpleNamespace(chARange=None), 'chARange') == 7
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Welch PSD accumulator, on synthetic signals
+
+@author: dqml-lab
+"""
+import numpy as np
+from scipy import signal
+
+from pymodaq_plugins_picoscope.hardware.spectrum import WelchAccumulator
+
+
+def noisy_sine(nSamples=8192, fs=1e6, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(nSamples) / fs
+    return np.stack([np.sin(2 * np.pi * 50e3 * t) + 0.1 * rng.normal(size=nSamples), rng.normal(size=nSamples)])
+
+
+def test_psd_matches_scipy_welch():
+    fs = 1e6
+    data = noisy_sine(fs=fs)
+    welch = WelchAccumulator(nperseg=256, overlap=0.5, window="Hann")
+    welch.update(data, continuous=False)
+    frequencies, psd = welch.psd(fs)
+
+    expected_frequencies, expected = signal.welch(data, fs, window=np.hanning(256), nperseg=256, noverlap=128, detrend='constant', axis=-1)
+    np.testing.assert_allclose(frequencies, expected_frequencies)
+    np.testing.assert_allclose(psd, expected, rtol=1e-3, atol=1e-12)
+
+
+def test_continuous_chunks_span_the_boundaries():
+    data = noisy_sine()
+    whole = WelchAccumulator(nperseg=256, overlap=0.5)
+    whole.update(data)
+    chunked = WelchAccumulator(nperseg=256, overlap=0.5)
+    for start in range(0, data.shape[-1], 1000): chunked.update(data[:, start:start + 1000])
+
+    assert chunked.count == whole.count
+    np.testing.assert_allclose(chunked.psd(1e6)[1], whole.psd(1e6)[1], rtol=1e-5)
+
+
+def test_scales_and_reset():
+    data = noisy_sine()
+    welch = WelchAccumulator(nperseg=128)
+    welch.update(data)
+    _, psd = welch.psd(1e6)
+    _, scaled = welch.psd(1e6, scales=[2., 0.5])
+    np.testing.assert_allclose(scaled, psd * np.array([[4.], [0.25]]))
+
+    welch.reset()
+    assert welch.count == 0
+    assert welch.psd(1e6)[1] is None
+
+
+def test_short_capture_has_no_segment():
+    welch = WelchAccumulator(nperseg=1024)
+    welch.update(np.zeros((2, 100)), continuous=False)
+    assert welch.count == 0
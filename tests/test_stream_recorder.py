@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the rotating writers and the stream recorder, on synthetic streams
+
+@author: dqml-lab
+"""
+import json
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoscope.hardware.stream_recorder import MemmapWriter, H5Writer, StreamRecorder
+
+
+def chunks(sizes, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.integers(-32768, 32767, n, dtype=np.int16), rng.integers(-32768, 32767, n, dtype=np.int16)) for n in sizes]
+
+
+def test_memmap_writer_rotates(tmp_path):
+    writer = MemmapWriter(tmp_path, fileSamples=1000, metadata={'sample_interval_s': 1e-7})
+    data = chunks([300, 1200, 1000])
+    for a, b in data: writer.write(a, b)
+    writer.close()
+
+    assert [path.suffix for path in writer.files] == ['.bin'] * 3
+    a = np.concatenate([chunk[0] for chunk in data])
+    b = np.concatenate([chunk[1] for chunk in data])
+    start = 0
+    for path in writer.files:
+        with open(path.with_suffix('.json')) as f: info = json.load(f)
+        assert info['sample_interval_s'] == 1e-7
+        samples = info['samples']
+        stored = np.memmap(path, dtype=np.int16, mode='r', shape=(samples, 2))
+        np.testing.assert_array_equal(stored[:, 0], a[start:start + samples])
+        np.testing.assert_array_equal(stored[:, 1], b[start:start + samples])
+        start += samples
+    assert start == a.size
+
+
+def test_h5_writer_rotates(tmp_path):
+    tables = pytest.importorskip('tables')
+    writer = H5Writer(tmp_path, fileSamples=1000, metadata={'scale_A_mV': 0.5})
+    data = chunks([700, 700, 700])
+    for a, b in data: writer.write(a, b)
+    writer.close()
+
+    assert len(writer.files) == 3
+    a = np.concatenate([chunk[0] for chunk in data])
+    start = 0
+    for path in writer.files:
+        with tables.open_file(str(path), 'r') as h5file:
+            samples = h5file.root._v_attrs['samples']
+            assert h5file.root._v_attrs['scale_A_mV'] == 0.5
+            np.testing.assert_array_equal(h5file.root.A.read(), a[start:start + samples])
+            start += samples
+    assert start == a.size
+
+
+class SyntheticStream:
+    """ Source with the streaming interface of Picoscope_Wrapper, giving the prepared chunks one per poll """
+
+    def __init__(self, data) -> None:
+        self.data = list(data)
+        self.streamingRunning = False
+
+    def start_streaming(self, bufferSize, sampleInterval_ns=None):
+        self.streamingRunning = True
+
+    def get_streaming_latest(self):
+        if not self.data: return np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+        return self.data.pop(0)
+
+    def stop_streaming(self):
+        self.streamingRunning = False
+
+
+def test_stream_recorder_writes_everything(tmp_path):
+    data = chunks([500] * 10)
+    writer = MemmapWriter(tmp_path, fileSamples=2000)
+    recorder = StreamRecorder(SyntheticStream(data), writer, pollPeriod=0.001)
+    recorder.start()
+    while recorder.poll(): pass
+    stats = recorder.stop()
+
+    assert stats['samples'] == stats['recorded'] == 5000
+    assert stats['droppedSamples'] == 0
+    assert stats['files'] == 3
+
+
+def test_stream_recorder_drops_when_the_buffer_is_full(tmp_path):
+    data = chunks([500] * 10)
+    recorder = StreamRecorder(SyntheticStream(data), MemmapWriter(tmp_path), maxBufferedBytes=3000)
+    for _ in data: recorder.poll()  # the writer thread is not started, nothing leaves the queue
+    assert recorder.samples == 5000
+    assert recorder.droppedSamples == 5000 - 500 and recorder.droppedChunks == 9
+    assert recorder.highWaterBytes == 2000
+
+
+def test_h5_writer_preview(tmp_path):
+    tables = pytest.importorskip('tables')
+    from pymodaq_plugins_picoscope.exporters.preview_pyramid import read_preview, write_preview_pyramid
+
+    writer = H5Writer(tmp_path, fileSamples=5000)
+    a, b = chunks([5000])[0]
+    writer.write(a, b)
+    writer.close()
+
+    path = writer.files[0]
+    with tables.open_file(str(path), 'r') as h5file:
+        assert h5file.root.A.attrs['data_type'] == 'data'
+        preview = h5file.root.A_preview16.read()
+        assert preview.size == 2 * 313
+        np.testing.assert_array_equal(preview[0::2][:-1], a[:4992].reshape(-1, 16).min(axis=1))
+        np.testing.assert_array_equal(preview[1::2][:-1], a[:4992].reshape(-1, 16).max(axis=1))
+        assert 'A_preview16' in h5file.root and 'B_preview256' in h5file.root and 'A_preview4096' in h5file.root
+        index, envelope = read_preview(h5file.root.B, nPoints=100)
+        assert envelope.size == 2 * 313
+    assert write_preview_pyramid(path) == 2  # the files can be decimated again, the levels are replaced
+
+
+def test_h5_writer_without_preview(tmp_path):
+    tables = pytest.importorskip('tables')
+    writer = H5Writer(tmp_path, fileSamples=5000, preview=False)
+    writer.write(*chunks([5000])[0])
+    writer.close()
+    with tables.open_file(str(writer.files[0]), 'r') as h5file:
+        assert [node.name for node in h5file.list_nodes('/')] == ['A', 'B']
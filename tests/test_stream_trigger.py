@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the software trigger on the streaming, on synthetic streams
+
+@author: dqml-lab
+"""
+import numpy as np
+
+from pymodaq_plugins_picoscope.hardware.stream_trigger import StreamTrigger, RISING, FALLING
+
+
+def pulse_stream(size, edges, width=5, level=1000):
+    """ Channel 0 a ramp (sample index), channel 1 high during width samples from every edge """
+    stream = np.zeros((2, size), dtype=np.int16)
+    stream[0] = np.arange(size) % 32768
+    for edge in edges: stream[1, edge:edge + width] = level
+    return stream
+
+
+def feed_in_chunks(trigger, stream, sizes, triggers=()):
+    windows, start = [], 0
+    for size in sizes:
+        # Copies of the windows : the views are only valid until the ring wraps over them
+        windows += [(event, window.copy()) for event, window in trigger.feed(stream[:, start:start + size], triggers)]
+        start += size
+    return windows
+
+
+def test_windows_around_every_edge_across_chunks():
+    edges = [3, 50, 157, 158 + 40, 400, 777, 1500, 1996]
+    stream = pulse_stream(2000, edges)
+    trigger = StreamTrigger(preSamples=4, postSamples=6, level=500, capacity=0)  # smallest ring, 16 windows
+    windows = feed_in_chunks(trigger, stream, [1, 49, 107, 1, 300, 1000, 542])
+
+    # 3 is too early for its pre-trigger samples, 1996 has no complete window yet
+    assert [event for event, _ in windows] == edges[1:-1]
+    for event, window in windows:
+        np.testing.assert_array_equal(window, stream[:, event - 4:event + 6])
+    assert trigger.events == len(edges) and trigger.missed == 1 and trigger.emitted == len(edges) - 2
+
+
+def test_falling_edges_and_holdoff():
+    stream = pulse_stream(1000, [100, 120, 300, 500])
+    falling = feed_in_chunks(StreamTrigger(2, 2, level=500, direction=FALLING), stream, [1000])
+    assert [event for event, _ in falling] == [105, 125, 305, 505]
+
+    held = feed_in_chunks(StreamTrigger(2, 2, level=500, direction=RISING, holdoff=50), stream, [130, 870])
+    assert [event for event, _ in held] == [100, 300, 500]
+
+
+def test_external_triggers():
+    stream = pulse_stream(1000, [])
+    trigger = StreamTrigger(preSamples=10, postSamples=10, level=500)
+    windows = feed_in_chunks(trigger, stream, [250] * 4, triggers=[120, 600])
+    assert [event for event, _ in windows] == [120, 600]
+    np.testing.assert_array_equal(windows[1][1][0], np.arange(590, 610))
+
+
+def test_reset():
+    stream = pulse_stream(500, [200])
+    trigger = StreamTrigger(5, 5, level=500)
+    assert len(trigger.feed(stream)) == 1
+    trigger.reset()
+    assert trigger.total == 0 and trigger.events == 0
+    assert [event for event, _ in trigger.feed(stream)] == [200]
+
+
+def test_windows_of_a_chunk_larger_than_the_ring():
+    edges = list(range(20, 1980, 97))
+    stream = pulse_stream(2000, edges)
+    windows = StreamTrigger(preSamples=4, postSamples=6, level=500, capacity=0).feed(stream)
+
+    # Returned as is : the windows overwritten by the rest of the chunk are copies
+    assert [event for event, _ in windows] == edges
+    for event, window in windows:
+        np.testing.assert_array_equal(window, stream[:, event - 4:event + 6])